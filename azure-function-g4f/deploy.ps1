@@ -69,6 +69,8 @@ Write-Host "Function App: https://$FUNCTION_APP_NAME.azurewebsites.net"
 Write-Host ""
 Write-Host "Endpoints:"
 Write-Host "  - GET /api/g4f-models - Lista modelos (público)"
+Write-Host "  - GET /api/g4f-models/changes?since=N - Deltas desde a versão N (público)"
+Write-Host "  - GET /api/g4f-providers/{name} - Modelos de um provider (público)"
 Write-Host "  - POST /api/update-g4f - Força atualização (requer function key)"
 Write-Host ""
 Write-Host "Timer: Executa automaticamente todos os dias às 3:00 AM UTC"
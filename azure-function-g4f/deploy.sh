@@ -63,6 +63,8 @@ echo "Function App: https://$FUNCTION_APP_NAME.azurewebsites.net"
 echo ""
 echo "Endpoints:"
 echo "  - GET /api/g4f-models - Lista modelos (público)"
+echo "  - GET /api/g4f-models/changes?since=N - Deltas desde a versão N (público)"
+echo "  - GET /api/g4f-providers/{name} - Modelos de um provider (público)"
 echo "  - POST /api/update-g4f - Força atualização (requer function key)"
 echo ""
 echo "Timer: Executa automaticamente todos os dias às 3:00 AM UTC"
@@ -1,13 +1,31 @@
 import azure.functions as func
+import gzip
+import hashlib
 import logging
 import json
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from pymongo import MongoClient
 
 app = func.FunctionApp()
 logger = logging.getLogger("g4f-cache")
 MONGO_URI = os.environ.get('MONGODB_URI')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '10'))
+MONGO_TIMEOUT_MS = int(os.environ.get('MONGO_TIMEOUT_MS', '5000'))
+# Intervalo mínimo (s) entre consultas ao `updated_at` no Mongo; dentro dele o snapshot local é servido direto
+SNAPSHOT_CHECK_SECONDS = float(os.environ.get('SNAPSHOT_CHECK_SECONDS', '30'))
+MODELS_MAX_AGE = int(os.environ.get('MODELS_MAX_AGE', '300'))
+# Quantas versões de delta ficam guardadas (clientes mais atrasados recebem `reset` e baixam tudo)
+CATALOG_DELTA_RETENTION = int(os.environ.get('CATALOG_DELTA_RETENTION', '90'))
+# Tempo (s) que uma atualização em andamento segura a próxima versão antes de outra poder assumi-la
+CATALOG_CLAIM_SECONDS = int(os.environ.get('CATALOG_CLAIM_SECONDS', '600'))
+
+_mongo_client = None
+_mongo_lock = threading.Lock()
+_snapshot = None
+_snapshot_lock = threading.Lock()
 
 
 def respond(payload, status=200):
@@ -17,6 +35,109 @@ def respond(payload, status=200):
         mimetype="application/json"
     )
 
+def get_mongo():
+    """MongoClient único por worker (o pool de conexões é reaproveitado entre invocações)"""
+    global _mongo_client
+    if _mongo_client is None:
+        with _mongo_lock:
+            if _mongo_client is None:
+                _mongo_client = MongoClient(
+                    MONGO_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_TIMEOUT_MS,
+                )
+    return _mongo_client
+
+def g4f_collection():
+    return get_mongo().get_default_database()['g4f_cache']
+
+class ModelsSnapshot:
+    """Resposta do g4f-models já serializada e comprimida, com ETag derivado do conteúdo"""
+
+    def __init__(self, data):
+        updated_at = data.get('updated_at')
+        self.updated_at = updated_at
+        self.version = data.get('version', 0)
+        self.hash = data.get('hash')
+        self.body = json.dumps({
+            'version': data.get('version'),
+            'hash': data.get('hash'),
+            'models': data.get('models', []),
+            'providers': data.get('providers', []),
+            'updated_at': updated_at.isoformat() if updated_at else None
+        }, default=str, separators=(',', ':')).encode('utf-8')
+        self.gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.etag = '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+        self.checked_at = time.monotonic()
+
+def load_snapshot():
+    """
+    Snapshot em memória, revalidado contra `updated_at` no máximo a cada
+    SNAPSHOT_CHECK_SECONDS. O documento completo só é relido quando mudou.
+    """
+    global _snapshot
+    current = _snapshot
+    if current is not None and time.monotonic() - current.checked_at < SNAPSHOT_CHECK_SECONDS:
+        return current
+    with _snapshot_lock:
+        current = _snapshot
+        if current is not None and time.monotonic() - current.checked_at < SNAPSHOT_CHECK_SECONDS:
+            return current
+        collection = g4f_collection()
+        if current is not None:
+            meta = collection.find_one({'_id': 'g4f_data'}, {'updated_at': 1})
+            if meta and meta.get('updated_at') == current.updated_at:
+                current.checked_at = time.monotonic()
+                return current
+        data = collection.find_one({'_id': 'g4f_data'})
+        # Documento criado só pela reserva de uma atualização ainda não tem versão publicada
+        _snapshot = ModelsSnapshot(data) if data and 'models' in data else None
+        return _snapshot
+
+def invalidate_snapshot():
+    global _snapshot
+    _snapshot = None
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+def _accepts_gzip(header):
+    """Accept-Encoding aceita gzip? Respeita q-values (`gzip;q=0` recusa) e o curinga `*`"""
+    accepted = {}
+    for part in (header or '').lower().split(','):
+        name, _, params = part.partition(';')
+        name = name.strip()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted.get('gzip', accepted.get('x-gzip', accepted.get('*', 0.0))) > 0
+
+def respond_snapshot(req, snapshot):
+    headers = {
+        'ETag': snapshot.etag,
+        'Cache-Control': 'public, max-age=%d' % MODELS_MAX_AGE,
+        'Vary': 'Accept-Encoding',
+    }
+    if _etag_matches(req.headers.get('If-None-Match'), snapshot.etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+    body = snapshot.body
+    if _accepts_gzip(req.headers.get('Accept-Encoding')):
+        body = snapshot.gzip
+        headers['Content-Encoding'] = 'gzip'
+    return func.HttpResponse(body, status_code=200, headers=headers, mimetype="application/json")
+
 def get_g4f_models():
     """Lista todos os modelos e provedores disponíveis no g4f"""
     try:
@@ -87,7 +208,7 @@ def get_g4f_providers():
                         'supports_stream': supports_stream,
                         'supports_gpt4': supports_gpt4,
                         'supports_gpt35': supports_gpt35,
-                        'models': supported_models[:10]  # Limita a 10 modelos
+                        'models': supported_models
                     })
             except Exception as e:
                 logger.warning("Erro ao processar provider %s: %s", provider_name, e)
@@ -100,37 +221,161 @@ def get_g4f_providers():
         logger.error("Erro ao listar provedores g4f: %s", e)
         return []
 
+def content_hash(value):
+    """SHA-256 do JSON canônico (chaves ordenadas), estável entre execuções"""
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def compute_delta(previous, current, key):
+    """Itens adicionados, removidos (só a chave) e alterados entre duas listas, comparados por `key`"""
+    before = {item[key]: content_hash(item) for item in previous}
+    after = {item[key]: item for item in current}
+    return {
+        'added': [item for name, item in after.items() if name not in before],
+        'removed': [name for name in before if name not in after],
+        'changed': [item for name, item in after.items() if name in before and before[name] != content_hash(item)],
+    }
+
+def provider_summary(provider):
+    """Provider sem a lista de modelos (fica em g4f_providers): flags, nº de modelos e hash do conteúdo"""
+    summary = {key: value for key, value in provider.items() if key != 'models'}
+    summary['model_count'] = len(provider.get('models') or [])
+    summary['hash'] = content_hash(provider)
+    return summary
+
+def _delta_size(delta):
+    return sum(len(delta[kind]) for kind in ('added', 'removed', 'changed'))
+
 def save_to_mongodb(models, providers):
-    """Salva os modelos e provedores no MongoDB"""
+    """
+    Salva uma nova versão do catálogo se o conteúdo mudou.
+
+    Layout em `g4f_cache`:
+    - `g4f_data`: versão atual (models, resumo dos providers, version, hash)
+    - `g4f_deltas` (_id = versão): o que mudou em relação à versão anterior
+    - `g4f_providers` (_id = nome): lista completa de modelos de cada provider
+
+    Atualizações concorrentes (timer e /update-g4f) disputam a próxima versão
+    em `g4f_data` (`pending_version`) antes de gravar qualquer delta ou
+    provider: quem perde não deixa efeito colateral. Uma reserva abandonada
+    expira em CATALOG_CLAIM_SECONDS.
+
+    Retorna o resumo da atualização, ou None em caso de erro.
+    """
     if not MONGO_URI:
         logger.error("MONGODB_URI não configurado")
-        return False
+        return None
 
-    client = MongoClient(MONGO_URI)
     try:
-        db = client.get_default_database()
+        db = get_mongo().get_default_database()
         collection = db['g4f_cache']
-        collection.update_one(
-            {'_id': 'g4f_data'},
+        now = datetime.utcnow()
+        digest = content_hash({'models': models, 'providers': providers})
+        current = collection.find_one({'_id': 'g4f_data'}) or {}
+        version = current.get('version') or 0
+
+        if current.get('hash') == digest:
+            # Nada mudou: não reescreve o catálogo (clientes e snapshots continuam válidos)
+            collection.update_one({'_id': 'g4f_data'}, {'$set': {'checked_at': now}})
+            logger.info("Catálogo inalterado (versão %s)", version)
+            return {'version': version, 'hash': digest, 'changed': False}
+
+        new_version = version + 1
+        # Reserva a versão antes de qualquer escrita: só avança quem ainda vê a versão lida
+        # e não há outra atualização em andamento (ou a reserva dela já expirou)
+        collection.update_one({'_id': 'g4f_data'}, {'$setOnInsert': {'version': 0}}, upsert=True)
+        claimed = collection.find_one_and_update(
             {
-                '$set': {
-                    'models': models,
-                    'providers': providers,
-                    'updated_at': datetime.utcnow(),
-                    'model_count': len(models),
-                    'provider_count': len(providers)
-                }
+                '_id': 'g4f_data',
+                'version': {'$in': [0, None]} if not version else version,
+                '$or': [
+                    {'pending_version': None},
+                    {'pending_at': {'$lt': now - timedelta(seconds=CATALOG_CLAIM_SECONDS)}},
+                ],
             },
-            upsert=True
+            {'$set': {'pending_version': new_version, 'pending_hash': digest, 'pending_at': now}}
         )
-
-        logger.info("Salvos %s modelos e %s provedores no MongoDB", len(models), len(providers))
-        return True
+        if claimed is None:
+            logger.warning("Outra atualização do catálogo está em andamento (versão %s); ignorando", new_version)
+            return {'version': version, 'hash': current.get('hash'), 'changed': False, 'conflict': True}
+        try:
+            return _publish_version(db, current, version, new_version, digest, models, providers, now)
+        except Exception:
+            # Libera a reserva para a próxima tentativa não esperar a expiração
+            collection.update_one(
+                {'_id': 'g4f_data', 'pending_hash': digest, 'pending_version': new_version},
+                {'$unset': {'pending_version': '', 'pending_hash': '', 'pending_at': ''}}
+            )
+            raise
     except Exception as e:
         logger.error("Erro ao salvar no MongoDB: %s", e)
-        return False
-    finally:
-        client.close()
+        return None
+
+def _publish_version(db, current, version, new_version, digest, models, providers, now):
+    """Grava delta, providers e por fim o `g4f_data` de uma versão já reservada"""
+    collection = db['g4f_cache']
+    # Em g4f_data (e no /g4f-models) só vai o resumo de cada provider; as listas completas
+    # ficam em g4f_providers, então o download completo não cresce com os modelos de cada um
+    summaries = [provider_summary(provider) for provider in providers]
+    by_name = {provider['name']: provider for provider in providers}
+    model_delta = compute_delta(current.get('models', []), models, 'id')
+    provider_delta = compute_delta(current.get('providers', []), summaries, 'name')
+
+    # Upsert: uma tentativa anterior desta versão que falhou no meio (e liberou a reserva)
+    # pode ter deixado o delta gravado; com a versão reservada só nós escrevemos aqui
+    db['g4f_deltas'].replace_one({'_id': new_version}, {
+        '_id': new_version,
+        'from_version': version,
+        'hash': digest,
+        'created_at': now,
+        'models': model_delta,
+        'providers': {
+            'added': [p['name'] for p in provider_delta['added']],
+            'removed': provider_delta['removed'],
+            'changed': [p['name'] for p in provider_delta['changed']],
+        },
+    }, upsert=True)
+    db['g4f_deltas'].delete_many({'_id': {'$lte': new_version - CATALOG_DELTA_RETENTION}})
+
+    provider_docs = db['g4f_providers']
+    # Documento legado (sem versão ou com listas completas) ainda não tem os providers separados: grava todos
+    legacy = not version or any('hash' not in provider for provider in current.get('providers', []))
+    touched = summaries if legacy else provider_delta['added'] + provider_delta['changed']
+    for summary in touched:
+        provider = by_name[summary['name']]
+        provider_docs.replace_one(
+            {'_id': provider['name']},
+            dict(provider, _id=provider['name'], version=new_version, hash=summary['hash'], updated_at=now),
+            upsert=True
+        )
+    if provider_delta['removed']:
+        provider_docs.delete_many({'_id': {'$in': provider_delta['removed']}})
+
+    # Por último o documento principal: quem lê a versão nova já encontra deltas e providers gravados.
+    # Só publica se a reserva ainda é nossa (não expirou e foi assumida por outra atualização)
+    result = collection.update_one(
+        {'_id': 'g4f_data', 'pending_version': new_version, 'pending_hash': digest},
+        {
+            '$set': {
+                'models': models,
+                'providers': summaries,
+                'version': new_version,
+                'hash': digest,
+                'updated_at': now,
+                'checked_at': now,
+                'model_count': len(models),
+                'provider_count': len(providers)
+            },
+            '$unset': {'pending_version': '', 'pending_hash': '', 'pending_at': ''}
+        }
+    )
+    if result.matched_count == 0:
+        raise RuntimeError("Reserva da versão %s expirou antes da publicação" % new_version)
+
+    invalidate_snapshot()
+    logger.info("Catálogo versão %s: %s modelos e %s provedores (%s mudanças em modelos, %s em provedores)",
+                new_version, len(models), len(providers), _delta_size(model_delta), _delta_size(provider_delta))
+    return {'version': new_version, 'hash': digest, 'changed': True}
 
 # Timer trigger - roda todos os dias às 3:00 AM UTC
 @app.timer_trigger(schedule="0 0 3 * * *", arg_name="timer", run_on_startup=False)
@@ -146,7 +391,7 @@ def update_g4f_models(timer: func.TimerRequest) -> None:
     
     logger.info("Encontrados %s modelos e %s provedores", len(models), len(providers))
     
-    # Salva no MongoDB
+    # Salva no MongoDB (só grava uma nova versão se algo mudou)
     success = save_to_mongodb(models, providers)
     
     if success:
@@ -162,10 +407,10 @@ def manual_update(req: func.HttpRequest) -> func.HttpResponse:
     models = get_g4f_models()
     providers = get_g4f_providers()
     
-    success = save_to_mongodb(models, providers)
+    result = save_to_mongodb(models, providers)
     
-    if success:
-        return respond({'success': True, 'models': len(models), 'providers': len(providers)})
+    if result:
+        return respond({'success': True, 'models': len(models), 'providers': len(providers), **result})
     return respond({'success': False, 'error': 'Failed to save to MongoDB'}, status=500)
 
 # HTTP trigger para listar modelos (público)
@@ -175,18 +420,63 @@ def get_models(req: func.HttpRequest) -> func.HttpResponse:
         return respond({'error': 'Database not configured'}, status=500)
 
     try:
-        client = MongoClient(MONGO_URI)
-        db = client.get_default_database()
-        data = db['g4f_cache'].find_one({'_id': 'g4f_data'})
+        snapshot = load_snapshot()
     except Exception as e:
         return respond({'error': str(e)}, status=500)
-    finally:
-        client.close()
 
-    if data:
-        return respond({
-            'models': data.get('models', []),
-            'providers': data.get('providers', []),
-            'updated_at': data.get('updated_at', '').isoformat() if data.get('updated_at') else None
-        })
+    if snapshot:
+        return respond_snapshot(req, snapshot)
     return respond({'models': [], 'providers': [], 'message': 'No data yet'})
+
+# HTTP trigger para sincronização incremental (público): deltas desde uma versão
+@app.route(route="g4f-models/changes", auth_level=func.AuthLevel.ANONYMOUS)
+def get_model_changes(req: func.HttpRequest) -> func.HttpResponse:
+    if not MONGO_URI:
+        return respond({'error': 'Database not configured'}, status=500)
+    try:
+        since = int(req.params.get('since', '0'))
+    except ValueError:
+        return respond({'error': "'since' deve ser um número de versão"}, status=400)
+    if since < 0:
+        return respond({'error': "'since' não pode ser negativo"}, status=400)
+
+    try:
+        snapshot = load_snapshot()
+        if snapshot is None:
+            # Catálogo ainda não publicado: não há o que sincronizar
+            return respond({'version': 0, 'hash': None, 'deltas': []})
+        version = snapshot.version
+        if since >= version:
+            return respond({'version': version, 'hash': snapshot.hash, 'deltas': []})
+        deltas = list(get_mongo().get_default_database()['g4f_deltas']
+                      .find({'_id': {'$gt': since, '$lte': version}}).sort('_id', 1))
+    except Exception as e:
+        return respond({'error': str(e)}, status=500)
+
+    # Deltas já descartados (ou versão desconhecida): o cliente precisa baixar o catálogo completo
+    if since <= 0 or len(deltas) != version - since:
+        return respond({'version': version, 'hash': snapshot.hash, 'reset': True})
+    for delta in deltas:
+        delta['version'] = delta.pop('_id')
+    return respond({'version': version, 'hash': snapshot.hash, 'deltas': deltas})
+
+# HTTP trigger para a lista completa de modelos de um provider (público)
+@app.route(route="g4f-providers/{name}", auth_level=func.AuthLevel.ANONYMOUS)
+def get_provider(req: func.HttpRequest) -> func.HttpResponse:
+    if not MONGO_URI:
+        return respond({'error': 'Database not configured'}, status=500)
+    name = req.route_params.get('name')
+    try:
+        doc = get_mongo().get_default_database()['g4f_providers'].find_one({'_id': name})
+    except Exception as e:
+        return respond({'error': str(e)}, status=500)
+    if not doc:
+        return respond({'error': f"Provider '{name}' não encontrado"}, status=404)
+
+    etag = '"%s"' % doc['hash'][:32]
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=%d' % MODELS_MAX_AGE}
+    if _etag_matches(req.headers.get('If-None-Match'), etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+    doc.pop('_id')
+    return func.HttpResponse(json.dumps(doc, default=str), status_code=200, headers=headers,
+                             mimetype="application/json")
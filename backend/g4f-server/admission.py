@@ -0,0 +1,266 @@
+"""
+Controle de admissão: limites de concorrência global e por provider, com
+fila de espera limitada e prazo máximo na fila.
+
+Quando a fila está cheia a requisição é recusada na hora (429) e quando o
+prazo de espera estoura ela é recusada com 503; ambos com `Retry-After`.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "64"))
+MAX_QUEUE = int(os.environ.get("MAX_QUEUE", "256"))
+PROVIDER_MAX_CONCURRENCY = int(os.environ.get("PROVIDER_MAX_CONCURRENCY", "8"))
+PROVIDER_MAX_QUEUE = int(os.environ.get("PROVIDER_MAX_QUEUE", "32"))
+# Limites específicos: "PollinationsAI=4,DDG=2"
+PROVIDER_CONCURRENCY_OVERRIDES = os.environ.get("PROVIDER_CONCURRENCY_OVERRIDES", "")
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "10"))
+
+
+def _parse_overrides(raw: str) -> Dict[str, int]:
+    overrides = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            overrides[name.strip().lower()] = int(value.strip())
+    return overrides
+
+
+def _percentile(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada pelo controle de admissão (status HTTP + Retry-After em segundos)"""
+
+    def __init__(self, status_code: int, retry_after: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Gate:
+    """Semáforo FIFO com fila limitada, prazo de espera e estatísticas de espera/serviço"""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.wait_times: Deque[float] = deque(maxlen=500)
+        self.service_times: Deque[float] = deque(maxlen=500)
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for f in self._waiters if not f.done())
+
+    def retry_after(self) -> int:
+        """Estimativa de quando haverá vaga: tempo médio de serviço × fila / limite"""
+        avg = sum(self.service_times) / len(self.service_times) if self.service_times else 1.0
+        return int(min(60, max(1, round(avg * (self.queued + 1) / self.limit))))
+
+    @property
+    def has_room(self) -> bool:
+        return self.in_use < self.limit and not self.queued
+
+    def try_acquire(self) -> bool:
+        """Pega uma vaga livre sem esperar (nem furar a fila)"""
+        if not self.has_room:
+            return False
+        self.in_use += 1
+        self.admitted += 1
+        self.wait_times.append(0.0)
+        return True
+
+    async def acquire(self, timeout: float) -> float:
+        """Aguarda uma vaga; retorna o tempo de espera em segundos"""
+        if self.try_acquire():
+            return 0.0
+
+        if self.queued >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected(429, self.retry_after(), f"Fila cheia para '{self.name}'")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            self._forget(future)
+            self.rejected_timeout += 1
+            raise AdmissionRejected(503, self.retry_after(), f"Tempo de fila esgotado para '{self.name}'")
+        except asyncio.CancelledError:
+            self._forget(future)
+            raise
+
+        waited = time.perf_counter() - started
+        self.admitted += 1
+        self.wait_times.append(waited)
+        return waited
+
+    def _forget(self, future: asyncio.Future):
+        # Se a vaga foi transferida no exato momento do timeout/cancelamento, devolve-a
+        if future.done() and not future.cancelled():
+            self.release()
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.service_times.append(service_time)
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                # Transfere a vaga diretamente para o próximo da fila
+                future.set_result(None)
+                return
+        self.in_use = max(0, self.in_use - 1)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_p50": _percentile(self.wait_times, 50),
+            "wait_p99": _percentile(self.wait_times, 99),
+            "service_p50": _percentile(self.service_times, 50),
+        }
+
+
+class Slot:
+    """Vagas obtidas por uma requisição; `release` é idempotente"""
+
+    def __init__(self, gates: List[Gate], waited: float):
+        self.gates = gates
+        self.waited = waited
+        self.started = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        elapsed = time.perf_counter() - self.started
+        for gate in reversed(self.gates):
+            gate.release(elapsed)
+
+
+class AdmissionController:
+    """Gate global + um gate por provider (criado sob demanda)"""
+
+    def __init__(
+        self,
+        global_limit: int = MAX_CONCURRENT_REQUESTS,
+        global_queue: int = MAX_QUEUE,
+        provider_limit: int = PROVIDER_MAX_CONCURRENCY,
+        provider_queue: int = PROVIDER_MAX_QUEUE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+        overrides: Optional[Dict[str, int]] = None,
+    ):
+        self.global_gate = Gate("global", global_limit, global_queue)
+        self.provider_limit = provider_limit
+        self.provider_queue = provider_queue
+        self.queue_timeout = queue_timeout
+        self.overrides = overrides if overrides is not None else _parse_overrides(PROVIDER_CONCURRENCY_OVERRIDES)
+        self._gates: Dict[str, Gate] = {}
+
+    def gate(self, provider_name: str) -> Gate:
+        gate = self._gates.get(provider_name)
+        if gate is None:
+            limit = self.overrides.get(provider_name.lower(), self.provider_limit)
+            gate = self._gates[provider_name] = Gate(provider_name, limit, self.provider_queue)
+        return gate
+
+    async def admit(self, provider_name: Optional[str]) -> Slot:
+        """Reserva vaga global e do provider dentro de um único prazo de fila"""
+        deadline = time.perf_counter() + self.queue_timeout
+        waited = await self.global_gate.acquire(self.queue_timeout)
+        provider_gate = self.gate(provider_name or "auto")
+        try:
+            waited += await provider_gate.acquire(deadline - time.perf_counter())
+        except BaseException:
+            self.global_gate.release()
+            raise
+        return Slot([self.global_gate, provider_gate], waited)
+
+    def has_room(self, provider_name: str) -> bool:
+        return self.gate(provider_name).has_room
+
+    def reserve_provider(self, provider_name: str) -> Slot:
+        """
+        Vaga só do provider, sem esperar: tentativas extras (fallback, hedge) de
+        uma requisição que já tem a vaga global. Provider cheio → 429 na hora.
+        """
+        gate = self.gate(provider_name)
+        if not gate.try_acquire():
+            gate.rejected_full += 1
+            raise AdmissionRejected(429, gate.retry_after(), f"Provider '{provider_name}' sem vaga")
+        return Slot([gate], 0.0)
+
+    def gates(self) -> List[Tuple[str, Gate]]:
+        """Gates por provider já criados, ordenados por nome"""
+        return sorted(self._gates.items())
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "queue_timeout": self.queue_timeout,
+            "global": self.global_gate.snapshot(),
+            "providers": {name: gate.snapshot() for name, gate in self.gates()},
+        }
+
+
+class SlotGuard:
+    """
+    Repassa o iterador de origem e libera a vaga quando ele termina, falha ou é
+    fechado. Ao contrário de um gerador com `finally`, `aclose()` libera a vaga
+    mesmo que o iterador nunca tenha começado (cliente saiu antes do stream).
+    """
+
+    def __init__(self, source: AsyncIterator[str], slot: Optional[Slot]):
+        self._source = source
+        self._iterator: Optional[AsyncIterator[str]] = None
+        self.slot = slot
+
+    def __aiter__(self) -> "SlotGuard":
+        return self
+
+    async def __anext__(self) -> str:
+        if self._iterator is None:
+            self._iterator = self._source.__aiter__()
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        try:
+            aclose = getattr(self._source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+
+
+def release_after(source: AsyncIterator[str], slot: Optional[Slot]) -> SlotGuard:
+    """Repassa o iterador de origem e libera a vaga quando ele termina (ou é fechado)"""
+    return SlotGuard(source, slot)
@@ -0,0 +1,337 @@
+"""
+Benchmark do servidor.
+
+Sobe o servidor com FAKE_PROVIDER=only (sem rede, latência controlada pelo
+perfil do provider falso) ou mede um servidor já rodando (--url), e dispara
+os cenários chat, stream, models e providers em cada nível de concorrência.
+
+Reporta vazão (req/s), latência p50/p99, TTFT p50/p99 (stream) e memória
+por stream (pico de RSS do servidor acima da linha de base, dividido pela
+concorrência). Os resultados vão para benchmarks/results/<data>-<commit>.json
+e são comparados com a execução anterior para evidenciar regressões.
+
+Uso:
+    python benchmark.py --concurrency 1,8,32 --requests 200
+    python benchmark.py --url http://localhost:8000 --pid 1234 --scenarios models,providers
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "benchmarks", "results")
+SCENARIOS = ("chat", "stream", "models", "providers")
+# Métricas em que subir é piorar (as demais, como rps, é o contrário)
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "ttft_p50_ms", "ttft_p99_ms", "mem_per_stream_kb", "error_rate")
+
+
+# ============ SERVIDOR ============
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_kb(pid: Optional[int]) -> Optional[int]:
+    """VmRSS do processo em KB (Linux); None se indisponível"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", "r") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def _wait_ready(session: aiohttp.ClientSession, url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{url}/ready") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Servidor não ficou pronto em {timeout:g}s")
+
+
+def _spawn_server(port: int, profile: str, tokens: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "FAKE_PROVIDER": "only",
+        "FAKE_PROVIDERS": profile,
+        "FAKE_RESPONSE_TOKENS": str(tokens),
+        "WORKERS": "1",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+# ============ CENÁRIOS ============
+
+def _chat_body(stream: bool) -> Dict[str, object]:
+    # Conteúdo único e cache desligado: mede o caminho completo, não o cache de respostas
+    return {
+        "model": "auto",
+        "messages": [{"role": "user", "content": f"benchmark {uuid.uuid4().hex}"}],
+        "stream": stream,
+        "cache": False,
+    }
+
+
+async def _request(session: aiohttp.ClientSession, url: str, scenario: str) -> Dict[str, Optional[float]]:
+    started = time.perf_counter()
+    ttft = None
+    if scenario in ("chat", "stream"):
+        stream = scenario == "stream"
+        async with session.post(f"{url}/v1/chat/completions", json=_chat_body(stream)) as resp:
+            ok = resp.status == 200
+            if stream and ok:
+                async for line in resp.content:
+                    if ttft is None and line.startswith(b"data: {") and b'"content"' in line:
+                        ttft = time.perf_counter() - started
+                    if b'"error"' in line:
+                        ok = False
+            else:
+                await resp.read()
+    else:
+        async with session.get(f"{url}/v1/{scenario}") as resp:
+            ok = resp.status == 200
+            await resp.read()
+    return {"ok": ok, "latency": time.perf_counter() - started, "ttft": ttft}
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+async def run_scenario(session: aiohttp.ClientSession, url: str, scenario: str, concurrency: int,
+                       total: int, pid: Optional[int]) -> Dict[str, object]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    results: List[Dict[str, Optional[float]]] = []
+
+    async def worker():
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results.append(await _request(session, url, scenario))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                results.append({"ok": False, "latency": None, "ttft": None})
+
+    baseline = _rss_kb(pid)
+    peak = baseline
+    done = asyncio.Event()
+
+    async def sample_memory():
+        nonlocal peak
+        while not done.is_set():
+            rss = _rss_kb(pid)
+            if rss is not None and (peak is None or rss > peak):
+                peak = rss
+            await asyncio.sleep(0.02)
+
+    sampler = asyncio.create_task(sample_memory())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler
+
+    latencies = [r["latency"] for r in results if r["ok"]]
+    ttfts = [r["ttft"] for r in results if r["ok"] and r["ttft"] is not None]
+    errors = sum(1 for r in results if not r["ok"])
+    row: Dict[str, object] = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": _ms(_percentile(latencies, 50)),
+        "p99_ms": _ms(_percentile(latencies, 99)),
+    }
+    if scenario == "stream":
+        row["ttft_p50_ms"] = _ms(_percentile(ttfts, 50))
+        row["ttft_p99_ms"] = _ms(_percentile(ttfts, 99))
+        if baseline is not None and peak is not None:
+            row["mem_per_stream_kb"] = round(max(0, peak - baseline) / concurrency, 1)
+    return row
+
+
+# ============ RESULTADOS ============
+
+def _key(row: Dict[str, object]) -> str:
+    return f"{row['scenario']}@{row['concurrency']}"
+
+
+def _previous_results(current: Dict[str, object]) -> Optional[Dict[str, object]]:
+    """Última execução salva com a mesma configuração (alvo, perfil, tokens, requisições)"""
+    same = ("target", "profile", "response_tokens", "requests_per_level")
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), reverse=True):
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                previous = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        if all(previous.get(field) == current.get(field) for field in same):
+            return previous
+    return None
+
+
+def compare(current: List[Dict[str, object]], previous: List[Dict[str, object]], threshold: float) -> List[str]:
+    """Métricas que pioraram mais que `threshold` (fração) em relação à execução anterior"""
+    before = {_key(row): row for row in previous}
+    regressions = []
+    for row in current:
+        old = before.get(_key(row))
+        if not old:
+            continue
+        for metric in LOWER_IS_BETTER + ("rps",):
+            new_value, old_value = row.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            if metric == "error_rate":
+                worse = new_value - old_value > threshold
+            elif not old_value:
+                continue
+            elif metric == "rps":
+                worse = (old_value - new_value) / old_value > threshold
+            else:
+                worse = (new_value - old_value) / old_value > threshold
+            if worse:
+                regressions.append(f"{_key(row)} {metric}: {old_value} → {new_value}")
+    return regressions
+
+
+def print_table(rows: List[Dict[str, object]]):
+    columns = ("scenario", "concurrency", "rps", "p50_ms", "p99_ms", "ttft_p50_ms", "ttft_p99_ms",
+               "mem_per_stream_kb", "errors")
+    print("  ".join(f"{name:>17}" for name in columns))
+    for row in rows:
+        print("  ".join(f"{str(row.get(name, '-') if row.get(name) is not None else '-'):>17}" for name in columns))
+
+
+# ============ MAIN ============
+
+async def main(args) -> int:
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Cenários desconhecidos: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    server = None
+    url, pid = args.url, args.pid
+    if not url:
+        port = _free_port()
+        server = _spawn_server(port, args.profile, args.tokens)
+        url, pid = f"http://127.0.0.1:{port}", server.pid
+
+    rows: List[Dict[str, object]] = []
+    try:
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        connector = aiohttp.TCPConnector(limit=0)
+        url = url.rstrip("/")
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await _wait_ready(session, url)
+            for scenario in scenarios:
+                # Aquece conexões e caminhos antes de medir
+                await run_scenario(session, url, scenario, 1, min(3, args.requests), None)
+                for level in levels:
+                    row = await run_scenario(session, url, scenario, level, args.requests, pid)
+                    rows.append(row)
+                    print(f"[bench] {_key(row)}: {row['rps']} req/s, p50={row['p50_ms']}ms, "
+                          f"p99={row['p99_ms']}ms, erros={row['errors']}", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print_table(rows)
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": _git_rev(),
+        "target": args.url or "fake",
+        "profile": None if args.url else args.profile,
+        "response_tokens": None if args.url else args.tokens,
+        "requests_per_level": args.requests,
+        "results": rows,
+    }
+    regressions: List[str] = []
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        path = os.path.join(RESULTS_DIR, f"{stamp}-{result['git_rev']}.json")
+        previous = _previous_results(result)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2, ensure_ascii=False)
+        print(f"\nResultados salvos em {os.path.relpath(path, HERE)}")
+        if previous:
+            regressions = compare(rows, previous.get("results", []), args.threshold)
+            print(f"Comparado com {previous.get('git_rev')} ({previous.get('timestamp')}): "
+                  f"{len(regressions)} regressão(ões) acima de {args.threshold:.0%}")
+            for line in regressions:
+                print(f"  - {line}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do GPT4Free API Server")
+    parser.add_argument("--url", help="Servidor já rodando (padrão: sobe um com FAKE_PROVIDER=only)")
+    parser.add_argument("--pid", type=int, help="PID do servidor em --url (para medir memória)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="Requisições por nível de concorrência")
+    parser.add_argument("--profile", default=os.environ.get("FAKE_PROVIDERS", "FakeProvider=0.1/200/0"),
+                        help="Perfis do provider falso (nome=latência/tokens_por_s/taxa_de_falha)")
+    parser.add_argument("--tokens", type=int, default=int(os.environ.get("FAKE_RESPONSE_TOKENS", "64")))
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--threshold", type=float, default=0.1, help="Piora relativa que conta como regressão")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,189 @@
+"""
+Circuit breakers por provider.
+
+Cada provider tem uma janela das últimas chamadas. O circuito abre quando a
+taxa de erro ou de chamadas lentas passa do limite; aberto, o provider é
+pulado na hora. Depois de BREAKER_OPEN_SECONDS o circuito fica meio-aberto e
+deixa passar poucas chamadas de teste: sucesso fecha, falha reabre (com o
+tempo de abertura dobrando até BREAKER_MAX_OPEN_SECONDS).
+
+Toda chamada reservada com `acquire` termina em `record` (resultado) ou em
+`release` (cancelada, sem resultado). Uma chamada de teste que não volta em
+BREAKER_PROBE_TIMEOUT segundos deixa de contar, para o provider não ficar
+preso no meio-aberto.
+"""
+
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+BREAKER_ENABLED = os.environ.get("BREAKER_ENABLED", "1").lower() not in ("0", "false", "no")
+BREAKER_WINDOW = int(os.environ.get("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+# Chamada lenta: latência (TTFT em streams) acima de BREAKER_SLOW_SECONDS
+BREAKER_SLOW_SECONDS = float(os.environ.get("BREAKER_SLOW_SECONDS", "30"))
+BREAKER_SLOW_RATE = float(os.environ.get("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_MAX_OPEN_SECONDS = float(os.environ.get("BREAKER_MAX_OPEN_SECONDS", "300"))
+BREAKER_HALF_OPEN_CALLS = int(os.environ.get("BREAKER_HALF_OPEN_CALLS", "1"))
+# Chamadas de teste sem resultado depois disso liberam a vaga
+BREAKER_PROBE_TIMEOUT = float(os.environ.get("BREAKER_PROBE_TIMEOUT", "120"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _provider_name(provider) -> str:
+    return provider if isinstance(provider, str) else getattr(provider, "__name__", str(provider))
+
+
+class CircuitOpenError(Exception):
+    """Provider com circuito aberto (status HTTP + Retry-After em segundos)"""
+
+    def __init__(self, provider_name: str, retry_after: int):
+        super().__init__(f"Provider '{provider_name}' temporariamente indisponível (circuito aberto)")
+        self.status_code = 503
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        # Por chamada: (sucesso, lenta)
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=BREAKER_WINDOW)
+        self.opened_at = 0.0
+        self.open_for = BREAKER_OPEN_SECONDS
+        # Início de cada chamada de teste em andamento (meio-aberto)
+        self._probes: Deque[float] = deque()
+        self.trips = 0
+
+    @property
+    def probes(self) -> int:
+        return len(self._probes)
+
+    def _refresh(self, now: float):
+        if self.state == OPEN and now - self.opened_at >= self.open_for:
+            self.state = HALF_OPEN
+            self._probes.clear()
+        while self._probes and now - self._probes[0] >= BREAKER_PROBE_TIMEOUT:
+            self._probes.popleft()
+
+    def available(self) -> bool:
+        """Pode receber tráfego agora? (não consome vaga de teste)"""
+        self._refresh(time.monotonic())
+        if self.state == OPEN:
+            return False
+        return self.state == CLOSED or self.probes < BREAKER_HALF_OPEN_CALLS
+
+    def acquire(self) -> bool:
+        """Reserva uma chamada; no estado meio-aberto limita as chamadas de teste simultâneas"""
+        if not self.available():
+            return False
+        if self.state == HALF_OPEN:
+            self._probes.append(time.monotonic())
+        return True
+
+    def release(self):
+        """Devolve uma chamada reservada que terminou sem resultado (cancelada, perdedora do hedge)"""
+        if self.state == HALF_OPEN and self._probes:
+            self._probes.popleft()
+
+    def retry_after(self) -> int:
+        if self.state != OPEN:
+            return 1
+        return max(1, int(self.open_for - (time.monotonic() - self.opened_at)) + 1)
+
+    def record(self, ok: bool, latency: Optional[float] = None):
+        now = time.monotonic()
+        self._refresh(now)
+        slow = latency is not None and latency > BREAKER_SLOW_SECONDS
+        if self.state == HALF_OPEN:
+            if self._probes:
+                self._probes.popleft()
+            if ok and not slow:
+                self.state = CLOSED
+                self.open_for = BREAKER_OPEN_SECONDS
+                self._calls.clear()
+            else:
+                self._trip(now, backoff=True)
+            return
+        if self.state == OPEN:
+            # Resultado tardio de uma chamada iniciada antes de abrir
+            return
+
+        self._calls.append((ok, slow))
+        if len(self._calls) < BREAKER_MIN_CALLS:
+            return
+        errors = sum(1 for success, _ in self._calls if not success)
+        slow_calls = sum(1 for _, was_slow in self._calls if was_slow)
+        if errors / len(self._calls) >= BREAKER_ERROR_RATE or slow_calls / len(self._calls) >= BREAKER_SLOW_RATE:
+            self._trip(now, backoff=False)
+
+    def _trip(self, now: float, backoff: bool):
+        if backoff:
+            self.open_for = min(BREAKER_MAX_OPEN_SECONDS, self.open_for * 2)
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._probes.clear()
+        self._calls.clear()
+
+    def snapshot(self) -> Dict[str, object]:
+        self._refresh(time.monotonic())
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "errors": sum(1 for ok, _ in self._calls if not ok),
+            "slow": sum(1 for _, slow in self._calls if slow),
+            "trips": self.trips,
+            "probes": self.probes,
+            "retry_after": self.retry_after() if self.state == OPEN else None,
+        }
+
+
+class BreakerRegistry:
+    """Um circuit breaker por provider (criado sob demanda)"""
+
+    def __init__(self, enabled: bool = BREAKER_ENABLED):
+        self.enabled = enabled
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, provider) -> CircuitBreaker:
+        name = _provider_name(provider)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def available(self, provider) -> bool:
+        return not self.enabled or not provider or self.get(provider).available()
+
+    def acquire(self, provider) -> bool:
+        return not self.enabled or not provider or self.get(provider).acquire()
+
+    def release(self, provider):
+        if self.enabled and provider:
+            self.get(provider).release()
+
+    def check(self, provider):
+        """Levanta CircuitOpenError se o provider estiver com o circuito aberto"""
+        if not self.available(provider):
+            breaker = self.get(provider)
+            raise CircuitOpenError(breaker.name, breaker.retry_after())
+
+    def filter(self, providers: Iterable) -> List:
+        return [p for p in providers if self.available(p)]
+
+    def record(self, provider, ok: bool, latency: Optional[float] = None):
+        if self.enabled and provider:
+            self.get(provider).record(ok, latency)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "providers": {name: breaker.snapshot() for name, breaker in sorted(self._breakers.items())},
+        }
@@ -0,0 +1,351 @@
+"""
+Índice pré-computado de providers e modelos do g4f.
+
+Construído uma vez e reconstruído periodicamente; a troca é atômica (só a
+referência do índice corrente muda), então os endpoints leem sempre uma
+versão consistente sem percorrer `__providers__` a cada requisição.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from encoded import EncodedBody
+
+logger = logging.getLogger("g4f-server")
+
+
+def provider_models(provider) -> List[str]:
+    """Lista de modelos declarados por um provider (lista ou chaves do dict)"""
+    if hasattr(provider, "models") and provider.models:
+        if isinstance(provider.models, list):
+            return [str(m) for m in provider.models if m]
+        if isinstance(provider.models, dict):
+            return list(provider.models.keys())
+    return []
+
+
+class ProviderRecord:
+    """Capacidades de um provider, lidas uma única vez na construção do índice"""
+
+    __slots__ = ("name", "provider", "working", "needs_auth", "supports_stream",
+                 "supports_message_history", "url", "models", "raw_models", "public")
+
+    def __init__(self, provider, data: Optional[Dict[str, object]] = None):
+        self.name = provider.__name__
+        self.provider = provider
+        if data is not None:
+            # Capacidades já lidas por outro processo (snapshot compartilhado)
+            self.working = data["working"]
+            self.needs_auth = data["needs_auth"]
+            self.supports_stream = data["supports_stream"]
+            self.supports_message_history = data["supports_message_history"]
+            self.url = data["url"]
+            self.models = data["models"]
+            self.raw_models = data["raw_models"]
+        else:
+            self.working = bool(getattr(provider, "working", False))
+            self.needs_auth = bool(getattr(provider, "needs_auth", False))
+            self.supports_stream = getattr(provider, "supports_stream", True)
+            self.supports_message_history = getattr(provider, "supports_message_history", True)
+            self.url = getattr(provider, "url", None)
+            self.models = provider_models(provider)
+            self.raw_models = getattr(provider, "models", []) if hasattr(provider, "models") else []
+        self.public = self.working and not self.needs_auth
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "working": self.working,
+            "needs_auth": self.needs_auth,
+            "supports_stream": self.supports_stream,
+            "supports_message_history": self.supports_message_history,
+            "url": self.url,
+            "models": self.models,
+            "raw_models": self.raw_models,
+        }
+
+    def info(self) -> Dict[str, object]:
+        return {
+            "id": self.name,
+            "working": self.working,
+            "needs_auth": self.needs_auth,
+            "supports_stream": self.supports_stream,
+            "supports_message_history": self.supports_message_history,
+            "url": self.url,
+            "models": self.raw_models,
+        }
+
+
+class CatalogIndex:
+    """Snapshot imutável do catálogo: nome→provider, modelo→providers e payloads de listagem"""
+
+    def __init__(self, providers, model_lookup: Callable[[str], object], version: int = 1,
+                 snapshot: Optional[Dict[str, object]] = None):
+        """
+        Com `snapshot` (gerado por `to_snapshot` em outro processo) as capacidades,
+        os modelos conhecidos e os payloads vêm prontos: só os nomes são
+        resolvidos para as classes de provider deste processo.
+        """
+        self.version = snapshot["version"] if snapshot else version
+        self.built_at = snapshot["built_at"] if snapshot else time.time()
+        self._model_lookup = model_lookup
+        self._known: Dict[str, bool] = dict(snapshot["known"]) if snapshot else {}
+        shared = snapshot["providers"] if snapshot else {}
+
+        self.records: Dict[str, ProviderRecord] = {}
+        self.by_name: Dict[str, object] = {}
+        self.public: List[ProviderRecord] = []
+        self.model_providers: Dict[str, List[object]] = {}
+
+        for provider in providers:
+            if snapshot and provider.__name__ not in shared:
+                continue
+            try:
+                record = ProviderRecord(provider, shared.get(provider.__name__))
+            except Exception:
+                continue
+            self.records[record.name] = record
+            self.by_name.setdefault(record.name.lower(), provider)
+            if record.public:
+                self.public.append(record)
+                for model in record.models:
+                    bucket = self.model_providers.setdefault(model, [])
+                    if provider not in bucket:
+                        bucket.append(provider)
+
+        self.auto_candidates = [r.provider for r in self.public if r.url]
+        if snapshot:
+            # Listagens já codificadas pelo líder, servidas direto do arquivo mapeado;
+            # os objetos só são decodificados se alguém pedir (ex.: ordenação por sonda)
+            self._payloads: Dict[str, object] = {}
+            self.encoded: Dict[str, EncodedBody] = dict(snapshot["bodies"])
+        else:
+            self._payloads = {
+                "models": self._build_models(),
+                "all_models": self._build_all_models(),
+                "providers": self._build_providers(),
+            }
+            # Listagens já serializadas e comprimidas (uma vez por versão do índice)
+            self.encoded = {name: EncodedBody(payload) for name, payload in self._payloads.items()}
+        self._encoded_providers: Dict[str, EncodedBody] = {}
+
+    def payload(self, name: str) -> Dict[str, object]:
+        payload = self._payloads.get(name)
+        if payload is None:
+            payload = self._payloads[name] = json.loads(bytes(self.encoded[name].identity))
+        return payload
+
+    @property
+    def models_payload(self) -> Dict[str, object]:
+        return self.payload("models")
+
+    @property
+    def all_models_payload(self) -> Dict[str, object]:
+        return self.payload("all_models")
+
+    @property
+    def providers_payload(self) -> Dict[str, object]:
+        return self.payload("providers")
+
+    def to_snapshot(self) -> Dict[str, object]:
+        """Índice de roteamento serializável; as listagens vão codificadas à parte (`encoded`)"""
+        return {
+            "version": self.version,
+            "built_at": self.built_at,
+            "known": self._known,
+            "providers": {name: record.to_dict() for name, record in self.records.items()},
+        }
+
+    def is_known_model(self, model: str) -> bool:
+        """Equivale a `ModelUtils.get_model(model) is not None`, memoizado por versão do índice"""
+        known = self._known.get(model)
+        if known is None:
+            try:
+                known = self._model_lookup(model) is not None
+            except Exception:
+                known = False
+            self._known[model] = known
+        return known
+
+    def find_provider(self, name: Optional[str]):
+        if not name:
+            return None
+        return self.by_name.get(name.lower())
+
+    def candidates(self, model: Optional[str]) -> List[object]:
+        """Providers públicos aptos a atender o modelo (ou qualquer um com url no modo auto)"""
+        if model is None:
+            return self.auto_candidates
+        return self.model_providers.get(model, [])
+
+    def provider_info(self, name: str) -> Optional[Dict[str, object]]:
+        provider = self.find_provider(name)
+        if provider is None:
+            return None
+        return self.records[provider.__name__].info()
+
+    def encoded_provider(self, name: str) -> Optional[EncodedBody]:
+        """`provider_info` pré-codificado, materializado no primeiro acesso"""
+        provider = self.find_provider(name)
+        if provider is None:
+            return None
+        body = self._encoded_providers.get(provider.__name__)
+        if body is None:
+            body = self._encoded_providers[provider.__name__] = EncodedBody(self.records[provider.__name__].info())
+        return body
+
+    def _build_models(self) -> Dict[str, object]:
+        seen_models: Dict[str, Dict[str, object]] = {}
+        for record in self.public:
+            for model in record.models:
+                if not self.is_known_model(model):
+                    continue
+                entry = seen_models.setdefault(model, {
+                    "id": model,
+                    "object": "model",
+                    "type": "chat",
+                    "owned_by": "g4f",
+                    "providers": []
+                })
+                if record.name not in entry["providers"]:
+                    entry["providers"].append(record.name)
+
+        model_list = sorted(seen_models.values(), key=lambda x: x["id"].lower())
+        return {"data": model_list, "object": "list", "total": len(model_list)}
+
+    def _build_all_models(self) -> Dict[str, object]:
+        providers_with_models = []
+        all_unique_models = set()
+        for record in self.public:
+            if not record.models:
+                continue
+            all_unique_models.update(record.models)
+            providers_with_models.append({
+                "provider": record.name,
+                "models": sorted(record.models),
+                "count": len(record.models),
+                "url": record.url
+            })
+
+        providers_with_models.sort(key=lambda x: -x["count"])
+        return {
+            "data": providers_with_models,
+            "total_providers": len(providers_with_models),
+            "total_unique_models": len(all_unique_models),
+            "object": "list"
+        }
+
+    def _build_providers(self) -> Dict[str, object]:
+        providers_list = [{
+            "id": record.name,
+            "working": record.working,
+            "needs_auth": record.needs_auth,
+            "supports_stream": record.supports_stream,
+            "url": record.url,
+            "models": record.models
+        } for record in self.public]
+        return {"data": providers_list, "object": "list"}
+
+
+class Catalog:
+    """
+    Mantém o índice corrente e o reconstrói a cada `refresh_interval` segundos.
+
+    Com um `store` (modo multi-worker) só o worker líder varre os providers e
+    publica o snapshot; os demais consultam o store a cada `poll_interval`
+    segundos e adotam a versão publicada.
+    """
+
+    def __init__(self, providers_source: Callable[[], List[object]],
+                 model_lookup: Callable[[str], object], refresh_interval: int,
+                 store=None, poll_interval: float = 5.0):
+        self._providers_source = providers_source
+        self._model_lookup = model_lookup
+        self.refresh_interval = refresh_interval
+        self.poll_interval = poll_interval
+        self._store = store
+        self._index: Optional[CatalogIndex] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _adopt(self, snapshot: Dict[str, object]) -> CatalogIndex:
+        started = time.perf_counter()
+        index = CatalogIndex(self._providers_source(), self._model_lookup, snapshot=snapshot)
+        logger.info("[G4F] Catálogo v%s carregado do snapshot compartilhado em %.3fs",
+                    index.version, time.perf_counter() - started)
+        return index
+
+    def _build(self) -> CatalogIndex:
+        current = self._index.version if self._index else 0
+        store = self._store
+        if store is not None:
+            snapshot = store.load(newer_than=current)
+            if not store.try_lead():
+                if snapshot is not None:
+                    return self._adopt(snapshot)
+                if self._index is not None:
+                    return self._index
+                # Nada publicado ainda: constrói localmente sem publicar
+            elif snapshot is not None and (self.refresh_interval <= 0
+                                           or time.time() - snapshot["built_at"] < self.refresh_interval):
+                # Líder recém-eleito com snapshot ainda fresco: não refaz a varredura
+                return self._adopt(snapshot)
+            elif self._index is not None and self.refresh_interval <= 0:
+                return self._index
+            current = max(current, store.generation())
+
+        version = current + 1
+        started = time.perf_counter()
+        index = CatalogIndex(self._providers_source(), self._model_lookup, version)
+        logger.info("[G4F] Catálogo v%s construído em %.3fs (%s providers públicos)",
+                    version, time.perf_counter() - started, len(index.public))
+        if store is not None and store.leader:
+            try:
+                store.publish(index.to_snapshot(), version, index.encoded)
+            except Exception:
+                logger.exception("Falha ao publicar o snapshot do catálogo")
+            else:
+                # O líder também passa a servir as listagens do mapeamento (uma cópia só)
+                published = store.load(newer_than=version - 1)
+                if published is not None:
+                    index.encoded.update(published["bodies"])
+        return index
+
+    def refresh(self) -> CatalogIndex:
+        self._index = self._build()
+        return self._index
+
+    def get(self) -> CatalogIndex:
+        index = self._index
+        if index is None:
+            index = self.refresh()
+        return index
+
+    @property
+    def age(self) -> Optional[float]:
+        return time.time() - self._index.built_at if self._index else None
+
+    def _next_refresh(self) -> float:
+        if self._store is None or (self._store.leader and self.refresh_interval > 0):
+            return self.refresh_interval
+        return min(self.poll_interval, self.refresh_interval) if self.refresh_interval > 0 else self.poll_interval
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self._next_refresh())
+            try:
+                # Reconstrói fora do event loop e troca a referência de uma vez
+                self._index = await asyncio.to_thread(self._build)
+            except Exception:
+                logger.exception("Falha ao reconstruir o catálogo")
+
+    def start(self):
+        if self._task is None and (self.refresh_interval > 0 or self._store is not None):
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,281 @@
+"""
+Orçamento de contexto por modelo e compactação do histórico.
+
+Cada modelo tem uma janela de contexto (tabela por família, sobrescrevível
+via CONTEXT_WINDOWS) da qual se reserva o espaço da resposta. Quando o
+histórico não cabe, as mensagens mais antigas são recolhidas num resumo
+curto (trechos do início de cada uma), preservando os system prompts e os
+turnos recentes. Em último caso a mensagem final é cortada no meio.
+
+A compactação é opt-in (CONTEXT_BUDGET_ENABLED=1) e só vale para modelos com
+janela conhecida; modelos desconhecidos (e `auto`) passam intactos, a não ser
+que CONTEXT_DEFAULT_TOKENS defina uma janela padrão.
+
+O recolhimento só avança: o prefixo já compactado de uma conversa fica em
+cache (chave = hash encadeado das mensagens), então a chamada seguinte da
+mesma conversa só conta e encaixa as mensagens novas.
+"""
+
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import tokens as tokenizer
+
+CONTEXT_BUDGET_ENABLED = os.environ.get("CONTEXT_BUDGET_ENABLED", "0").lower() in ("1", "true", "yes")
+# Janela usada quando o modelo não é conhecido (0 = não compacta esses modelos)
+CONTEXT_DEFAULT_TOKENS = int(os.environ.get("CONTEXT_DEFAULT_TOKENS", "0"))
+# Tokens reservados para a resposta quando a requisição não envia max_tokens
+CONTEXT_RESERVED_OUTPUT = int(os.environ.get("CONTEXT_RESERVED_OUTPUT", "1024"))
+# Fração da janela efetivamente usada (margem para a diferença entre tokenizers)
+CONTEXT_SAFETY = float(os.environ.get("CONTEXT_SAFETY", "0.9"))
+# Tamanho máximo do resumo das mensagens recolhidas e de cada trecho dentro dele
+CONTEXT_SUMMARY_TOKENS = int(os.environ.get("CONTEXT_SUMMARY_TOKENS", "512"))
+CONTEXT_SNIPPET_CHARS = int(os.environ.get("CONTEXT_SNIPPET_CHARS", "160"))
+CONTEXT_CACHE_SIZE = int(os.environ.get("CONTEXT_CACHE_SIZE", "2048"))
+
+# Prefixos de família → janela de contexto (o primeiro que casar vence)
+CONTEXT_WINDOWS: List[Tuple[str, int]] = [
+    ("gpt-4.1", 1047576),
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4", 8192),
+    ("gpt-3.5", 16385),
+    ("gpt-5", 400000),
+    ("o1", 200000),
+    ("o3", 200000),
+    ("o4", 200000),
+    ("claude", 200000),
+    ("gemini", 1048576),
+    ("llama-3.1", 128000),
+    ("llama-3.2", 128000),
+    ("llama-3.3", 128000),
+    ("llama", 8192),
+    ("deepseek", 64000),
+    ("qwen", 32768),
+    ("mistral", 32000),
+    ("mixtral", 32000),
+    ("command-r", 128000),
+    ("phi", 16000),
+]
+
+_SPACES = re.compile(r"\s+")
+TRUNCATION_MARK = "\n[...]\n"
+
+
+def _parse_windows(raw: str) -> List[Tuple[str, int]]:
+    """CONTEXT_WINDOWS="gpt-4o=64000,llama=4096" → [(prefixo, tokens)]"""
+    windows = []
+    for item in raw.split(","):
+        prefix, _, value = item.strip().partition("=")
+        if prefix and value.strip().isdigit():
+            windows.append((prefix.strip().lower(), int(value)))
+    return windows
+
+
+# Entradas do ambiente têm prioridade sobre a tabela padrão
+CONTEXT_WINDOWS = _parse_windows(os.environ.get("CONTEXT_WINDOWS", "")) + CONTEXT_WINDOWS
+
+
+def context_window(model: Optional[str]) -> Optional[int]:
+    name = (model or "").lower()
+    if "/" in name:
+        name = name.rsplit("/", 1)[1]
+    for prefix, window in CONTEXT_WINDOWS:
+        if name.startswith(prefix):
+            return window
+    return CONTEXT_DEFAULT_TOKENS or None
+
+
+def prompt_budget(model: Optional[str], max_tokens: Optional[int] = None) -> Optional[int]:
+    """Tokens disponíveis para o prompt: janela com margem, menos a reserva da resposta (None = janela desconhecida)"""
+    window = context_window(model)
+    if window is None:
+        return None
+    reserve = max_tokens if max_tokens and max_tokens > 0 else CONTEXT_RESERVED_OUTPUT
+    return max(0, int(window * CONTEXT_SAFETY) - reserve)
+
+
+def _snippet(message: Dict[str, str]) -> str:
+    text = _SPACES.sub(" ", message.get("content") or "").strip()
+    if len(text) > CONTEXT_SNIPPET_CHARS:
+        text = text[:CONTEXT_SNIPPET_CHARS].rstrip() + "…"
+    return f"- {message.get('role', 'user')}: {text}"
+
+
+def _chain(previous: bytes, message: Dict[str, str]) -> bytes:
+    digest = hashlib.sha256(previous)
+    digest.update((message.get("role") or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((message.get("content") or "").encode("utf-8"))
+    return digest.digest()
+
+
+def truncate_middle(text: str, limit: int, model: Optional[str] = None) -> str:
+    """Corta o meio do texto (mantém início e fim) até caber em `limit` tokens"""
+    count = tokenizer.count_text(text, model)
+    while count > limit and len(text) > 1:
+        keep = max(0, int(len(text) * limit / count * 0.95) - len(TRUNCATION_MARK))
+        head = keep // 2
+        text = text[:head] + TRUNCATION_MARK + text[len(text) - (keep - head):] if keep else ""
+        count = tokenizer.count_text(text, model)
+    return text
+
+
+class _State:
+    """Forma compactada de um prefixo de conversa (messages[:length])"""
+
+    __slots__ = ("length", "boundary", "pinned", "snippets", "tokens")
+
+    def __init__(self, length: int = 0, boundary: int = 0, pinned: Tuple[int, ...] = (),
+                 snippets: Tuple[str, ...] = (), tokens: int = 0):
+        self.length = length
+        # messages[:boundary] foram recolhidas, exceto os system prompts em `pinned`
+        self.boundary = boundary
+        self.pinned = pinned
+        self.snippets = snippets
+        # Tokens da forma compactada (sem o priming da resposta)
+        self.tokens = tokens
+
+
+class Compaction:
+    """Resultado da compactação de uma requisição"""
+
+    __slots__ = ("messages", "original_tokens", "tokens", "budget", "collapsed", "truncated", "reused")
+
+    def __init__(self, messages, original_tokens, tokens, budget, collapsed=0, truncated=False, reused=0):
+        self.messages = messages
+        # Tokens antes da compactação (None quando veio do cache e não foi recontado)
+        self.original_tokens = original_tokens
+        self.tokens = tokens
+        self.budget = budget
+        self.collapsed = collapsed
+        self.truncated = truncated
+        self.reused = reused
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.collapsed or self.truncated)
+
+
+class ContextBudget:
+    """Encaixa o histórico no orçamento do modelo, reaproveitando prefixos já compactados"""
+
+    def __init__(self, enabled: bool = CONTEXT_BUDGET_ENABLED, cache_size: int = CONTEXT_CACHE_SIZE,
+                 summary_tokens: int = CONTEXT_SUMMARY_TOKENS):
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self.summary_tokens = summary_tokens
+        self._states: "OrderedDict[Tuple[int, str, bytes], _State]" = OrderedDict()
+        self.requests = 0
+        self.compacted = 0
+        self.truncated = 0
+        self.prefix_hits = 0
+
+    def _summary(self, snippets: Tuple[str, ...], model: Optional[str]) -> Tuple[Optional[Dict[str, str]], int]:
+        """Mensagem de resumo com os trechos mais recentes que cabem em `summary_tokens`"""
+        if not snippets:
+            return None, 0
+        kept: List[str] = []
+        used = 0
+        for snippet in reversed(snippets):
+            cost = tokenizer.count_text(snippet, model) + 1
+            if used + cost > self.summary_tokens:
+                break
+            kept.append(snippet)
+            used += cost
+        omitted = len(snippets) - len(kept)
+        header = f"Resumo das {len(snippets)} mensagens anteriores desta conversa"
+        if omitted:
+            header += f" ({omitted} mais antigas omitidas)"
+        message = {"role": "system", "content": header + ":\n" + "\n".join(reversed(kept))}
+        return message, tokenizer.count_message(message, model)
+
+    def _assemble(self, messages: List[Dict[str, str]], state: _State,
+                  summary: Optional[Dict[str, str]]) -> List[Dict[str, str]]:
+        out = [messages[i] for i in state.pinned]
+        if summary is not None:
+            out.append(summary)
+        out.extend(messages[state.boundary:state.length])
+        return out
+
+    def compact(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                max_tokens: Optional[int] = None) -> Compaction:
+        budget = prompt_budget(model, max_tokens)
+        if not self.enabled or not messages or budget is None:
+            return Compaction(messages, None, None, budget)
+        self.requests += 1
+        count = lambda message: tokenizer.count_message(message, model)
+        namespace = (budget, tokenizer.encoding_for(model))
+
+        # Hash encadeado de cada prefixo; reaproveita o maior prefixo já compactado
+        chain: List[bytes] = []
+        digest = b""
+        for message in messages:
+            digest = _chain(digest, message)
+            chain.append(digest)
+        state = _State()
+        for length in range(len(messages), 0, -1):
+            cached = self._states.get(namespace + (chain[length - 1],))
+            if cached is not None:
+                self._states.move_to_end(namespace + (chain[length - 1],))
+                state = cached
+                self.prefix_hits += 1
+                break
+        reused = state.length
+
+        summary, summary_tokens = self._summary(state.snippets, model)
+        tokens = state.tokens + sum(count(m) for m in messages[state.length:])
+        state = _State(len(messages), state.boundary, state.pinned, state.snippets, tokens)
+        original = tokens + tokenizer.TOKENS_REPLY_PRIMING if not state.boundary else None
+        available = budget - tokenizer.TOKENS_REPLY_PRIMING
+
+        # Recolhe as mensagens mais antigas (a última sempre fica) até caber
+        boundary, pinned, snippets = state.boundary, list(state.pinned), list(state.snippets)
+        kept_tokens = tokens - summary_tokens - sum(count(messages[i]) for i in pinned)
+        while tokens > available and boundary < len(messages) - 1:
+            message = messages[boundary]
+            kept_tokens -= count(message)
+            if message.get("role") == "system":
+                pinned.append(boundary)
+            else:
+                snippets.append(_snippet(message))
+            boundary += 1
+            summary, summary_tokens = self._summary(tuple(snippets), model)
+            tokens = kept_tokens + summary_tokens + sum(count(messages[i]) for i in pinned)
+        if boundary != state.boundary:
+            state = _State(len(messages), boundary, tuple(pinned), tuple(snippets), tokens)
+
+        self._states[namespace + (chain[-1],)] = state
+        while len(self._states) > self.cache_size:
+            self._states.popitem(last=False)
+
+        out = self._assemble(messages, state, summary)
+        truncated = False
+        if tokens > available:
+            # Nem só os system prompts + a última mensagem cabem: corta o meio da última
+            last = out[-1]
+            room = max(0, available - (tokens - count(last)) - tokenizer.TOKENS_PER_MESSAGE
+                       - tokenizer.count_text(last.get("role", ""), model))
+            out[-1] = dict(last, content=truncate_middle(last.get("content") or "", room, model))
+            tokens = sum(count(m) for m in out)
+            truncated = True
+            self.truncated += 1
+        if state.boundary:
+            self.compacted += 1
+        return Compaction(out, original, tokens + tokenizer.TOKENS_REPLY_PRIMING, budget,
+                          collapsed=len(state.snippets), truncated=truncated, reused=reused)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "default_window": CONTEXT_DEFAULT_TOKENS,
+            "reserved_output": CONTEXT_RESERVED_OUTPUT,
+            "cached_prefixes": len(self._states),
+            "requests": self.requests,
+            "compacted": self.compacted,
+            "truncated": self.truncated,
+            "prefix_hits": self.prefix_hits,
+        }
@@ -0,0 +1,112 @@
+"""
+Respostas JSON pré-codificadas e condicionais.
+
+Um `EncodedBody` guarda o JSON já serializado e as variantes gzip e brotli
+(brotli só quando o pacote estiver instalado), cada uma com ETag forte
+próprio. `encoded_response` escolhe a variante pelo Accept-Encoding e
+responde 304 quando o If-None-Match bate, sem serializar nem comprimir nada
+por requisição.
+"""
+
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from sse import dumps
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende do ambiente
+    brotli = None
+
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE", "60"))
+# Corpos menores que isso não compensam a compressão
+ENCODED_MIN_BYTES = int(os.environ.get("ENCODED_MIN_BYTES", "512"))
+
+
+def _accepted(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding → {codificação: q}"""
+    accepted: Dict[str, float] = {}
+    for part in (header or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    return accepted
+
+
+class EncodedBody:
+    """JSON serializado uma vez + variantes comprimidas, com ETag por variante"""
+
+    __slots__ = ("identity", "variants", "etag")
+
+    def __init__(self, payload):
+        body = dumps(payload)
+        self.identity = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        # codificação → bytes (só as que de fato reduzem o tamanho)
+        self.variants: Dict[str, bytes] = {}
+        if len(body) >= ENCODED_MIN_BYTES:
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+
+    @classmethod
+    def shared(cls, etag: str, variants: Dict[str, bytes]) -> "EncodedBody":
+        """Corpo já codificado em outro processo (`variants` inclui "identity"; aceita memoryview)"""
+        body = cls.__new__(cls)
+        body.etag = etag
+        body.identity = variants.pop("identity")
+        body.variants = variants
+        return body
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Melhor variante aceita pelo cliente (a menor entre as aceitas)"""
+        accepted = _accepted(accept_encoding)
+        best, encoding = self.identity, None
+        for name, data in self.variants.items():
+            q = accepted.get(name, accepted.get("*", 0.0))
+            if q > 0 and len(data) < len(best):
+                best, encoding = data, name
+        return best, encoding
+
+    def tag(self, encoding: Optional[str]) -> str:
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match casa com qualquer variante desta mesma versão do conteúdo?"""
+        if not if_none_match:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*":
+                return True
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+            if candidate.strip('"').split("-", 1)[0] == self.etag:
+                return True
+        return False
+
+
+def encoded_response(request: Request, body: EncodedBody, max_age: int = CATALOG_MAX_AGE) -> Response:
+    content, encoding = body.select(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": body.tag(encoding),
+        "Cache-Control": f"public, max-age={max_age}",
+        "Vary": "Accept-Encoding",
+    }
+    if body.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
@@ -0,0 +1,141 @@
+"""
+Provider falso (offline) para medir o overhead do próprio servidor.
+
+Com FAKE_PROVIDER=1 os providers falsos entram no catálogo ao lado dos do
+g4f e atendem quando são escolhidos (pelo roteador ou pelo nome). Com
+FAKE_PROVIDER=only o g4f nem é importado: catálogo, cliente e modelos são
+todos falsos, o que permite rodar o benchmark sem rede.
+
+Perfis em FAKE_PROVIDERS, separados por vírgula:
+"nome=latência_s/tokens_por_s/taxa_de_falha", ex.:
+"FakeFast=0.05/400/0,FakeFlaky=0.3/60/0.2".
+"""
+
+import asyncio
+import base64
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, List, Optional
+
+FAKE_PROVIDER = os.environ.get("FAKE_PROVIDER", "0").lower()
+FAKE_PROVIDERS = os.environ.get("FAKE_PROVIDERS", "FakeProvider=0.1/200/0")
+FAKE_RESPONSE_TOKENS = int(os.environ.get("FAKE_RESPONSE_TOKENS", "64"))
+FAKE_MODELS = ["fake-model", "gpt-4o-mini"]
+
+# PNG 1x1 transparente (resposta do images.generate falso)
+_PIXEL = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+_WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")
+
+
+class FakeProviderError(RuntimeError):
+    pass
+
+
+class FakeProvider:
+    """Provider com latência até o primeiro token, vazão de tokens e taxa de falha configuráveis"""
+
+    working = True
+    needs_auth = False
+    supports_stream = True
+    supports_message_history = True
+    url = "http://fake.local"
+    models = FAKE_MODELS
+    latency = 0.1
+    tokens_per_second = 200.0
+    failure_rate = 0.0
+
+    @classmethod
+    async def create_async_generator(cls, model: Optional[str], messages: List[Dict], **kwargs) -> AsyncIterator[str]:
+        """Mesma forma dos AsyncGeneratorProvider do g4f: emite o texto token a token"""
+        await asyncio.sleep(cls.latency)
+        if cls.failure_rate and random.random() < cls.failure_rate:
+            raise FakeProviderError(f"{cls.__name__}: falha simulada")
+        interval = 1.0 / cls.tokens_per_second if cls.tokens_per_second > 0 else 0.0
+        started = time.perf_counter()
+        for index in range(FAKE_RESPONSE_TOKENS):
+            # Ritmo pelo relógio (não acumula o erro de cada sleep)
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield ("" if index == 0 else " ") + _WORDS[index % len(_WORDS)]
+
+
+def parse_profiles(raw: str = FAKE_PROVIDERS) -> List[type]:
+    """Cria uma subclasse de FakeProvider por perfil declarado"""
+    providers = []
+    for item in raw.split(","):
+        name, _, spec = item.strip().partition("=")
+        if not name:
+            continue
+        values = (spec.split("/") + ["", "", ""])[:3]
+        attrs = {}
+        for field, value in zip(("latency", "tokens_per_second", "failure_rate"), values):
+            if value.strip():
+                attrs[field] = float(value)
+        providers.append(type(name, (FakeProvider,), attrs))
+    return providers
+
+
+def _chunk(content: str, provider: str):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta, message=None)], provider=provider)
+
+
+class _FakeCompletions:
+    def __init__(self, providers: List[type], fallback=None):
+        self._providers = providers
+        self._fallback = fallback
+
+    def create(self, model=None, messages=None, provider=None, stream=False, **kwargs):
+        if provider is None or provider not in self._providers:
+            if self._fallback is not None:
+                return self._fallback.create(model=model, messages=messages, provider=provider, stream=stream, **kwargs)
+            provider = self._providers[0]
+        if stream:
+            return self._stream(provider, model, messages)
+        return self._complete(provider, model, messages)
+
+    async def _stream(self, provider, model, messages):
+        async for token in provider.create_async_generator(model, messages or []):
+            yield _chunk(token, provider.__name__)
+
+    async def _complete(self, provider, model, messages):
+        content = "".join([token async for token in provider.create_async_generator(model, messages or [])])
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], provider=provider.__name__)
+
+
+class _FakeImages:
+    def __init__(self, providers: List[type], fallback=None):
+        self._providers = providers
+        self._fallback = fallback
+
+    async def generate(self, prompt, model=None, provider=None, **kwargs):
+        if (provider is None or provider not in self._providers) and self._fallback is not None:
+            return await self._fallback.generate(prompt=prompt, model=model, provider=provider, **kwargs)
+        provider = provider or self._providers[0]
+        await asyncio.sleep(provider.latency)
+        image = SimpleNamespace(url=None, b64_json=base64.b64encode(_PIXEL).decode("ascii"))
+        return SimpleNamespace(data=[image], provider=provider.__name__)
+
+
+class FakeClient:
+    """
+    Mesma interface usada do AsyncClient do g4f. Chamadas para providers que
+    não são falsos vão para `inner` (o cliente real), quando houver.
+    """
+
+    def __init__(self, providers: List[type], inner=None):
+        self.chat = SimpleNamespace(completions=_FakeCompletions(
+            providers, inner.chat.completions if inner is not None else None))
+        self.images = _FakeImages(providers, inner.images if inner is not None else None)
+
+
+class FakeModelUtils:
+    @staticmethod
+    def get_model(name: str):
+        return name if name in FAKE_MODELS else None
@@ -0,0 +1,179 @@
+"""
+Requisições "hedged" de streaming: dispara o mesmo pedido em vários providers
+(de uma vez ou escalonado por um atraso) e fica com quem emitir o primeiro
+chunk com conteúdo. Os perdedores são cancelados e seus geradores fechados.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Callable, List, Optional
+
+HEDGE_MAX_PER_REQUEST = int(os.environ.get("HEDGE_MAX_PER_REQUEST", "3"))
+HEDGE_MAX_GLOBAL = int(os.environ.get("HEDGE_MAX_GLOBAL", "32"))
+HEDGE_DELAY = float(os.environ.get("HEDGE_DELAY", "0.3"))
+# Número de candidatos usado quando a requisição não informa `hedge` (0 = desligado)
+HEDGE_DEFAULT = int(os.environ.get("HEDGE_DEFAULT", "0"))
+
+
+def hedge_width(requested: Optional[int]) -> int:
+    """Quantidade de candidatos para a corrida, respeitando o limite por requisição"""
+    width = HEDGE_DEFAULT if requested is None else requested
+    return max(0, min(width, HEDGE_MAX_PER_REQUEST))
+
+
+class HedgeLimiter:
+    """Limite global de upstreams extras (além do primário) em corrida ao mesmo tempo"""
+
+    def __init__(self, max_extra: int = HEDGE_MAX_GLOBAL):
+        self.max_extra = max_extra
+        self.in_flight = 0
+        self.launched = 0
+        self.denied = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.max_extra:
+            self.denied += 1
+            return False
+        self.in_flight += 1
+        self.launched += 1
+        return True
+
+    def release(self, count: int = 1):
+        self.in_flight = max(0, self.in_flight - count)
+
+    def snapshot(self):
+        return {
+            "max_extra": self.max_extra,
+            "max_per_request": HEDGE_MAX_PER_REQUEST,
+            "default_delay": HEDGE_DELAY,
+            "in_flight": self.in_flight,
+            "launched": self.launched,
+            "denied": self.denied,
+        }
+
+
+class HedgeResult:
+    """Vencedor da corrida: índice do candidato, primeiro chunk e o stream para continuar lendo"""
+
+    __slots__ = ("index", "first_chunk", "stream", "errors")
+
+    def __init__(self, index: int, first_chunk, stream: AsyncIterator, errors: List):
+        self.index = index
+        self.first_chunk = first_chunk
+        self.stream = stream
+        self.errors = errors
+
+
+async def _close_stream(stream) -> None:
+    aclose = getattr(stream, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception:
+        pass
+
+
+async def prepend_chunk(first_chunk, stream: AsyncIterator):
+    """Re-emite o primeiro chunk já consumido e continua o stream do vencedor"""
+    try:
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await _close_stream(stream)
+
+
+async def _first_content(stream: AsyncIterator, has_content: Callable[[object], bool]):
+    async for chunk in stream:
+        if has_content(chunk):
+            return chunk
+    raise RuntimeError("Stream terminou sem conteúdo")
+
+
+async def race_first_chunk(
+    openers: List[Callable[[], AsyncIterator]],
+    has_content: Callable[[object], bool],
+    limiter: HedgeLimiter,
+    delay: Optional[float] = None,
+    on_error: Optional[Callable[[int, BaseException], None]] = None,
+    on_cancel: Optional[Callable[[int], None]] = None,
+) -> HedgeResult:
+    """
+    Abre `openers[0]` imediatamente e os seguintes a cada `delay` segundos (ou
+    logo após uma falha) enquanto ninguém tiver respondido. Upstreams extras só
+    são abertos se o `limiter` global permitir. Levanta a última exceção se
+    todos os candidatos falharem. `on_cancel(índice)` é chamado para cada
+    candidato aberto que foi cancelado sem resultado (perdedores).
+    """
+    delay = HEDGE_DELAY if delay is None else max(0.0, delay)
+    streams = {}
+    tasks = {}
+    errors: List = []
+    extra = 0
+    next_index = 0
+
+    def launch(index: int):
+        stream = openers[index]()
+        streams[index] = stream
+        tasks[asyncio.ensure_future(_first_content(stream, has_content))] = index
+
+    async def cancel_all(keep: Optional[int] = None):
+        for task, index in list(tasks.items()):
+            if index == keep:
+                continue
+            failed = task.done() and not task.cancelled() and task.exception() is not None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await _close_stream(streams[index])
+            if failed:
+                # Já tinha falhado na mesma rodada em que outro venceu
+                errors.append(task.exception())
+                if on_error:
+                    on_error(index, task.exception())
+            elif on_cancel:
+                on_cancel(index)
+        tasks.clear()
+
+    try:
+        launch(next_index)
+        next_index += 1
+        while tasks:
+            can_hedge = next_index < len(openers)
+            done, _ = await asyncio.wait(
+                tasks.keys(),
+                timeout=delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            failed = False
+            for task in done:
+                index = tasks.pop(task)
+                if task.exception() is None:
+                    await cancel_all(keep=index)
+                    return HedgeResult(index, task.result(), streams[index], errors)
+                errors.append(task.exception())
+                failed = True
+                if on_error:
+                    on_error(index, task.exception())
+                await _close_stream(streams[index])
+
+            # Timeout do atraso ou falha de um candidato: abre o próximo, se permitido
+            if can_hedge and (failed or not done):
+                if not tasks:
+                    launch(next_index)
+                    next_index += 1
+                elif limiter.try_acquire():
+                    extra += 1
+                    launch(next_index)
+                    next_index += 1
+                else:
+                    # Sem vaga global: não escalona mais nesta requisição
+                    next_index = len(openers)
+
+        raise errors[-1] if errors else RuntimeError("Nenhum provider disponível")
+    except BaseException:
+        await cancel_all()
+        raise
+    finally:
+        limiter.release(extra)
@@ -0,0 +1,211 @@
+"""
+Armazenamento local de imagens geradas.
+
+As imagens são gravadas por conteúdo (nome = SHA-256 dos bytes + extensão),
+então a mesma imagem nunca ocupa espaço duas vezes. Um índice separado liga
+a chave da requisição (prompt, model, size) aos blobs. O espaço em disco é
+limitado por IMAGE_STORE_MAX_BYTES, com despejo LRU por último acesso.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("g4f-server")
+
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "./image_store")
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_SIZE = re.compile(r"^\s*(\d{2,4})\s*[xX]\s*(\d{2,4})\s*$")
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}\.(png|jpg|webp|gif)$")
+_MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+
+
+def image_key(prompt: str, model: Optional[str], size: Optional[str]) -> str:
+    """Chave canônica de uma geração: mesmo prompt/modelo/tamanho → mesma imagem"""
+    canonical = json.dumps([prompt.strip(), (model or "").lower(), (size or "").lower()],
+                           separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def parse_size(size: Optional[str]) -> Optional[Tuple[int, int]]:
+    """'1024x768' → (1024, 768); ValueError se o formato for inválido"""
+    if not size:
+        return None
+    match = _SIZE.match(size)
+    if not match:
+        raise ValueError(f"Tamanho inválido '{size}' (use LARGURAxALTURA, ex.: 1024x1024)")
+    return int(match.group(1)), int(match.group(2))
+
+
+def sniff_extension(data: bytes) -> Optional[str]:
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data.startswith(b"GIF8"):
+        return "gif"
+    return None
+
+
+def decode_data_url(url: str) -> Optional[bytes]:
+    """Bytes de uma URL `data:image/...;base64,...` (None se não for uma)"""
+    if not url.startswith("data:"):
+        return None
+    header, _, payload = url.partition(",")
+    if ";base64" not in header:
+        return None
+    return base64.b64decode(payload)
+
+
+def media_type(name: str) -> str:
+    return _MEDIA_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+class BlobStore:
+    """Blobs por conteúdo em disco + índice chave→blobs, com despejo LRU"""
+
+    def __init__(self, root: str = IMAGE_STORE_DIR, max_bytes: int = IMAGE_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs: "OrderedDict[str, int]" = OrderedDict()
+        self._keys: Dict[str, List[str]] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _blob_path(self, name: str) -> str:
+        return os.path.join(self.root, "blobs", name[:2], name)
+
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self.root, "keys", key[:2], f"{key}.json")
+
+    def _load(self):
+        """Reconstrói o LRU a partir do disco (ordem = último acesso)"""
+        if not self.enabled:
+            return
+        found = []
+        for directory, _, files in os.walk(os.path.join(self.root, "blobs")):
+            for name in files:
+                if not _BLOB_NAME.match(name):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._blobs[name] = size
+            self._bytes += size
+
+    def path(self, name: str) -> Optional[str]:
+        """Caminho de um blob existente (marca como usado); None se não existe ou nome inválido"""
+        if not _BLOB_NAME.match(name) or name not in self._blobs:
+            return None
+        self._touch(name)
+        return self._blob_path(name)
+
+    def _touch(self, name: str):
+        self._blobs.move_to_end(name)
+        try:
+            os.utime(self._blob_path(name))
+        except OSError:
+            pass
+
+    def lookup(self, key: str) -> Optional[List[str]]:
+        """Blobs gerados para a chave, se todos ainda estão no disco"""
+        names = self._keys.get(key)
+        if names is None:
+            try:
+                with open(self._key_path(key), "r", encoding="utf-8") as fh:
+                    names = json.load(fh)
+            except (OSError, ValueError):
+                names = None
+        if not names or any(name not in self._blobs for name in names):
+            self._keys.pop(key, None)
+            self.misses += 1
+            return None
+        self._keys[key] = names
+        for name in names:
+            self._touch(name)
+        self.hits += 1
+        return names
+
+    def write(self, data: bytes, extension: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Grava os bytes no disco e retorna (nome, tamanho). Não toca no índice,
+        então pode rodar numa thread; o registro é feito depois por `add`.
+        """
+        name = f"{hashlib.sha256(data).hexdigest()}.{extension or sniff_extension(data) or 'png'}"
+        path = self._blob_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Sempre regrava (o conteúdo é o mesmo): o blob pode ter sido despejado no meio tempo.
+        # Temporário por thread: duas gerações da mesma imagem podem gravar ao mesmo tempo
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return name, len(data)
+
+    def add(self, name: str, size: int) -> str:
+        """Registra no índice um blob já gravado por `write` e aplica o despejo (no event loop)"""
+        if name in self._blobs:
+            self._touch(name)
+            return name
+        self._blobs[name] = size
+        self._bytes += size
+        self._evict()
+        return name
+
+    def put(self, data: bytes, extension: Optional[str] = None) -> str:
+        """Grava os bytes e retorna o nome do blob (tudo na mesma thread)"""
+        return self.add(*self.write(data, extension))
+
+    def bind(self, key: str, names: List[str]):
+        self._keys[key] = names
+        path = self._key_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(names, fh)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Falha ao gravar índice de imagens: %s", e)
+
+    def _evict(self):
+        # O blob recém-gravado é o mais recente: só sai se sozinho já passar do limite
+        while self._bytes > self.max_bytes and len(self._blobs) > 1:
+            name, size = self._blobs.popitem(last=False)
+            self._bytes -= size
+            self.evicted += 1
+            try:
+                os.remove(self._blob_path(name))
+            except OSError:
+                pass
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "dir": os.path.abspath(self.root),
+            "blobs": len(self._blobs),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
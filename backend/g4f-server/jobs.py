@@ -0,0 +1,423 @@
+"""
+Jobs assíncronos com fila persistente.
+
+Completions longas (ex.: com web_search) não precisam segurar uma requisição
+HTTP aberta: o cliente envia o job, recebe um id e consulta (ou faz long-poll)
+o resultado depois.
+
+Os jobs ficam numa tabela SQLite (WAL, compartilhável entre os workers do
+servidor) e sobrevivem a reinícios. Um pool de JOBS_WORKERS tasks pega o job
+pronto de maior prioridade (mais antigo primeiro no empate) com um UPDATE
+atômico que também grava um lease; enquanto o job roda o lease é renovado.
+Se o processo morrer, o lease vence e outro worker retoma o job.
+
+Opt-in (JOBS_ENABLED=1). Em container, JOBS_DB precisa apontar para um volume
+(o docker-compose usa /data/jobs.sqlite3), senão a fila some junto com ele.
+
+Falhas são repetidas com backoff exponencial até `max_attempts`, exceto as
+marcadas como definitivas (`JobError(retryable=False)`). No shutdown os jobs
+em andamento têm JOBS_DRAIN_SECONDS para terminar; os que não terminam voltam
+para a fila sem contar a tentativa.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger("g4f-server")
+
+JOBS_ENABLED = os.environ.get("JOBS_ENABLED", "0").lower() in ("1", "true", "yes")
+JOBS_DB = os.environ.get("JOBS_DB", "./jobs.sqlite3")
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "4"))
+JOBS_MAX_ATTEMPTS = int(os.environ.get("JOBS_MAX_ATTEMPTS", "3"))
+# Backoff entre tentativas: base * 2^(tentativa-1), limitado ao teto
+JOBS_RETRY_BACKOFF = float(os.environ.get("JOBS_RETRY_BACKOFF", "5"))
+JOBS_RETRY_BACKOFF_MAX = float(os.environ.get("JOBS_RETRY_BACKOFF_MAX", "300"))
+# Tempo máximo de uma tentativa e duração do lease (renovado a cada terço)
+JOBS_TIMEOUT = float(os.environ.get("JOBS_TIMEOUT", "600"))
+JOBS_LEASE = float(os.environ.get("JOBS_LEASE", "60"))
+# Intervalo de consulta da fila quando ociosa (jobs de outros processos, retries agendados)
+JOBS_POLL_INTERVAL = float(os.environ.get("JOBS_POLL_INTERVAL", "1"))
+JOBS_DRAIN_SECONDS = float(os.environ.get("JOBS_DRAIN_SECONDS", "30"))
+# Jobs na fila aceitos antes de recusar novos (429) e retenção dos jobs terminados
+JOBS_MAX_QUEUED = int(os.environ.get("JOBS_MAX_QUEUED", "10000"))
+JOBS_RETENTION = float(os.environ.get("JOBS_RETENTION", "86400"))
+# Espera máxima de um long-poll
+JOBS_MAX_WAIT = float(os.environ.get("JOBS_MAX_WAIT", "60"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+_COLUMNS = ("id", "kind", "payload", "status", "priority", "attempts", "max_attempts", "run_after",
+            "lease_until", "worker", "result", "error", "created_at", "started_at", "finished_at")
+
+Job = Dict[str, Any]
+
+
+class JobError(Exception):
+    """Falha de um job; `retryable=False` encerra o job sem novas tentativas"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class QueueFull(Exception):
+    """Fila com JOBS_MAX_QUEUED jobs pendentes"""
+
+
+def _row(row) -> Optional[Job]:
+    if row is None:
+        return None
+    job = dict(zip(_COLUMNS, row))
+    job["payload"] = json.loads(job["payload"])
+    if job["result"] is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+class JobStore:
+    """Tabela de jobs em SQLite; as transições de estado são UPDATEs condicionais (seguros entre processos)"""
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def add(self, kind: str, payload: Dict[str, Any], priority: int = 0,
+            max_attempts: int = JOBS_MAX_ATTEMPTS, max_queued: int = JOBS_MAX_QUEUED) -> Job:
+        now = time.time()
+        job_id = f"job-{uuid.uuid4().hex}"
+        with self._lock, self._conn:
+            if max_queued > 0:
+                queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                if queued >= max_queued:
+                    raise QueueFull(f"Fila de jobs cheia ({queued} pendentes)")
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, priority, max_attempts, run_after, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, priority, max_attempts, now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row(row)
+
+    def claim(self, worker: str, lease: float) -> Optional[Job]:
+        """Pega o próximo job pronto (ou com lease vencido) e grava o lease deste worker"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_until = ?, "
+                f"started_at = COALESCE(started_at, ?) "
+                f"WHERE id = (SELECT id FROM jobs WHERE (status = ? AND run_after <= ?) "
+                f"OR (status = ? AND lease_until < ?) ORDER BY priority DESC, created_at LIMIT 1) "
+                f"RETURNING {', '.join(_COLUMNS)}",
+                (RUNNING, worker, now + lease, now, QUEUED, now, RUNNING, now)
+            ).fetchone()
+        return _row(row)
+
+    def heartbeat(self, job_id: str, worker: str, lease: float) -> bool:
+        """Renova o lease; False se o job foi cancelado ou retomado por outro worker"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + lease, job_id, worker, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def _transition(self, job_id: str, worker: str, sql: str, params: tuple) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {sql} WHERE id = ? AND worker = ? AND status = ?",
+                params + (job_id, worker, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def finish(self, job_id: str, worker: str, status: str, result: Any = None, error: Optional[str] = None) -> bool:
+        return self._transition(
+            job_id, worker, "status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL",
+            (status, None if result is None else json.dumps(result, ensure_ascii=False, default=str),
+             error, time.time())
+        )
+
+    def retry(self, job_id: str, worker: str, delay: float, error: str) -> bool:
+        return self._transition(
+            job_id, worker, "status = ?, run_after = ?, error = ?, lease_until = NULL",
+            (QUEUED, time.time() + delay, error)
+        )
+
+    def release(self, job_id: str, worker: str) -> bool:
+        """Devolve o job à fila sem contar a tentativa (shutdown)"""
+        return self._transition(
+            job_id, worker, "status = ?, attempts = attempts - 1, run_after = ?, lease_until = NULL",
+            (QUEUED, time.time())
+        )
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in (QUEUED, RUNNING) + FINISHED} | dict(rows)
+
+    def purge(self, retention: float = JOBS_RETENTION) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+                FINISHED + (time.time() - retention,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def public(job: Job) -> Dict[str, Any]:
+    """Representação do job na API"""
+    return {
+        "id": job["id"],
+        "object": "job",
+        "type": job["kind"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "next_attempt_at": job["run_after"] if job["status"] == QUEUED and job["attempts"] else None,
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
+class JobQueue:
+    """
+    Pool de workers sobre um `JobStore`. `handlers` mapeia o tipo do job para
+    uma coroutine que recebe o payload e devolve o resultado (serializável).
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]],
+                 workers: int = JOBS_WORKERS, timeout: float = JOBS_TIMEOUT, lease: float = JOBS_LEASE,
+                 poll_interval: float = JOBS_POLL_INTERVAL):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._released: Set[str] = set()
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._last_purge = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: float = JOBS_DRAIN_SECONDS):
+        """Para de pegar jobs, espera os em andamento até `drain` e devolve o resto à fila"""
+        self._stopping = True
+        self._wakeup.set()
+        running = list(self._running.items())
+        if running and drain > 0:
+            logger.info("[JOBS] Aguardando %s jobs em andamento (até %.0fs)", len(running), drain)
+            await asyncio.wait([task for _, task in running], timeout=drain)
+        for job_id, task in list(self._running.items()):
+            self._released.add(job_id)
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, payload: Dict[str, Any], priority: int = 0,
+                     max_attempts: Optional[int] = None) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo de job desconhecido: {kind}")
+        job = await asyncio.to_thread(self.store.add, kind, payload, priority, max_attempts or JOBS_MAX_ATTEMPTS)
+        self._wakeup.set()
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        if not await asyncio.to_thread(self.store.cancel, job_id):
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        self._notify(job_id)
+        return True
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Long-poll: devolve o job assim que terminar ou quando `timeout` vencer"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED:
+                self._finished.pop(job_id, None)
+                return job
+            if remaining <= 0:
+                return job
+            # Jobs deste processo avisam ao terminar; os de outros processos só aparecem na consulta
+            event = self._finished.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self, job_id: str):
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.worker_id, self.lease)
+            except sqlite3.Error as e:
+                logger.warning("[JOBS] Falha ao consultar a fila: %s", e)
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            if self._stopping:
+                # Shutdown começou durante o claim: devolve o job em vez de segurar o encerramento
+                await asyncio.to_thread(self.store.release, job["id"], self.worker_id)
+                break
+            # Outro job pode estar pronto: acorda um worker ocioso
+            self._wakeup.set()
+            await self._execute(job)
+
+    async def _idle(self):
+        now = time.monotonic()
+        if now - self._last_purge > 3600:
+            self._last_purge = now
+            await asyncio.to_thread(self.store.purge)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _heartbeat(self, job_id: str, run: asyncio.Task):
+        while not run.done():
+            await asyncio.sleep(self.lease / 3)
+            if not await asyncio.to_thread(self.store.heartbeat, job_id, self.worker_id, self.lease):
+                # Cancelado via API em outro processo (ou lease perdido): para de trabalhar nele
+                run.cancel()
+                return
+
+    async def _execute(self, job: Job):
+        job_id = job["id"]
+        handler = self.handlers.get(job["kind"])
+        if handler is None or job["attempts"] > job["max_attempts"]:
+            # Tipo desconhecido, ou lease vencido depois da última tentativa (processo morreu no meio)
+            error = "Tipo de job desconhecido" if handler is None else "Tentativas esgotadas (worker interrompido)"
+            await asyncio.to_thread(self.store.finish, job_id, self.worker_id, FAILED, None, error)
+            self.failed += 1
+            self._notify(job_id)
+            return
+
+        run = asyncio.ensure_future(asyncio.wait_for(handler(job["payload"]), self.timeout))
+        self._running[job_id] = run
+        beat = asyncio.ensure_future(self._heartbeat(job_id, run))
+        try:
+            await asyncio.wait({run})
+        except asyncio.CancelledError:
+            run.cancel()
+            self.store.release(job_id, self.worker_id)
+            raise
+        finally:
+            beat.cancel()
+            self._running.pop(job_id, None)
+
+        if job_id in self._released:
+            self._released.discard(job_id)
+            await asyncio.to_thread(self.store.release, job_id, self.worker_id)
+            logger.info("[JOBS] Job %s devolvido à fila (shutdown)", job_id)
+            return
+        if run.cancelled():
+            # Cancelado via API: o status já está gravado
+            self._notify(job_id)
+            return
+
+        error = run.exception()
+        if error is None:
+            await asyncio.to_thread(self.store.finish, job_id, self.worker_id, SUCCEEDED, run.result())
+            self.completed += 1
+        else:
+            message = str(error) or type(error).__name__
+            if isinstance(error, asyncio.TimeoutError):
+                message = f"Timeout após {self.timeout:.0f}s"
+            retryable = getattr(error, "retryable", True)
+            if retryable and job["attempts"] < job["max_attempts"]:
+                delay = min(JOBS_RETRY_BACKOFF * 2 ** (job["attempts"] - 1), JOBS_RETRY_BACKOFF_MAX)
+                await asyncio.to_thread(self.store.retry, job_id, self.worker_id, delay, message)
+                self.retried += 1
+                logger.warning("[JOBS] Job %s falhou (tentativa %s/%s), nova tentativa em %.0fs: %s",
+                               job_id, job["attempts"], job["max_attempts"], delay, message)
+                return
+            await asyncio.to_thread(self.store.finish, job_id, self.worker_id, FAILED, None, message)
+            self.failed += 1
+            logger.warning("[JOBS] Job %s falhou: %s", job_id, message)
+        self._notify(job_id)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running_here": len(self._running),
+            "jobs": self.store.counts(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "draining": self._stopping,
+        }
@@ -5,24 +5,92 @@ Este servidor pode rodar localmente ou em um container Docker
 """
 
 import os
-import json
 import asyncio
+import base64
+import hmac
 import time
 import logging
-from typing import Optional, List, Dict, AsyncGenerator
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Optional, List, Dict, AsyncGenerator, AsyncIterator
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-import g4f
-from g4f.client import AsyncClient
-from g4f.models import ModelUtils
-from g4f.Provider import __providers__
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.requests import HTTPConnection
+from routing import LatencyRouter
+from hedging import HedgeLimiter, hedge_width, prepend_chunk, race_first_chunk
+from catalog import Catalog
+from encoded import encoded_response
+from shared_catalog import SnapshotStore
+from response_cache import ResponseCache, cache_key, replay_pieces
+from similar_cache import SimilarCache
+from singleflight import SingleFlight
+from multiplex import StreamMux
+from admission import AdmissionController, AdmissionRejected, Gate, Slot, release_after
+from breaker import BreakerRegistry, CircuitOpenError
+from timeouts import UPSTREAM_TOTAL_TIMEOUT, UpstreamTimeout, close_stream, with_timeouts
+from sse import DONE_FRAME, ChunkEncoder, dumps, new_completion_id
+from metrics import Registry, TOKENS_PER_SECOND_BUCKETS
+import tokens as tokenizer
+from context import ContextBudget
+import tracing
+from tracing import TracingMiddleware
+from profiler import ProfileBusy, sample_cpu, sample_tasks
+from image_store import BlobStore, decode_data_url, image_key, media_type, parse_size
+from jobs import JOBS_ENABLED, JOBS_MAX_WAIT, JobError, JobQueue, JobStore, QueueFull, public as public_job
+from probe import PROBE_ENABLED, PROBE_MODELS_PER_PROVIDER, PROBE_PROMPT, SORT_KEYS, Prober, ProbeStore, rank_models, rank_providers
+from startup import PROCESS_STARTED, StartupTracker, g4f_modules, g4f_version, get_client, get_model, get_providers
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Inicia as tarefas de fundo (aquecimento e refresh do catálogo) e as encerra no shutdown"""
+    startup_tracker.phases["app_import"] = app_imported - PROCESS_STARTED
+    warm = asyncio.create_task(_warm_up())
+    catalog.start()
+    yield
+    warm.cancel()
+    await asyncio.gather(warm, return_exceptions=True)
+    if job_queue is not None:
+        # Jobs em andamento têm JOBS_DRAIN_SECONDS para terminar; o resto volta para a fila
+        await job_queue.stop()
+    await catalog.stop()
+    if prober is not None:
+        await prober.stop()
+
+async def _warm_up():
+    """Importa o g4f, cria o cliente e constrói o catálogo sem bloquear o event loop"""
+    startup_tracker.warming = True
+    try:
+        with startup_tracker.phase("import_g4f"):
+            await asyncio.to_thread(g4f_modules)
+        with startup_tracker.phase("client"):
+            get_client()
+        with startup_tracker.phase("catalog"):
+            await asyncio.to_thread(catalog.refresh)
+    except Exception as e:
+        startup_tracker.error = str(e)
+        logger.exception("Falha no aquecimento do servidor")
+        return
+    finally:
+        startup_tracker.warming = False
+    startup_tracker.mark_ready()
+    if prober is not None:
+        prober.start()
+    if job_queue is not None:
+        job_queue.start()
+
+async def _await_warm_up(request: HTTPConnection):
+    # Rotas da API esperam o aquecimento (até STARTUP_WAIT) em vez de importar o g4f no event loop
+    if startup_tracker.warming and request.url.path.startswith("/v1/"):
+        await startup_tracker.wait(STARTUP_WAIT)
 
 app = FastAPI(
     title="GPT4Free API Server",
     description="API que expõe todos os providers do gpt4free",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    dependencies=[Depends(_await_warm_up)]
 )
 
 # CORS - permite qualquer origem
@@ -32,44 +100,116 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id"],
 )
+# Spans por requisição amostrada (TRACE_SAMPLE_RATE ou header X-Trace: 1) → Server-Timing + log JSON
+app.add_middleware(TracingMiddleware)
 
-# Cliente assíncrono do g4f
-client = AsyncClient()
 logger = logging.getLogger("g4f-server")
 
+# Fases da inicialização e prontidão (o g4f e o cliente assíncrono são criados no aquecimento)
+startup_tracker = StartupTracker()
+STARTUP_WAIT = float(os.environ.get("STARTUP_WAIT", "30"))
+
 MODELS_CACHE_TTL = int(os.environ.get("MODELS_CACHE_TTL", "300"))
+# Nº de processos do servidor; com mais de um o catálogo é compartilhado via snapshot.
+# O resto é por processo: limites de admissão (MAX_CONCURRENT_REQUESTS, PROVIDER_MAX_CONCURRENCY...),
+# circuit breakers, estatísticas do roteador, cache de respostas e coalescência. Com N workers
+# cada provider recebe até N × PROVIDER_MAX_CONCURRENCY chamadas: divida os limites por N
+WORKERS = int(os.environ.get("WORKERS", "1"))
+SHARED_CATALOG_POLL = float(os.environ.get("SHARED_CATALOG_POLL", "5"))
+# Lote: itens simultâneos (padrão e teto), tamanho máximo e nº de providers entre os quais espalhar
+BATCH_PARALLELISM = int(os.environ.get("BATCH_PARALLELISM", "8"))
+BATCH_MAX_PARALLELISM = int(os.environ.get("BATCH_MAX_PARALLELISM", "32"))
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", "1000"))
+BATCH_SPREAD = int(os.environ.get("BATCH_SPREAD", "3"))
+# Chunk final com `usage` em streams quando o cliente não envia stream_options
+STREAM_INCLUDE_USAGE = os.environ.get("STREAM_INCLUDE_USAGE", "1").lower() not in ("0", "false", "no")
 
-# ============ CACHE DE MODELOS ============
-# Cache para evitar iterar sobre providers a cada requisição
-models_cache = {
-    "data": None,
-    "timestamp": 0
-}
+# Roteador que aprende TTFT/latência/sucesso de cada provider com o tráfego real
+router = LatencyRouter()
+hedge_limiter = HedgeLimiter()
+# Cache de respostas (memória + disco opcional), configurado via RESPONSE_CACHE_*
+response_cache = ResponseCache()
+# Quase-duplicatas (SIMILAR_CACHE_*, opt-in): perguntas que só diferem em caixa/pontuação/espaços
+similar_cache = SimilarCache()
+# Coalescência de requisições idênticas em andamento (SINGLEFLIGHT_ENABLED)
+coalescer = SingleFlight()
+# Limites de concorrência global/por provider com fila limitada (MAX_CONCURRENT_REQUESTS, ...)
+admission = AdmissionController()
+# Circuit breakers por provider (BREAKER_*): providers com circuito aberto são pulados
+breakers = BreakerRegistry()
+# Orçamento de contexto por modelo (CONTEXT_*): históricos longos são compactados antes do envio
+context_budget = ContextBudget()
+# Prazo total de uma completion (fila + tentativas) e nº máximo de providers tentados
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "120"))
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "3"))
+# Imagens: blobs locais por conteúdo (IMAGE_STORE_*) e limite próprio de concorrência,
+# separado dos gates de chat para que gerações longas não tomem vagas do chat
+image_store = BlobStore()
+IMAGE_MAX_CONCURRENCY = int(os.environ.get("IMAGE_MAX_CONCURRENCY", "4"))
+IMAGE_MAX_QUEUE = int(os.environ.get("IMAGE_MAX_QUEUE", "16"))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", "30"))
+# URL pública do servidor para os links das imagens (padrão: a URL da própria requisição)
+IMAGE_PUBLIC_URL = os.environ.get("IMAGE_PUBLIC_URL", "").rstrip("/")
+image_gate = Gate("images", IMAGE_MAX_CONCURRENCY, IMAGE_MAX_QUEUE)
+# Gerações idênticas em andamento (chave → task compartilhada)
+_image_flights: Dict[str, asyncio.Task] = {}
+# Token dos endpoints /admin (Authorization: Bearer ...); vazio desativa esses endpoints
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# ============ MÉTRICAS ============
+metrics = Registry()
+TTFT_SECONDS = metrics.histogram(
+    "g4f_time_to_first_token_seconds", "Tempo até o primeiro chunk com conteúdo", ("provider", "model"))
+REQUEST_SECONDS = metrics.histogram(
+    "g4f_request_duration_seconds", "Latência total da chamada upstream", ("endpoint", "provider", "model"))
+TOKENS_PER_SECOND = metrics.histogram(
+    "g4f_tokens_per_second", "Vazão de geração (tokens de saída por segundo)", ("provider", "model"),
+    buckets=TOKENS_PER_SECOND_BUCKETS)
+ERRORS_TOTAL = metrics.counter("g4f_errors_total", "Erros por endpoint e tipo", ("endpoint", "type"))
+CLIENT_DISCONNECTS = metrics.counter("g4f_client_disconnects_total", "Streams encerrados porque o cliente desconectou")
+INFLIGHT_STREAMS = metrics.gauge("g4f_inflight_streams", "Streams SSE abertos neste processo")
+CATALOG_AGE = metrics.gauge("g4f_catalog_age_seconds", "Idade do índice de providers/modelos (models_cache)")
+CATALOG_VERSION = metrics.gauge("g4f_catalog_version", "Versão do índice de providers/modelos")
+QUEUE_DEPTH = metrics.gauge("g4f_admission_queued", "Requisições aguardando vaga", ("gate",))
+SLOTS_IN_USE = metrics.gauge("g4f_admission_in_use", "Vagas de concorrência ocupadas", ("gate",))
+CACHE_ENTRIES = metrics.gauge("g4f_response_cache_entries", "Entradas no cache de respostas")
+CACHE_BYTES = metrics.gauge("g4f_response_cache_bytes", "Bytes ocupados pelo cache de respostas")
+CIRCUIT_STATE = metrics.gauge("g4f_circuit_state", "Estado do circuit breaker (0 fechado, 1 meio-aberto, 2 aberto)", ("provider",))
+SIMILAR_SCORE = metrics.histogram(
+    "g4f_similar_cache_score", "Maior similaridade encontrada por consulta ao cache de quase-duplicatas",
+    buckets=SimilarCache.SCORE_BUCKETS)
+READY = metrics.gauge("g4f_ready", "1 quando o g4f, o cliente e o catálogo estão aquecidos")
+STARTUP_PHASE_SECONDS = metrics.gauge("g4f_startup_phase_seconds", "Duração de cada fase da inicialização", ("phase",))
+
+
+def _count_tokens(text: str, model: Optional[str] = None) -> int:
+    return tokenizer.count_text(text, model)
 
-def _cached_models():
-    if models_cache["data"] is None:
-        return None
-    if time.time() - models_cache["timestamp"] > MODELS_CACHE_TTL:
-        return None
-    return models_cache["data"]
 
+def _observe_completion(endpoint: str, provider, model: Optional[str], total: float,
+                        ttft: Optional[float] = None, tokens: int = 0):
+    provider_name = getattr(provider, "__name__", None) or (str(provider) if provider else "auto")
+    model_name = model or "auto"
+    REQUEST_SECONDS.observe(total, endpoint, provider_name, model_name)
+    if ttft is not None:
+        TTFT_SECONDS.observe(ttft, provider_name, model_name)
+    generation = total - (ttft or 0.0)
+    if tokens and generation > 0:
+        TOKENS_PER_SECOND.observe(tokens / generation, provider_name, model_name)
 
-def _set_cache(payload):
-    models_cache["data"] = payload
-    models_cache["timestamp"] = time.time()
+# ============ CATÁLOGO DE MODELOS ============
+# Índice pré-computado (nome→provider, modelo→providers, payloads das listagens)
+# reconstruído a cada MODELS_CACHE_TTL segundos para não varrer providers por requisição
+# Em modo multi-worker só um processo varre os providers; os outros leem o snapshot
+catalog_store = SnapshotStore() if WORKERS > 1 else None
+catalog = Catalog(get_providers, get_model, MODELS_CACHE_TTL,
+                  store=catalog_store, poll_interval=SHARED_CATALOG_POLL)
 
 
 def _find_provider_by_name(name: Optional[str]):
-    if not name:
-        return None
-    for provider in __providers__:
-        try:
-            if provider.__name__.lower() == name.lower():
-                return provider
-        except Exception:
-            continue
-    return None
+    return catalog.get().find_provider(name)
 
 
 def _normalize_model_and_provider(model: Optional[str]):
@@ -88,22 +228,104 @@ def _normalize_model_and_provider(model: Optional[str]):
     return None, model
 
 
-def _public_providers():
-    for provider in __providers__:
-        try:
-            if provider.working and not getattr(provider, "needs_auth", False):
-                yield provider
-        except Exception:
+def _route_candidates(model: Optional[str]):
+    """Providers públicos aptos a atender o modelo (ou qualquer um com url no modo auto), sem os de circuito aberto"""
+    return breakers.filter(catalog.get().candidates(model))
+
+def _fallback_chain(model: Optional[str], exclude: List[object]) -> List[object]:
+    """Próximos providers a tentar (ordem do roteador) se os primeiros falharem"""
+    ranked = router.rank(_route_candidates(model), model)
+    return [p for p in ranked if p not in exclude][:max(0, RETRY_MAX_ATTEMPTS - 1)]
+
+def _record_outcome(provider, model: Optional[str], ok: bool, ttft: Optional[float] = None,
+                    total: Optional[float] = None, error: Optional[str] = None):
+    """Registra o resultado de uma chamada no roteador e no circuit breaker do provider"""
+    router.record(provider, model, ok=ok, ttft=ttft, total=total, error=error)
+    breakers.record(provider, ok, ttft if ttft is not None else total)
+
+def _reserve_attempt(candidate, admitted) -> Optional[Slot]:
+    """
+    Vaga do provider para uma tentativa extra (fallback ou hedge). O provider
+    admitido já tem a vaga na requisição; os demais só entram se houver vaga
+    livre (AdmissionRejected 429 senão), para não estourar o limite deles.
+    """
+    if candidate is None or candidate is admitted:
+        return None
+    return admission.reserve_provider(candidate.__name__)
+
+def _has_room(candidate, admitted) -> bool:
+    return candidate is None or candidate is admitted or admission.has_room(candidate.__name__)
+
+# ============ SONDAGEM ATIVA ============
+# Canário periódico em cada par provider/modelo (PROBE_*); o histórico fica em SQLite
+# (compartilhado entre workers, só o líder do catálogo sonda) e alimenta o roteador
+
+def _probe_targets():
+    for record in catalog.get().public:
+        if not record.url:
             continue
+        models = record.models[:PROBE_MODELS_PER_PROVIDER] if PROBE_MODELS_PER_PROVIDER > 0 else record.models
+        for model in models or ["auto"]:
+            yield record.provider, model
+
+async def _probe_stream(provider, model: str) -> AsyncIterator[str]:
+    stream = with_timeouts(
+        get_client().chat.completions.create(
+            model=None if model == "auto" else model,
+            messages=[{"role": "user", "content": PROBE_PROMPT}],
+            provider=provider,
+            stream=True
+        ),
+        has_content=lambda c: bool(_chunk_content(c))
+    )
+    try:
+        async for chunk in stream:
+            text = _chunk_content(chunk)
+            if text:
+                yield text
+    finally:
+        await close_stream(stream)
+
+def _probe_recorded(result: Dict[str, object]):
+    model = None if result["model"] == "auto" else result["model"]
+    router.record(result["provider"], model, ok=result["ok"], ttft=result["ttft"],
+                  total=result["total"], error=result["error"])
 
+prober = Prober(
+    ProbeStore(), _probe_targets, _probe_stream, _count_tokens, on_result=_probe_recorded,
+    should_probe=lambda: catalog_store is None or catalog_store.leader
+) if PROBE_ENABLED else None
 
-def _provider_models(provider):
-    if hasattr(provider, "models") and provider.models:
-        if isinstance(provider.models, list):
-            return [str(m) for m in provider.models if m]
-        if isinstance(provider.models, dict):
-            return list(provider.models.keys())
-    return []
+def _performance_filters(sort: Optional[str], min_success: Optional[float],
+                         max_ttft: Optional[float], probed: bool) -> bool:
+    """Valida os filtros de desempenho das listagens; retorna se algum foi pedido"""
+    if sort is not None and sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort deve ser um de: {', '.join(SORT_KEYS)}")
+    requested = sort is not None or min_success is not None or max_ttft is not None or probed
+    if requested and prober is None:
+        raise HTTPException(status_code=400, detail="Sondagem desativada (PROBE_ENABLED=0)")
+    return requested
+
+
+@metrics.collector
+def _collect_gauges():
+    if catalog.age is not None:
+        CATALOG_AGE.set(catalog.age)
+        CATALOG_VERSION.set(catalog.get().version)
+    QUEUE_DEPTH.clear()
+    SLOTS_IN_USE.clear()
+    for name, gate in [("global", admission.global_gate), ("images", image_gate), *admission.gates()]:
+        QUEUE_DEPTH.set(gate.queued, name)
+        SLOTS_IN_USE.set(gate.in_use, name)
+    cache = response_cache.snapshot()
+    CACHE_ENTRIES.set(cache["entries"])
+    CACHE_BYTES.set(cache["bytes"])
+    CIRCUIT_STATE.clear()
+    for name, state in breakers.snapshot()["providers"].items():
+        CIRCUIT_STATE.set({"closed": 0, "half_open": 1, "open": 2}[state["state"]], name)
+    READY.set(1 if startup_tracker.ready else 0)
+    for phase, seconds in startup_tracker.phases.items():
+        STARTUP_PHASE_SECONDS.set(seconds, phase)
 
 # ============ MODELOS PYDANTIC ============
 
@@ -119,12 +341,34 @@ class ChatCompletionRequest(BaseModel):
     max_tokens: Optional[int] = None
     provider: Optional[str] = None
     web_search: bool = False
+    # Streaming hedged (opt-in): nº de providers em corrida e atraso entre disparos (s)
+    hedge: Optional[int] = None
+    hedge_delay: Optional[float] = None
+    # False ignora o cache de respostas (equivale a Cache-Control: no-cache)
+    cache: Optional[bool] = None
+    # {"include_usage": bool}: chunk final com `usage` no stream (padrão: STREAM_INCLUDE_USAGE)
+    stream_options: Optional[Dict[str, bool]] = None
+
+class BatchChatCompletionRequest(BaseModel):
+    requests: List[ChatCompletionRequest]
+    # Itens simultâneos (padrão BATCH_PARALLELISM, limitado a BATCH_MAX_PARALLELISM)
+    parallelism: Optional[int] = None
 
 class ImageGenerationRequest(BaseModel):
     prompt: str
     model: Optional[str] = "flux"
     size: Optional[str] = "1024x1024"
     provider: Optional[str] = None
+    # "url" (link servido por este servidor) ou "b64_json"
+    response_format: Optional[str] = "url"
+
+class JobRequest(BaseModel):
+    # "chat" (corpo de /v1/chat/completions) ou "image" (corpo de /v1/images/generations)
+    type: str = "chat"
+    request: Dict[str, Any]
+    # Maior prioridade sai da fila primeiro
+    priority: int = 0
+    max_attempts: Optional[int] = Field(default=None, ge=1, le=10)
 
 # ============ ENDPOINTS ============
 
@@ -135,109 +379,167 @@ async def root():
         "status": "online",
         "name": "GPT4Free API Server",
         "version": "1.0.0",
-        "g4f_version": getattr(g4f, '__version__', 'unknown'),
+        "g4f_version": g4f_version(),
+        "ready": startup_tracker.ready,
         "endpoints": {
             "chat": "/v1/chat/completions",
+            "batch": "/v1/chat/completions/batch",
+            "chat_ws": "/v1/chat/ws",
             "models": "/v1/models",
             "providers": "/v1/providers",
-            "images": "/v1/images/generations"
+            "images": "/v1/images/generations",
+            "routing": "/v1/routing",
+            "probes": "/v1/probes",
+            "cache": "/v1/cache",
+            "admission": "/v1/admission",
+            "jobs": "/v1/jobs",
+            "metrics": "/metrics",
+            "profile": "/admin/profile",
+            "ready": "/ready"
         }
     }
 
+@app.get("/ready")
+async def ready(http_response: Response):
+    """Readiness: 200 só depois que o g4f, o cliente e o catálogo estão aquecidos"""
+    if not startup_tracker.ready:
+        http_response.status_code = 503
+    return startup_tracker.snapshot()
+
 @app.get("/v1/models")
-async def list_models():
-    """Lista todos os modelos disponíveis de todos os providers funcionais e gratuitos"""
+async def list_models(http_request: Request, sort: Optional[str] = None, min_success: Optional[float] = None,
+                      max_ttft: Optional[float] = None, probed: bool = False):
+    """
+    Lista todos os modelos disponíveis de todos os providers funcionais e gratuitos.
+    Com `sort` (ttft|throughput|success), `min_success`, `max_ttft` ou `probed`,
+    ordena e filtra pelo desempenho medido nas sondagens.
+    """
+    if _performance_filters(sort, min_success, max_ttft, probed):
+        return rank_models(catalog.get().models_payload, prober, sort, min_success, max_ttft, probed)
     try:
-        cached = _cached_models()
-        if cached:
-            return cached
-
-        seen_models: Dict[str, Dict[str, object]] = {}
-
-        for provider in _public_providers():
-            provider_name = provider.__name__
-            for model in _provider_models(provider):
-                try:
-                    if ModelUtils.get_model(model) is None:
-                        continue
-                except Exception:
-                    continue
-
-                entry = seen_models.setdefault(model, {
-                    "id": model,
-                    "object": "model",
-                    "type": "chat",
-                    "owned_by": "g4f",
-                    "providers": []
-                })
-                if provider_name not in entry["providers"]:
-                    entry["providers"].append(provider_name)
-
-        model_list = sorted(seen_models.values(), key=lambda x: x["id"].lower())
-        result = {"data": model_list, "object": "list", "total": len(model_list)}
-        _set_cache(result)
-        return result
+        return encoded_response(http_request, catalog.get().encoded["models"])
     except Exception as e:
         logger.exception("Failed to list models")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/v1/models/all")
-async def list_all_models_with_providers():
+async def list_all_models_with_providers(http_request: Request):
     """Lista TODOS os modelos organizados por provider"""
     try:
-        providers_with_models = []
-        all_unique_models = set()
-
-        for provider in _public_providers():
-            provider_models = _provider_models(provider)
-            if not provider_models:
-                continue
-
-            for mdl in provider_models:
-                all_unique_models.add(mdl)
-
-            providers_with_models.append({
-                "provider": provider.__name__,
-                "models": sorted(provider_models),
-                "count": len(provider_models),
-                "url": getattr(provider, "url", None)
-            })
-
-        providers_with_models.sort(key=lambda x: -x["count"])
-        return {
-            "data": providers_with_models,
-            "total_providers": len(providers_with_models),
-            "total_unique_models": len(all_unique_models),
-            "object": "list"
-        }
+        return encoded_response(http_request, catalog.get().encoded["all_models"])
     except Exception as e:
         logger.exception("Failed to list providers with models")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/v1/providers")
-async def list_providers():
-    """Lista todos os providers disponíveis"""
+async def list_providers(http_request: Request, sort: Optional[str] = None, min_success: Optional[float] = None,
+                         max_ttft: Optional[float] = None, probed: bool = False):
+    """Lista todos os providers disponíveis (mesmos filtros de desempenho de /v1/models)"""
+    if _performance_filters(sort, min_success, max_ttft, probed):
+        return rank_providers(catalog.get().providers_payload, prober, sort, min_success, max_ttft, probed)
     try:
-        providers_list = []
-
-        for provider in _public_providers():
-            providers_list.append({
-                "id": provider.__name__,
-                "working": provider.working,
-                "needs_auth": getattr(provider, "needs_auth", False),
-                "supports_stream": getattr(provider, "supports_stream", True),
-                "url": getattr(provider, "url", None),
-                "models": _provider_models(provider)
-            })
-
-        return {"data": providers_list, "object": "list"}
+        return encoded_response(http_request, catalog.get().encoded["providers"])
     except Exception as e:
         logger.exception("Failed to list providers")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/v1/routing")
+async def routing_stats():
+    """Placar do roteador: TTFT, latência p50/p99 e taxa de sucesso por provider e modelo"""
+    stats = router.snapshot()
+    stats["hedging"] = hedge_limiter.snapshot()
+    stats["breakers"] = breakers.snapshot()
+    return stats
+
+@app.get("/v1/probes")
+async def probe_stats():
+    """Histórico resumido das sondagens: sucesso, TTFT e tokens/s por provider e modelo"""
+    if prober is None:
+        return {"enabled": False, "data": [], "object": "list"}
+    return {"enabled": True, **prober.snapshot()}
+
+@app.post("/v1/probes/run", status_code=202)
+async def run_probes():
+    """Dispara uma rodada de sondagem agora (sem esperar o intervalo)"""
+    if prober is None:
+        raise HTTPException(status_code=400, detail="Sondagem desativada (PROBE_ENABLED=0)")
+    if not prober.trigger():
+        raise HTTPException(status_code=409, detail="Já existe uma rodada de sondagem em andamento")
+    return {"started": True}
+
+@app.get("/v1/cache")
+async def cache_stats():
+    """Estado do cache de respostas (entradas, bytes, hits/misses) e da coalescência"""
+    stats = response_cache.snapshot()
+    stats["singleflight"] = coalescer.snapshot()
+    stats["similar"] = similar_cache.snapshot()
+    stats["images"] = image_store.snapshot()
+    stats["context"] = context_budget.snapshot()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Métricas no formato de exposição do Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/v1/admission")
+async def admission_stats():
+    """Ocupação, profundidade de fila e tempos de espera dos limites de concorrência"""
+    stats = admission.snapshot()
+    stats["images"] = image_gate.snapshot()
+    return stats
+
+def _cache_bypassed(request: ChatCompletionRequest, http_request: Optional[Request]) -> bool:
+    if not response_cache.enabled or request.cache is False:
+        return True
+    cache_control = http_request.headers.get("cache-control", "").lower() if http_request else ""
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+def _stream_usage_enabled(request: ChatCompletionRequest) -> bool:
+    if request.stream_options and "include_usage" in request.stream_options:
+        return bool(request.stream_options["include_usage"])
+    return STREAM_INCLUDE_USAGE
+
+def _completion_payload(request: ChatCompletionRequest, content: str, used_provider: str,
+                        messages: List[Dict[str, str]], completion_tokens: Optional[int] = None):
+    """`completion_tokens` já contado no upstream evita recontar a resposta inteira"""
+    prompt_tokens = tokenizer.count_messages(messages, request.model)
+    if completion_tokens is None:
+        completion_tokens = _count_tokens(content, request.model)
+    return {
+        "id": new_completion_id(),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": content
+            },
+            "finish_reason": "stop"
+        }],
+        "usage": tokenizer.usage(prompt_tokens, completion_tokens),
+        "provider": used_provider
+    }
+
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest):
+async def chat_completions(
+    request: ChatCompletionRequest,
+    http_request: Request = None,
+    http_response: Response = None
+):
     """Endpoint de chat completions compatível com OpenAI"""
+    return await _chat_completion(request, http_request, http_response)
+
+async def _chat_completion(
+    request: ChatCompletionRequest,
+    http_request: Optional[Request] = None,
+    http_response: Optional[Response] = None,
+    preferred: Optional[object] = None
+):
+    """Fluxo completo de uma completion; `preferred` é o provider sugerido quando a requisição não fixa um"""
+    deadline = time.perf_counter() + REQUEST_DEADLINE
     try:
         messages = [{"role": m.role, "content": m.content} for m in request.messages]
         
@@ -249,198 +551,1040 @@ async def chat_completions(request: ChatCompletionRequest):
             provider = prov_from_model
 
         model_to_use = None if (not normalized_model or normalized_model == "auto") else normalized_model
+        # Encaixa o histórico na janela do modelo (reservando max_tokens para a resposta)
+        with tracing.span("context"):
+            compaction = context_budget.compact(messages, normalized_model, request.max_tokens)
+        messages = compaction.messages
+        if compaction.changed:
+            logger.info("[G4F] Contexto compactado: %s mensagens recolhidas, %s tokens (orçamento %s)%s",
+                        compaction.collapsed, compaction.tokens, compaction.budget,
+                        " com truncamento" if compaction.truncated else "")
+        # Tokens do prompt só são contados quando o stream vai reportar `usage`
+        prompt_tokens = None
+        if request.stream and _stream_usage_enabled(request):
+            prompt_tokens = tokenizer.count_messages(messages, request.model)
 
-        if model_to_use and ModelUtils.get_model(model_to_use) is None:
+        if model_to_use and not catalog.get().is_known_model(model_to_use):
             logger.warning("Modelo '%s' não encontrado, usando auto", model_to_use)
             model_to_use = None
 
-        if model_to_use is None and provider is None:
-            for candidate in _public_providers():
-                if getattr(candidate, "url", None):
-                    provider = candidate
-                    logger.info("[G4F] Usando provider fallback: %s", candidate.__name__)
-                    break
+        # Chave canônica da requisição: usada pelo cache de respostas e pela coalescência
+        key = cache_key(request.model, request.provider, messages,
+                        request.temperature, request.max_tokens, request.web_search)
+
+        # Cache de respostas: hits também atendem streams, reproduzindo o texto como SSE
+        headers = {"X-Cache": "BYPASS"}
+        use_cache = not _cache_bypassed(request, http_request)
+        if use_cache:
+            with tracing.span("cache"):
+                cached = response_cache.get(key)
+            headers = {"X-Cache": "HIT"}
+            fingerprint = similar_cache.fingerprint(
+                messages, model=request.model, provider=(request.provider or "").lower(),
+                temperature=request.temperature, max_tokens=request.max_tokens, web_search=request.web_search
+            ) if cached is None else None
+            if fingerprint is not None:
+                with tracing.span("similar"):
+                    similar_key, score = similar_cache.lookup(fingerprint, response_cache.contains)
+                if score:
+                    SIMILAR_SCORE.observe(score)
+                if similar_key is not None:
+                    # Uma requisição conta uma vez só: o miss da chave exata vira hit
+                    cached = response_cache.get(similar_key, count=False)
+                    if cached is not None:
+                        response_cache.similar_hit()
+                    headers = {"X-Cache": "SIMILAR", "X-Cache-Similarity": f"{score:.3f}"}
+            if cached is not None:
+                headers["Age"] = str(int(cached.age))
+                if request.stream:
+                    return StreamingResponse(
+                        stream_chat_response(
+                            _replay_contents(cached.content), model_to_use, prompt_tokens, http_request,
+                            {"completion_tokens": _count_tokens(cached.content, model_to_use)} if prompt_tokens is not None else None
+                        ),
+                        media_type="text/event-stream",
+                        headers=headers
+                    )
+                if http_response is not None:
+                    http_response.headers.update(headers)
+                return _completion_payload(request, cached.content, cached.provider or "g4f", messages)
+            headers = {"X-Cache": "MISS"}
+            if fingerprint is not None:
+                # Indexa já na ida: a consulta só aceita a entrada quando a resposta estiver no cache exato
+                similar_cache.add(key, fingerprint)
+        if compaction.changed:
+            headers["X-Context-Compacted"] = f"collapsed={compaction.collapsed}; tokens={compaction.tokens}"
+
+        pinned = provider is not None
+        if pinned:
+            # Provider fixado com circuito aberto: falha na hora em vez de esperar o erro
+            breakers.check(provider)
+        hedge_providers = None
+        if request.stream and not pinned and hedge_width(request.hedge) > 1:
+            hedge_providers = router.rank(_route_candidates(model_to_use), model_to_use)[:hedge_width(request.hedge)]
+            if len(hedge_providers) > 1:
+                provider = hedge_providers[0]
+                logger.info("[G4F] Hedge entre: %s", ", ".join(p.__name__ for p in hedge_providers))
+            else:
+                hedge_providers = None
+
+        if provider is None and preferred is not None:
+            provider = preferred
+        if provider is None:
+            # No modo auto sempre escolhe o melhor candidato; com modelo explícito só
+            # força um provider quando já há medições saudáveis (senão o g4f decide)
+            with tracing.span("route"):
+                provider = router.best(
+                    _route_candidates(model_to_use),
+                    model_to_use,
+                    measured_only=model_to_use is not None
+                )
+            if provider:
+                logger.info("[G4F] Provider escolhido pelo roteador: %s", provider.__name__)
 
         logger.info("[G4F] Usando model=%s, provider=%s", model_to_use, provider.__name__ if provider else None)
-        if request.stream:
-            return StreamingResponse(
-                stream_chat_response(
+        store_key = key if use_cache else None
+        # Cadeia de fallback (só quando o provider foi escolhido pelo servidor)
+        fallbacks = [] if pinned or provider is None else _fallback_chain(model_to_use, hedge_providers or [provider])
+
+        # Backpressure: quem vai ao upstream reserva vaga global + do provider antes
+        # (seguidores de uma chamada já em voo não ocupam vaga)
+        # Stream e não-stream têm upstreams de formato diferente: só coalescem com o mesmo modo
+        flight_key = f"{key}:{'stream' if request.stream else 'complete'}"
+        slot = None
+        if not (coalescer.enabled and coalescer.active(flight_key)):
+            with tracing.span("queue"):
+                slot = await admission.admit(provider.__name__ if provider else None)
+            if slot.waited:
+                headers["X-Queue-Time"] = f"{slot.waited * 1000:.0f}"
+
+        def upstream(meta: Dict[str, object]) -> AsyncIterator[str]:
+            return release_after(_upstream_source(meta), slot)
+
+        def _upstream_source(meta: Dict[str, object]) -> AsyncIterator[str]:
+            if request.stream:
+                return upstream_stream(
                     model=model_to_use,
                     messages=messages,
                     provider=provider,
-                    temperature=request.temperature,
-                    max_tokens=request.max_tokens,
-                    web_search=request.web_search
-                ),
-                media_type="text/event-stream"
-            )
-        else:
-            # Resposta não-streaming - usa AsyncClient corretamente
-            # Baseado no exemplo oficial: etc/examples/text_completions_demo_async.py
-            response = await client.chat.completions.create(
+                    web_search=request.web_search,
+                    hedge_providers=hedge_providers,
+                    hedge_delay=request.hedge_delay,
+                    cache_key=store_key,
+                    meta=meta,
+                    fallbacks=fallbacks,
+                    deadline=deadline
+                )
+            return upstream_complete(
                 model=model_to_use,
                 messages=messages,
                 provider=provider,
-                web_search=request.web_search
+                web_search=request.web_search,
+                cache_key=store_key,
+                meta=meta,
+                fallbacks=fallbacks,
+                deadline=deadline
             )
-            
-            # Extrai conteúdo da resposta
-            content = ""
-            if hasattr(response, 'choices') and response.choices:
-                if hasattr(response.choices[0], 'message'):
-                    content = response.choices[0].message.content or ""
-            
-            # Obtém provider usado
-            used_provider = "g4f"
-            if hasattr(response, 'provider'):
-                used_provider = str(response.provider)
-            
-            return {
-                "id": f"chatcmpl-{id(response)}",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": content
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": sum(len(m.content.split()) for m in request.messages),
-                    "completion_tokens": len(content.split()) if content else 0,
-                    "total_tokens": 0
-                },
-                "provider": used_provider
-            }
-            
+
+        # Requisições idênticas em voo compartilham uma única chamada upstream
+        if coalescer.enabled:
+            flight, leader = coalescer.join(flight_key, upstream)
+            headers["X-Coalesced"] = "leader" if leader else "follower"
+            if not leader and slot is not None:
+                slot.release()
+            meta, contents = flight.meta, flight.subscribe()
+        else:
+            meta = {}
+            contents = upstream(meta)
+
+        if request.stream:
+            return UpstreamStreamingResponse(
+                stream_chat_response(contents, model_to_use, prompt_tokens, http_request, meta),
+                upstream=contents,
+                media_type="text/event-stream",
+                headers=headers
+            )
+
+        with tracing.span("upstream"):
+            content = "".join([piece async for piece in contents])
+        if http_response is not None:
+            http_response.headers.update(headers)
+        return _completion_payload(request, content, str(meta.get("provider") or "g4f"), messages,
+                                   meta.get("completion_tokens"))
+
+    except AdmissionRejected as e:
+        ERRORS_TOTAL.inc("chat", f"rejected_{e.status_code}")
+        logger.warning("[G4F] Requisição recusada (%s): %s", e.status_code, e)
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except CircuitOpenError as e:
+        ERRORS_TOTAL.inc("chat", "circuit_open")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except TimeoutError as e:
+        ERRORS_TOTAL.inc("chat", getattr(e, "phase", "timeout"))
+        logger.warning("[G4F] Timeout na completion: %s", e)
+        raise HTTPException(status_code=504, detail=str(e) or "Timeout aguardando o provider")
     except Exception as e:
-            logger.exception("Chat completion failed")
+        ERRORS_TOTAL.inc("chat", type(e).__name__)
+        logger.exception("Chat completion failed")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def stream_chat_response(
+# ============ STREAMS MULTIPLEXADOS (WEBSOCKET) ============
+
+async def _ws_open_stream(payload: Dict[str, object]):
+    """
+    Abre um stream pelo mesmo fluxo do /v1/chat/completions e devolve os
+    headers, os frames SSE e o iterador upstream (None em hit de cache), que
+    precisa ser fechado à parte caso os frames nunca comecem a ser lidos
+    """
+    try:
+        request = ChatCompletionRequest(**payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    request.stream = True
+    response = await _chat_completion(request)
+    headers = {name: value for name, value in response.headers.items() if name.startswith("x-") or name == "age"}
+    return headers, response.body_iterator, getattr(response, "upstream", None)
+
+@app.websocket("/v1/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """Vários streams de chat concorrentes numa conexão (protocolo em multiplex.py)"""
+    await StreamMux(websocket, _ws_open_stream).run()
+
+# ============ LOTE DE CHAT COMPLETIONS ============
+
+def _spread_provider(request: ChatCompletionRequest, inflight: Dict[str, int]):
+    """
+    Provider para um item do lote: entre os BATCH_SPREAD melhores do roteador,
+    prefere quem tem vaga livre no controle de admissão e menos itens em voo.
+    Retorna None quando a requisição fixa o provider (ou não há medições, no
+    caso de modelo explícito), deixando a decisão para o fluxo normal.
+    """
+    if request.provider:
+        return None
+    prov_from_model, normalized_model = _normalize_model_and_provider(request.model)
+    if prov_from_model:
+        return None
+    model = None if (not normalized_model or normalized_model == "auto") else normalized_model
+    if model and not catalog.get().is_known_model(model):
+        model = None
+    ranked = router.rank(_route_candidates(model), model)
+    if model is not None:
+        ranked = [p for p in ranked if router.is_healthy(p, model)]
+    top = ranked[:BATCH_SPREAD]
+    if not top:
+        return None
+
+    def load(provider):
+        gate = admission.gate(provider.__name__)
+        return (gate.in_use >= gate.limit, inflight.get(provider.__name__, 0))
+
+    # min é estável: em empate fica a ordem do roteador
+    return min(top, key=load)
+
+async def _batch_item(index: int, request: ChatCompletionRequest, inflight: Dict[str, int]) -> Dict[str, object]:
+    request.stream = False
+    preferred = _spread_provider(request, inflight)
+    name = preferred.__name__ if preferred else None
+    if name:
+        inflight[name] = inflight.get(name, 0) + 1
+    try:
+        response = await _chat_completion(request, preferred=preferred)
+        return {"index": index, "status": 200, "response": response}
+    except HTTPException as e:
+        error = {"message": e.detail}
+        if e.headers and "Retry-After" in e.headers:
+            error["retry_after"] = int(e.headers["Retry-After"])
+        return {"index": index, "status": e.status_code, "error": error}
+    except Exception as e:
+        return {"index": index, "status": 500, "error": {"message": str(e)}}
+    finally:
+        if name:
+            inflight[name] -= 1
+
+async def _run_batch(requests: List[ChatCompletionRequest], parallelism: int) -> AsyncGenerator[bytes, None]:
+    """Executa o lote com até `parallelism` itens simultâneos; emite NDJSON na ordem de conclusão"""
+    pending = iter(enumerate(requests))
+    results: asyncio.Queue = asyncio.Queue()
+    inflight: Dict[str, int] = {}
+
+    async def worker():
+        # Os workers compartilham o mesmo iterador: cada item é pego por um só
+        for index, item in pending:
+            results.put_nowait(await _batch_item(index, item, inflight))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(parallelism, len(requests)))]
+    try:
+        for _ in range(len(requests)):
+            yield dumps(await results.get()) + b"\n"
+    finally:
+        # Cliente desconectou (ou fim do lote): cancela o que ainda está em andamento
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+@app.post("/v1/chat/completions/batch")
+async def batch_chat_completions(batch: BatchChatCompletionRequest):
+    """Lote de chat completions (sem streaming); resultados em NDJSON com o índice original"""
+    if not batch.requests:
+        raise HTTPException(status_code=400, detail="Lote vazio")
+    if len(batch.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=413, detail=f"Lote acima de {BATCH_MAX_REQUESTS} requisições")
+    parallelism = max(1, min(batch.parallelism or BATCH_PARALLELISM, BATCH_MAX_PARALLELISM))
+    return StreamingResponse(
+        _run_batch(batch.requests, parallelism),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Parallelism": str(parallelism)}
+    )
+
+async def _replay_contents(content: str) -> AsyncGenerator[str, None]:
+    """Reproduz uma resposta em cache em pedaços, como se viesse do upstream"""
+    for piece in replay_pieces(content):
+        yield piece
+
+def _chunk_content(chunk) -> Optional[str]:
+    """Extrai o texto de um chunk de stream (None se o chunk não tiver conteúdo)"""
+    try:
+        # Tenta extrair conteúdo do delta (forma comum em streams)
+        content = None
+        if getattr(chunk, 'choices', None):
+            choice = chunk.choices[0]
+            # delta.content costuma ser usado em streams incrementais
+            delta = getattr(choice, 'delta', None)
+            if delta and getattr(delta, 'content', None):
+                content = delta.content
+            # alguns providers retornam message.content diretamente
+            if not content and getattr(choice, 'message', None):
+                content = getattr(choice.message, 'content', None)
+        return content
+    except (AttributeError, IndexError):
+        # Chunk sem conteúdo, ignora
+        return None
+
+async def upstream_complete(
     model: Optional[str],
     messages: List[Dict],
     provider: Optional[object] = None,
-    temperature: Optional[float] = None,
-    max_tokens: Optional[int] = None,
-    web_search: bool = False
+    web_search: bool = False,
+    cache_key: Optional[str] = None,
+    meta: Optional[Dict[str, object]] = None,
+    fallbacks: Optional[List[object]] = None,
+    deadline: Optional[float] = None
 ) -> AsyncGenerator[str, None]:
-    """Gera resposta em streaming - baseado no exemplo oficial messages_stream.py"""
-    try:
+    """
+    Chamada não-streaming ao upstream; emite a resposta inteira como um único
+    pedaço. Se o provider falhar tenta os `fallbacks` em ordem, todos dentro do
+    prazo `deadline` (relógio perf_counter).
+
+    Só UPSTREAM_TOTAL_TIMEOUT (e o prazo) vale aqui: sem streaming o g4f não
+    expõe conexão nem primeiro token, só a resposta pronta, então os limites
+    de conexão, primeiro token e ociosidade são exclusivos do `upstream_stream`.
+    """
+    meta = meta if meta is not None else {}
+    deadline = deadline or time.perf_counter() + REQUEST_DEADLINE
+    content, response, attempt, error = "", None, provider, None
+
+    for attempt in [provider, *(fallbacks or [])]:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            error = error or TimeoutError("Prazo da requisição esgotado")
+            break
+        try:
+            slot = _reserve_attempt(attempt, provider)
+        except AdmissionRejected as e:
+            # Fallback sem vaga no provider: pula para o próximo
+            error = error or e
+            continue
+        if not breakers.acquire(attempt):
+            if slot is not None:
+                slot.release()
+            continue
+        if error is not None:
+            ERRORS_TOTAL.inc("fallback", type(error).__name__)
+            logger.warning("[G4F] Tentando fallback %s após: %s", getattr(attempt, "__name__", attempt), error)
+        # Resposta não-streaming - usa AsyncClient corretamente
+        # Baseado no exemplo oficial: etc/examples/text_completions_demo_async.py
+        # Sem streaming o g4f só devolve a resposta inteira: vale o limite total por tentativa
+        limit = min(remaining, UPSTREAM_TOTAL_TIMEOUT) if UPSTREAM_TOTAL_TIMEOUT > 0 else remaining
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    provider=attempt,
+                    web_search=web_search
+                ),
+                timeout=limit
+            )
+        except asyncio.CancelledError:
+            # Cliente saiu / voo abandonado: a chamada não tem resultado
+            breakers.release(attempt)
+            raise
+        except asyncio.TimeoutError:
+            if time.perf_counter() - started < limit * 0.99:
+                # TimeoutError do próprio provider: falha comum, segue para o fallback
+                _record_outcome(attempt, model, ok=False, error="TimeoutError")
+                error = TimeoutError(f"Timeout no provider {getattr(attempt, '__name__', attempt)}")
+                continue
+            _record_outcome(attempt, model, ok=False, error="Timeout")
+            if limit < remaining:
+                error = UpstreamTimeout("total", limit)
+                continue
+            error = TimeoutError("Prazo da requisição esgotado aguardando o provider")
+            break
+        except Exception as e:
+            _record_outcome(attempt, model, ok=False, error=type(e).__name__)
+            error = e
+            continue
+        finally:
+            if slot is not None:
+                slot.release()
+
+        # Extrai conteúdo da resposta
+        content = ""
+        if hasattr(response, 'choices') and response.choices:
+            if hasattr(response.choices[0], 'message'):
+                content = response.choices[0].message.content or ""
+
+        total = time.perf_counter() - started
+        _record_outcome(
+            attempt or getattr(response, 'provider', None),
+            model,
+            ok=bool(content),
+            total=total,
+            error=None if content else "EmptyResponse"
+        )
+        if content:
+            meta["completion_tokens"] = _count_tokens(content, model)
+            _observe_completion("chat", attempt or getattr(response, 'provider', None), model, total,
+                                tokens=meta["completion_tokens"])
+            break
+        error = None
+
+    if not content and error is not None:
+        raise error
+    if response is None:
+        raise CircuitOpenError(getattr(provider, "__name__", str(provider)), breakers.get(provider).retry_after())
+
+    # Obtém provider usado
+    used_provider = "g4f"
+    if hasattr(response, 'provider'):
+        used_provider = str(response.provider)
+    meta["provider"] = used_provider
+
+    if cache_key is not None and content:
+        response_cache.set(cache_key, content, used_provider)
+    yield content
+
+async def upstream_stream(
+    model: Optional[str],
+    messages: List[Dict],
+    provider: Optional[object] = None,
+    web_search: bool = False,
+    hedge_providers: Optional[List[object]] = None,
+    hedge_delay: Optional[float] = None,
+    cache_key: Optional[str] = None,
+    meta: Optional[Dict[str, object]] = None,
+    fallbacks: Optional[List[object]] = None,
+    deadline: Optional[float] = None
+) -> AsyncGenerator[str, None]:
+    """
+    Chamada streaming ao upstream (com hedge opcional); emite o texto de cada
+    chunk. Até o primeiro texto chegar, falhas passam para o próximo provider
+    dos `fallbacks` dentro do prazo `deadline`; depois disso o erro é repassado.
+    """
+    meta = meta if meta is not None else {}
+    deadline = deadline or time.perf_counter() + REQUEST_DEADLINE
+    started = time.perf_counter()
+    ttft = None
+    counter = tokenizer.StreamCounter(model)
+    parts: List[str] = []
+    # Vagas de provider das tentativas extras (hedge/fallback) ainda abertas
+    attempt_slots: Dict[object, Slot] = {}
+
+    def release_attempt(candidate):
+        slot = attempt_slots.pop(candidate, None)
+        if slot is not None:
+            slot.release()
+
+    def open_stream(candidate):
+        # Vagas (do provider e do breaker) só são reservadas quando o candidato de fato abre
+        # (no hedge nem todos abrem)
+        try:
+            slot = _reserve_attempt(candidate, provider)
+        except AdmissionRejected as e:
+            return _failed_stream(e)
+        if slot is not None:
+            attempt_slots[candidate] = slot
+        if not breakers.acquire(candidate):
+            release_attempt(candidate)
+            return _failed_stream(CircuitOpenError(getattr(candidate, "__name__", str(candidate)),
+                                                   breakers.get(candidate).retry_after()))
         # Cria o stream - se `model` for None deixa como None (auto), caso contrário usa o valor já normalizado
-        stream = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            provider=provider,
-            stream=True,
-            web_search=web_search
+        # Limites de conexão/primeiro token/ociosidade/total (UPSTREAM_*_TIMEOUT) por provider
+        return with_timeouts(
+            get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                provider=candidate,
+                stream=True,
+                web_search=web_search
+            ),
+            has_content=lambda c: bool(_chunk_content(c))
         )
 
+    def attempt_failed(candidate, hedged: bool, e: BaseException):
+        release_attempt(candidate)
+        if isinstance(e, (CircuitOpenError, AdmissionRejected)):
+            return
+        _record_outcome(candidate, model, ok=False, error=type(e).__name__)
+        if hedged:
+            ERRORS_TOTAL.inc("hedge", type(e).__name__)
+
+    # Cada grupo é uma tentativa: o primeiro pode ser uma corrida (hedge) entre vários providers
+    groups = [hedge_providers if hedge_providers and len(hedge_providers) > 1 else [provider]]
+    groups += [[p] for p in fallbacks or []]
+    result, group, error = None, [], None
+    for group in groups:
+        group = [p for p in group if breakers.available(p) and _has_room(p, provider)]
+        if not group:
+            continue
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            error = error or TimeoutError("Prazo da requisição esgotado")
+            break
+        if error is not None:
+            ERRORS_TOTAL.inc("fallback", type(error).__name__)
+            logger.warning("[G4F] Tentando fallback %s após: %s", getattr(group[0], "__name__", group[0]), error)
+        hedged = len(group) > 1
+        race = asyncio.ensure_future(race_first_chunk(
+            [lambda p=p: open_stream(p) for p in group],
+            has_content=lambda c: bool(_chunk_content(c)),
+            limiter=hedge_limiter,
+            delay=hedge_delay,
+            on_error=lambda i, e, g=group, h=hedged: attempt_failed(g[i], h, e),
+            # Perdedores do hedge (e candidatos de uma corrida cancelada) não têm resultado
+            on_cancel=lambda i, g=group: (breakers.release(g[i]), release_attempt(g[i]))
+        ))
+        try:
+            done, _ = await asyncio.wait({race}, timeout=remaining)
+        except BaseException:
+            race.cancel()
+            await asyncio.gather(race, return_exceptions=True)
+            for candidate in list(attempt_slots):
+                release_attempt(candidate)
+            raise
+        if not done:
+            # Prazo estourou esperando o primeiro texto: a corrida fecha os streams abertos
+            race.cancel()
+            await asyncio.gather(race, return_exceptions=True)
+            for candidate in group:
+                _record_outcome(candidate, model, ok=False, error="Timeout")
+            error = TimeoutError("Prazo da requisição esgotado aguardando o primeiro token")
+            break
+        if race.exception() is not None:
+            error = race.exception()
+            continue
+        result = race.result()
+        break
+    # Até o primeiro texto (inclui corrida do hedge e fallbacks)
+    tracing.record("ttft", time.perf_counter() - started)
+    winner = group[result.index] if result is not None else None
+    for candidate in [c for c in attempt_slots if c is not winner]:
+        release_attempt(candidate)
+
+    if result is None:
+        if error is not None:
+            raise error
+        raise CircuitOpenError(getattr(provider, "__name__", str(provider)), breakers.get(provider).retry_after())
+
+    used_provider = group[result.index]
+    if hedged:
+        logger.info("[G4F] Hedge vencido por %s", used_provider.__name__)
+    stream = prepend_chunk(result.first_chunk, result.stream)
+
+    try:
         # Itera sobre os chunks do stream
         async for chunk in stream:
-            try:
-                # Tenta extrair conteúdo do delta (forma comum em streams)
-                content = None
-                if getattr(chunk, 'choices', None):
-                    choice = chunk.choices[0]
-                    # delta.content costuma ser usado em streams incrementais
-                    delta = getattr(choice, 'delta', None)
-                    if delta and getattr(delta, 'content', None):
-                        content = delta.content
-                    # alguns providers retornam message.content diretamente
-                    if not content and getattr(choice, 'message', None):
-                        content = getattr(choice.message, 'content', None)
+            content = _chunk_content(chunk)
+            if content:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    used_provider = used_provider or getattr(chunk, 'provider', None)
+                    meta["provider"] = getattr(used_provider, '__name__', used_provider)
+                counter.feed(content)
+                if cache_key is not None:
+                    parts.append(content)
+                yield content
+    except Exception as e:
+        _record_outcome(used_provider, model, ok=False, error=type(e).__name__)
+        raise
+    except BaseException:
+        # Cancelado ou fechado antes do fim (cliente saiu): sem resultado, só devolve a vaga
+        breakers.release(used_provider)
+        raise
+    finally:
+        # Fechamento antecipado (cliente saiu, cancelamento): fecha já o stream do provider
+        await close_stream(stream)
+        release_attempt(used_provider)
+
+    total = time.perf_counter() - started
+    _record_outcome(
+        used_provider,
+        model,
+        ok=ttft is not None,
+        ttft=ttft,
+        total=total,
+        error=None if ttft is not None else "EmptyResponse"
+    )
+    # Contagem única do stream: também alimenta o chunk de `usage` de stream_chat_response
+    meta["completion_tokens"] = counter.total
+    _observe_completion("stream", used_provider, model, total, ttft=ttft, tokens=meta["completion_tokens"])
+    if cache_key is not None and parts:
+        response_cache.set(cache_key, "".join(parts), meta.get("provider"))
+
+async def _failed_stream(error: Exception) -> AsyncGenerator[object, None]:
+    """Stream de um candidato que não pôde ser disparado (circuito aberto, provider sem vaga)"""
+    raise error
+    yield
+
+def _watch_disconnect(http_request: Optional[Request]) -> Optional[asyncio.Task]:
+    """
+    Com ASGI < 2.4 o Starlette já cancela o stream quando o cliente desconecta.
+    Em servidores ASGI >= 2.4 a desconexão só apareceria no próximo envio, então
+    vigia o `receive` e cancela a task do stream assim que o cliente sai.
+    """
+    if http_request is None:
+        return None
+    spec = http_request.scope.get("asgi", {}).get("spec_version", "2.0")
+    if tuple(int(part) for part in spec.split(".")) < (2, 4):
+        return None
+    stream_task = asyncio.current_task()
+
+    async def watch():
+        while True:
+            message = await http_request.receive()
+            if message["type"] == "http.disconnect":
+                stream_task.cancel()
+                return
 
+    return asyncio.ensure_future(watch())
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que sempre fecha o iterador upstream (liberando a vaga de
+    admissão) ao fim da resposta, inclusive quando o cliente sai antes de o
+    corpo começar a ser iterado e o `finally` do gerador nunca chega a rodar.
+    """
+
+    def __init__(self, content, upstream: AsyncIterator[str], **kwargs):
+        super().__init__(content, **kwargs)
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+async def stream_chat_response(
+    contents: AsyncIterator[str],
+    model: Optional[str],
+    prompt_tokens: Optional[int] = None,
+    http_request: Optional[Request] = None,
+    meta: Optional[Dict[str, object]] = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    Gera resposta em streaming - baseado no exemplo oficial messages_stream.py.
+    O `usage` final usa meta["completion_tokens"] (contado uma vez no upstream);
+    sem `meta` a completion é contada aqui.
+    """
+    encoder = ChunkEncoder(model)
+    trace = tracing.current()
+    started = time.perf_counter()
+    # Contagem incremental da completion para o chunk de `usage` (só se pedido e não vier do upstream)
+    counter = tokenizer.StreamCounter(model) if prompt_tokens is not None and meta is None else None
+    pending = None
+    watcher = _watch_disconnect(http_request)
+    INFLIGHT_STREAMS.inc()
+    try:
+        if not encoder.coalescing:
+            async for content in contents:
                 if content:
-                    data = {
-                        "id": f"chatcmpl-{id(chunk)}",
-                        "object": "chat.completion.chunk",
-                        "model": model or "auto",
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"content": content},
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
-            except (AttributeError, IndexError):
-                # Chunk sem conteúdo, ignora
-                continue
+                    if counter is not None:
+                        counter.feed(content)
+                    if trace is None:
+                        yield encoder.frame(content)
+                        continue
+                    encode_started = time.perf_counter()
+                    frame = encoder.frame(content)
+                    trace.add("encode", time.perf_counter() - encode_started)
+                    yield frame
+        else:
+            # Com janela de tempo, espera o próximo delta só até o buffer vencer
+            iterator = contents.__aiter__()
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                done, _ = await asyncio.wait({pending}, timeout=encoder.time_to_flush())
+                if not done:
+                    frame = encoder.flush()
+                    if frame:
+                        yield frame
+                    continue
+                finished, pending = pending, None
+                try:
+                    content = finished.result()
+                except StopAsyncIteration:
+                    break
+                if content:
+                    if counter is not None:
+                        counter.feed(content)
+                    encode_started = time.perf_counter() if trace is not None else None
+                    frame = encoder.feed(content)
+                    if encode_started is not None:
+                        trace.add("encode", time.perf_counter() - encode_started)
+                    if frame:
+                        yield frame
+            frame = encoder.flush()
+            if frame:
+                yield frame
 
-        # Envia chunk final com finish_reason
-        final_data = {
-            "id": f"chatcmpl-final",
-            "object": "chat.completion.chunk",
-            "model": model or "auto",
-            "choices": [{
-                "index": 0,
-                "delta": {},
-                "finish_reason": "stop"
-            }]
-        }
-        yield f"data: {json.dumps(final_data)}\n\n"
+        # Envia chunk final com finish_reason e [DONE] para sinalizar fim do stream
+        yield encoder.final()
+        if prompt_tokens is not None:
+            completion_tokens = counter.total if counter is not None else meta.get("completion_tokens") or 0
+            yield encoder.usage(tokenizer.usage(prompt_tokens, completion_tokens))
+        yield DONE_FRAME
 
-        # Envia [DONE] para sinalizar fim do stream
-        yield "data: [DONE]\n\n"
+    except asyncio.CancelledError:
+        # Cliente desconectou: o finally abaixo já cancela o upstream
+        CLIENT_DISCONNECTS.inc()
+        if watcher is not None and watcher.done():
+            # Cancelamento foi nosso (vigia de desconexão): encerra o stream normalmente
+            task = asyncio.current_task()
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            return
+        raise
+    except Exception as e:
+        ERRORS_TOTAL.inc("stream", type(e).__name__)
+        yield encoder.error(str(e), "timeout_error" if isinstance(e, TimeoutError) else "server_error")
+        yield DONE_FRAME
+    finally:
+        INFLIGHT_STREAMS.dec()
+        tracing.record("stream", time.perf_counter() - started)
+        if watcher is not None:
+            watcher.cancel()
+        # Cliente desconectou (ou fim normal): libera o iterador de origem
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(contents, "aclose", None)
+        if aclose is not None:
+            await aclose()
 
+async def _image_bytes(image) -> Optional[bytes]:
+    """Bytes de uma imagem da resposta do g4f (base64, data: URL ou download do link)"""
+    b64 = image.get("b64_json") if isinstance(image, dict) else getattr(image, "b64_json", None)
+    if b64:
+        return base64.b64decode(b64)
+    url = image.get("url") if isinstance(image, dict) else getattr(image, "url", None)
+    if not url:
+        return None
+    data = decode_data_url(url)
+    if data is not None or not url.startswith(("http://", "https://")):
+        return data
+    import aiohttp
+    try:
+        timeout = aiohttp.ClientTimeout(total=IMAGE_FETCH_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
     except Exception as e:
-        error_data = {"error": {"message": str(e), "type": "server_error"}}
-        yield f"data: {json.dumps(error_data)}\n\n"
-        yield "data: [DONE]\n\n"
+        logger.warning("[G4F] Falha ao baixar imagem gerada (%s): %s", url, e)
+        return None
+
+def _image_flight_done(key: str, task: asyncio.Task):
+    """Tira a geração do registro e lê a exceção, que fica sem dono se todos os clientes caíram"""
+    if _image_flights.get(key) is task:
+        del _image_flights[key]
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("[G4F] Geração de imagem falhou: %s", task.exception())
+
+async def _generate_images(request: ImageGenerationRequest, model: str, dimensions, key: str):
+    """
+    Gera (com vaga do gate de imagens) e guarda no blob store. Retorna
+    (itens, provider): cada item tem `blob` (guardado localmente) ou `url`
+    (link do provider, quando não foi possível obter os bytes).
+    """
+    # Provider explícito, senão o melhor já medido para o modelo de imagem (senão o g4f decide)
+    provider = _find_provider_by_name(request.provider)
+    if provider is not None:
+        breakers.check(provider)
+    else:
+        provider = router.best(_route_candidates(model), model, measured_only=True)
+    kwargs = {}
+    if dimensions:
+        kwargs["width"], kwargs["height"] = dimensions
+
+    await image_gate.acquire(admission.queue_timeout)
+    started = time.perf_counter()
+    try:
+        try:
+            response = await get_client().images.generate(
+                prompt=request.prompt,
+                model=model,
+                provider=provider,
+                **kwargs
+            )
+        except Exception as e:
+            _record_outcome(provider, model, ok=False, error=type(e).__name__)
+            raise
+        used_provider = getattr(response, "provider", None) or provider
+        images = response.data if hasattr(response, "data") else [response]
+
+        items = []
+        for image in images or []:
+            data = await _image_bytes(image)
+            if data and image_store.enabled:
+                # Só a escrita vai para a thread; o índice (LRU) é atualizado no event loop
+                name, size = await asyncio.to_thread(image_store.write, data)
+                items.append({"blob": image_store.add(name, size)})
+            else:
+                url = image.get("url") if isinstance(image, dict) else getattr(image, "url", None)
+                items.append({"url": url or ""})
+    finally:
+        image_gate.release(time.perf_counter() - started)
+
+    total = time.perf_counter() - started
+    _record_outcome(used_provider, model, ok=bool(items), total=total,
+                    error=None if items else "EmptyResponse")
+    _observe_completion("image", used_provider, model, total)
+    if items and all("blob" in item for item in items):
+        image_store.bind(key, [item["blob"] for item in items])
+    return items, getattr(used_provider, "__name__", used_provider)
+
+def _image_url(http_request: Optional[Request], name: str) -> str:
+    base = IMAGE_PUBLIC_URL or (str(http_request.base_url).rstrip("/") if http_request else "")
+    return f"{base}/v1/images/files/{name}"
 
 @app.post("/v1/images/generations")
-async def image_generations(request: ImageGenerationRequest):
+async def image_generations(
+    request: ImageGenerationRequest,
+    http_request: Request = None,
+    http_response: Response = None
+):
     """Endpoint de geração de imagens"""
     try:
-        response = await client.images.generate(
-            prompt=request.prompt,
-            model=request.model or "flux",
-        )
-        
-        return {
-            "created": int(asyncio.get_event_loop().time()),
-            "data": [
-                {"url": img.url if hasattr(img, 'url') else img.get('url', '')}
-                for img in (response.data if hasattr(response, 'data') else [response])
-            ]
-        }
+        dimensions = parse_size(request.size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    model = request.model or "flux"
+    key = image_key(request.prompt, model, request.size)
+
+    try:
+        # Mesmo prompt/modelo/tamanho já gerado: serve do disco sem chamar o provider
+        names = image_store.lookup(key) if image_store.enabled else None
+        if names is not None:
+            cache_status, provider_name = "HIT", None
+            items = [{"blob": name} for name in names]
+        else:
+            # Prompts idênticos simultâneos compartilham a mesma geração; o shield
+            # mantém a geração viva (e o resultado vai para o cache) se o cliente cair
+            task = _image_flights.get(key)
+            cache_status = "COALESCED" if task is not None else "MISS"
+            if task is None:
+                task = _image_flights[key] = asyncio.ensure_future(
+                    _generate_images(request, model, dimensions, key))
+                task.add_done_callback(partial(_image_flight_done, key))
+            items, provider_name = await asyncio.shield(task)
+
+        data = []
+        for item in items:
+            if "blob" not in item:
+                data.append({"url": item["url"]})
+            elif request.response_format == "b64_json":
+                path = image_store.path(item["blob"])
+                raw = await asyncio.to_thread(_read_file, path) if path else b""
+                data.append({"b64_json": base64.b64encode(raw).decode("ascii")})
+            else:
+                data.append({"url": _image_url(http_request, item["blob"])})
+
+        if http_response is not None:
+            http_response.headers["X-Cache"] = cache_status
+        result = {"created": int(time.time()), "data": data}
+        if provider_name:
+            result["provider"] = str(provider_name)
+        return result
+    except (AdmissionRejected, CircuitOpenError) as e:
+        ERRORS_TOTAL.inc("image", f"rejected_{e.status_code}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
+        ERRORS_TOTAL.inc("image", type(e).__name__)
         raise HTTPException(status_code=500, detail=str(e))
 
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+@app.get("/v1/images/files/{name}")
+async def image_file(name: str):
+    """Imagem gerada guardada localmente (endereçada pelo conteúdo: imutável)"""
+    path = image_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    return FileResponse(path, media_type=media_type(name),
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
 @app.get("/v1/providers/{provider_name}")
-async def get_provider_info(provider_name: str):
+async def get_provider_info(provider_name: str, http_request: Request):
     """Retorna informações detalhadas de um provider específico"""
     try:
-        for provider in __providers__:
-            if provider.__name__.lower() == provider_name.lower():
-                return {
-                    "id": provider.__name__,
-                    "working": provider.working,
-                    "needs_auth": getattr(provider, 'needs_auth', False),
-                    "supports_stream": getattr(provider, 'supports_stream', True),
-                    "supports_message_history": getattr(provider, 'supports_message_history', True),
-                    "url": getattr(provider, 'url', None),
-                    "models": getattr(provider, 'models', []) if hasattr(provider, 'models') else []
-                }
-        
+        body = catalog.get().encoded_provider(provider_name)
+        if body is not None:
+            return encoded_response(http_request, body)
+
         raise HTTPException(status_code=404, detail=f"Provider '{provider_name}' not found")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============ ADMIN ============
+
+def _require_admin(http_request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints de admin desativados (ADMIN_TOKEN não definido)")
+    scheme, _, token = http_request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token de admin inválido", headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/admin/profile", dependencies=[Depends(_require_admin)])
+async def admin_profile(seconds: float = 10, mode: str = "cpu", format: str = "json"):
+    """
+    Perfil do servidor em execução: `mode=cpu` amostra as pilhas de todas as
+    threads por `seconds`; `mode=tasks` junta as pilhas das tasks asyncio
+    (`seconds=0` para um dump imediato). `format=collapsed` devolve só as
+    pilhas no formato do flamegraph.pl.
+    """
+    if mode not in ("cpu", "tasks"):
+        raise HTTPException(status_code=400, detail="mode deve ser 'cpu' ou 'tasks'")
+    if seconds < 0:
+        raise HTTPException(status_code=400, detail="seconds deve ser >= 0")
+    try:
+        if mode == "cpu":
+            # A amostragem roda numa thread: o event loop segue atendendo (e aparece no perfil)
+            result = await asyncio.to_thread(sample_cpu, seconds)
+        else:
+            result = await sample_tasks(seconds)
+    except ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return PlainTextResponse(result.get("collapsed", ""))
+    return result
+
+# ============ JOBS ASSÍNCRONOS ============
+
+# Respostas que valem nova tentativa; as demais (400, 404, 422...) encerram o job
+JOB_RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+JOB_MODELS = {"chat": ChatCompletionRequest, "image": ImageGenerationRequest}
+
+def _job_error(e: HTTPException) -> JobError:
+    return JobError(f"{e.status_code}: {e.detail}", retryable=e.status_code in JOB_RETRY_STATUSES)
+
+async def _run_chat_job(payload: Dict[str, Any]):
+    request = ChatCompletionRequest(**payload)
+    request.stream = False
+    try:
+        return await _chat_completion(request)
+    except HTTPException as e:
+        raise _job_error(e)
+
+async def _run_image_job(payload: Dict[str, Any]):
+    # Sem requisição de origem os links das imagens são relativos (ou usam IMAGE_PUBLIC_URL)
+    try:
+        return await image_generations(ImageGenerationRequest(**payload))
+    except HTTPException as e:
+        raise _job_error(e)
+
+job_queue = JobQueue(JobStore(), {"chat": _run_chat_job, "image": _run_image_job}) if JOBS_ENABLED else None
+
+def _require_jobs() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(status_code=400, detail="Jobs desativados (JOBS_ENABLED=0)")
+    return job_queue
+
+@app.post("/v1/jobs", status_code=202)
+async def submit_job(job: JobRequest, http_response: Response):
+    """Enfileira uma completion (ou geração de imagem) e devolve o id para consulta"""
+    queue = _require_jobs()
+    model = JOB_MODELS.get(job.type)
+    if model is None:
+        raise HTTPException(status_code=400, detail=f"type deve ser um de: {', '.join(JOB_MODELS)}")
+    try:
+        model(**job.request)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        created = await queue.submit(job.type, job.request, job.priority, job.max_attempts)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    http_response.headers["Location"] = f"/v1/jobs/{created['id']}"
+    return public_job(created)
+
+@app.get("/v1/jobs")
+async def job_stats():
+    """Jobs por status e estado do pool de workers deste processo"""
+    queue = _require_jobs()
+    return await asyncio.to_thread(queue.snapshot)
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Estado/resultado do job; `wait=N` espera até N segundos (long-poll) pelo fim do job"""
+    queue = _require_jobs()
+    job = await queue.wait(job_id, max(0.0, min(wait, JOBS_MAX_WAIT)))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' não encontrado")
+    return public_job(job)
+
+@app.delete("/v1/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancela um job na fila ou em andamento"""
+    queue = _require_jobs()
+    if not await queue.cancel(job_id):
+        job = await asyncio.to_thread(queue.store.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' não encontrado")
+        raise HTTPException(status_code=409, detail=f"Job já terminado ({job['status']})")
+    return public_job(await asyncio.to_thread(queue.store.get, job_id))
+
 # ============ PROVIDERS ESPECÍFICOS ============
 
 @app.post("/v1/providers/{provider_name}/chat/completions")
-async def provider_chat_completions(provider_name: str, request: ChatCompletionRequest):
+async def provider_chat_completions(
+    provider_name: str,
+    request: ChatCompletionRequest,
+    http_request: Request,
+    http_response: Response
+):
     """Chat completions usando um provider específico"""
     request.provider = provider_name
-    return await chat_completions(request)
+    return await chat_completions(request, http_request, http_response)
+
+# Fim da montagem do app (fase "app_import" da inicialização)
+app_imported = time.perf_counter()
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8080))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if WORKERS > 1:
+        # Publica o catálogo uma vez antes de subir os workers, que já nascem com ele
+        catalog.refresh()
+        catalog_store.release()
+        logger.info("[G4F] Iniciando %s workers", WORKERS)
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,186 @@
+"""
+Vários streams de chat sobre um único WebSocket.
+
+Protocolo (mensagens de texto JSON, todas com o `id` do stream escolhido
+pelo cliente):
+
+- cliente → `{"type": "chat", "id": "s1", "request": {...}}` abre um stream
+  (mesmo corpo de /v1/chat/completions; `stream` é sempre true);
+- cliente → `{"type": "cancel", "id": "s1"}` cancela o stream (o upstream é
+  fechado na hora);
+- cliente → `{"type": "credit", "id": "s1", "n": 64}` libera mais `n` chunks;
+- cliente → `{"type": "ping"}` → `{"type": "pong"}`;
+- servidor → `{"id": "s1", "type": "start", "headers": {...}}`, depois
+  `{"id": "s1", "chunk": {...}}` (o mesmo `chat.completion.chunk` do SSE) e
+  por fim `{"id": "s1", "type": "done"}`, `"cancelled"` ou `"error"`.
+
+Controle de fluxo por crédito: cada stream começa com WS_STREAM_WINDOW chunks;
+sem crédito o stream para de ler do upstream até o cliente liberar mais. A
+fila de saída da conexão é limitada (WS_SEND_QUEUE), então um cliente lento
+segura todos os seus streams em vez de acumular memória no servidor.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, WebSocket
+
+from sse import DONE_FRAME, dumps
+
+logger = logging.getLogger("g4f-server.ws")
+
+WS_MAX_STREAMS = int(os.environ.get("WS_MAX_STREAMS", "64"))
+# Chunks que um stream pode enviar antes de precisar de crédito do cliente
+WS_STREAM_WINDOW = int(os.environ.get("WS_STREAM_WINDOW", "256"))
+WS_SEND_QUEUE = int(os.environ.get("WS_SEND_QUEUE", "1024"))
+
+# payload do "chat" → (headers iniciais, frames SSE de stream_chat_response, iterador upstream)
+OpenStream = Callable[[Dict[str, object]],
+                      Awaitable[Tuple[Dict[str, str], AsyncIterator[bytes], Optional[AsyncIterator[str]]]]]
+
+_DATA_PREFIX = len(b"data: ")
+
+
+class _Stream:
+    __slots__ = ("id", "task", "credit", "wakeup", "cancelled")
+
+    def __init__(self, stream_id: str, window: int):
+        self.id = stream_id
+        self.task: Optional[asyncio.Task] = None
+        self.credit = window
+        self.wakeup = asyncio.Event()
+        self.cancelled = False
+
+    def grant(self, n: int):
+        self.credit += n
+        self.wakeup.set()
+
+    async def spend(self):
+        while self.credit <= 0:
+            self.wakeup.clear()
+            await self.wakeup.wait()
+        self.credit -= 1
+
+
+class StreamMux:
+    """Uma conexão WebSocket: lê comandos, roda um task por stream e serializa os envios"""
+
+    def __init__(self, websocket: WebSocket, open_stream: OpenStream, max_streams: int = WS_MAX_STREAMS,
+                 window: int = WS_STREAM_WINDOW, queue_size: int = WS_SEND_QUEUE):
+        self.websocket = websocket
+        self.open_stream = open_stream
+        self.max_streams = max_streams
+        self.window = window
+        self.streams: Dict[str, _Stream] = {}
+        self.outbox: "asyncio.Queue[bytes]" = asyncio.Queue(queue_size)
+
+    async def run(self):
+        await self.websocket.accept()
+        writer = asyncio.ensure_future(self._write())
+        try:
+            while not writer.done():
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                raw = message.get("text")
+                if raw is None:
+                    raw = (message.get("bytes") or b"").decode("utf-8", "replace")
+                await self._handle(raw)
+        finally:
+            # Cliente saiu: cancela os streams (o que fecha os upstreams) e o escritor
+            tasks = [stream.task for stream in self.streams.values() if stream.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+    async def _write(self):
+        while True:
+            data = await self.outbox.get()
+            await self.websocket.send_text(data.decode("utf-8"))
+
+    async def _send(self, message: Dict[str, object]):
+        await self.outbox.put(dumps(message))
+
+    async def _error(self, stream_id: Optional[str], status: int, detail):
+        await self._send({"id": stream_id, "type": "error", "status": status, "detail": detail})
+
+    async def _handle(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            await self._error(None, 400, "JSON inválido")
+            return
+        if not isinstance(message, dict):
+            await self._error(None, 400, "Mensagem deve ser um objeto JSON")
+            return
+        kind, stream_id = message.get("type"), message.get("id")
+        if kind == "ping":
+            await self._send({"type": "pong"})
+            return
+        if not isinstance(stream_id, str) or not stream_id:
+            await self._error(None, 400, "Campo 'id' (string) é obrigatório")
+            return
+
+        if kind == "chat":
+            if stream_id in self.streams:
+                await self._error(stream_id, 409, "Já existe um stream com este id")
+            elif len(self.streams) >= self.max_streams:
+                await self._error(stream_id, 429, f"Limite de {self.max_streams} streams por conexão")
+            elif not isinstance(message.get("request"), dict):
+                await self._error(stream_id, 400, "Campo 'request' (objeto) é obrigatório")
+            else:
+                stream = _Stream(stream_id, self.window)
+                self.streams[stream_id] = stream
+                stream.task = asyncio.ensure_future(self._pump(stream, message["request"]))
+        elif kind == "cancel":
+            stream = self.streams.get(stream_id)
+            if stream is not None and not stream.cancelled:
+                stream.cancelled = True
+                stream.task.cancel()
+        elif kind == "credit":
+            stream = self.streams.get(stream_id)
+            n = message.get("n")
+            if not isinstance(n, int) or n <= 0:
+                await self._error(stream_id, 400, "Campo 'n' deve ser um inteiro positivo")
+            elif stream is not None:
+                stream.grant(n)
+        else:
+            await self._error(stream_id, 400, f"Tipo de mensagem desconhecido: {kind}")
+
+    async def _pump(self, stream: _Stream, payload: Dict[str, object]):
+        frames = upstream = None
+        prefix = b'{"id":' + dumps(stream.id) + b',"chunk":'
+        try:
+            try:
+                headers, frames, upstream = await self.open_stream(payload)
+            except HTTPException as e:
+                await self._error(stream.id, e.status_code, e.detail)
+                return
+            await self._send({"id": stream.id, "type": "start", "headers": headers})
+            async for frame in frames:
+                if frame == DONE_FRAME:
+                    break
+                await stream.spend()
+                # O frame SSE já traz o chunk serializado: só troca o envelope
+                await self.outbox.put(prefix + frame[_DATA_PREFIX:].rstrip(b"\n") + b"}")
+            await self._send({"id": stream.id, "type": "done"})
+        except asyncio.CancelledError:
+            if not stream.cancelled:
+                raise
+            await self._send({"id": stream.id, "type": "cancelled"})
+        except Exception as e:
+            logger.exception("Falha no stream %s do WebSocket", stream.id)
+            await self._error(stream.id, 500, str(e))
+        finally:
+            self.streams.pop(stream.id, None)
+            # Fechar só os frames não basta se eles nunca começaram (cancelado ainda no "start"):
+            # o upstream é fechado à parte para liberar a vaga e cancelar a chamada
+            for iterator in (frames, upstream):
+                aclose = getattr(iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
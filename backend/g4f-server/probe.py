@@ -0,0 +1,359 @@
+"""
+Sondagem ativa dos providers.
+
+O flag `working` do g4f é estático e não diz se o provider está de fato no ar
+nem quão rápido ele responde. Aqui cada par provider/modelo recebe, em
+intervalos, uma completion mínima (canário). As sondas rodam em paralelo num
+pool limitado, cada uma com seu timeout, e o resultado (sucesso, TTFT e
+vazão) vai para um histórico local em SQLite, e opcionalmente para o Mongo.
+
+Os resumos do histórico alimentam a ordenação e os filtros das listagens
+(`/v1/models` e `/v1/providers`).
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("g4f-server")
+
+PROBE_ENABLED = os.environ.get("PROBE_ENABLED", "0").lower() in ("1", "true", "yes")
+PROBE_INTERVAL = float(os.environ.get("PROBE_INTERVAL", "900"))
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", "8"))
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "30"))
+# Modelos sondados por provider (0 = todos os declarados)
+PROBE_MODELS_PER_PROVIDER = int(os.environ.get("PROBE_MODELS_PER_PROVIDER", "5"))
+PROBE_DB = os.environ.get("PROBE_DB", "./probes.sqlite3")
+# Janela do histórico considerada nos resumos e tempo de retenção das amostras
+PROBE_WINDOW = float(os.environ.get("PROBE_WINDOW", "86400"))
+PROBE_RETENTION = float(os.environ.get("PROBE_RETENTION", str(7 * 86400)))
+# Destino opcional no Mongo (coleção `provider_probes` do banco padrão da URI)
+PROBE_MONGO_URI = os.environ.get("PROBE_MONGO_URI", "")
+PROBE_PROMPT = os.environ.get("PROBE_PROMPT", "Reply with the single word: ok")
+
+# Chave dos resumos agregados de todos os modelos de um provider
+ANY_MODEL = "*"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    ts REAL NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    ttft REAL,
+    total REAL,
+    tokens INTEGER,
+    tps REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS probes_ts ON probes (ts);
+"""
+
+ProbeResult = Dict[str, object]
+
+
+def _median(values: List[float]) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def _summarize(rows: List[Tuple]) -> Dict[str, object]:
+    """Resumo de amostras (ts, ok, ttft, tps, error) já ordenadas por ts"""
+    ok = [row for row in rows if row[1]]
+    return {
+        "samples": len(rows),
+        "success_rate": round(len(ok) / len(rows), 4) if rows else None,
+        "ttft_p50": _median([row[2] for row in ok if row[2] is not None]),
+        "tps_p50": _median([row[3] for row in ok if row[3] is not None]),
+        "last_probe": rows[-1][0] if rows else None,
+        "last_ok": bool(rows[-1][1]) if rows else None,
+        "last_error": next((row[4] for row in reversed(rows) if row[4]), None),
+    }
+
+
+class ProbeStore:
+    """Histórico das sondas em SQLite (compartilhável entre workers) + cópia opcional no Mongo"""
+
+    def __init__(self, path: str = PROBE_DB, mongo_uri: str = PROBE_MONGO_URI):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        self._mongo = None
+        if mongo_uri:
+            try:
+                from pymongo import MongoClient
+                self._mongo = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000) \
+                    .get_default_database()["provider_probes"]
+            except Exception as e:
+                logger.warning("Histórico de sondas no Mongo indisponível: %s", e)
+
+    def add(self, results: List[ProbeResult]):
+        if not results:
+            return
+        rows = [(r["ts"], r["provider"], r["model"], int(r["ok"]), r["ttft"], r["total"],
+                 r["tokens"], r["tps"], r["error"]) for r in results]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("DELETE FROM probes WHERE ts < ?", (time.time() - PROBE_RETENTION,))
+        if self._mongo is not None:
+            try:
+                self._mongo.insert_many([dict(r) for r in results], ordered=False)
+            except Exception as e:
+                logger.warning("Falha ao gravar sondas no Mongo: %s", e)
+
+    def last_round(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(ts) FROM probes").fetchone()
+        return row[0] if row else None
+
+    def summaries(self, window: float = PROBE_WINDOW) -> Dict[Tuple[str, str], Dict[str, object]]:
+        """Resumo por (provider, modelo) e por (provider, ANY_MODEL) dentro da janela"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT provider, model, ts, ok, ttft, tps, error FROM probes WHERE ts >= ? ORDER BY ts",
+                (time.time() - window,)
+            ).fetchall()
+        grouped: Dict[Tuple[str, str], List[Tuple]] = {}
+        for provider, model, *sample in rows:
+            grouped.setdefault((provider, model), []).append(sample)
+            grouped.setdefault((provider, ANY_MODEL), []).append(sample)
+        return {key: _summarize(samples) for key, samples in grouped.items()}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Prober:
+    """
+    Roda rodadas de sondagem a cada `interval` segundos e mantém em memória os
+    resumos do histórico. `targets()` lista os pares (provider, modelo);
+    `open_stream(provider, modelo)` retorna um iterador com os textos do canário.
+    Com `should_probe` falso (ex.: worker que não é o líder) só relê os resumos.
+    """
+
+    def __init__(self, store: ProbeStore, targets: Callable[[], Iterable[Tuple[object, str]]],
+                 open_stream: Callable[[object, str], AsyncIterator[str]],
+                 count_tokens: Callable[[str, str], int],
+                 on_result: Optional[Callable[[ProbeResult], None]] = None,
+                 should_probe: Callable[[], bool] = lambda: True,
+                 interval: float = PROBE_INTERVAL, concurrency: int = PROBE_CONCURRENCY,
+                 timeout: float = PROBE_TIMEOUT):
+        self.store = store
+        self._targets = targets
+        self._open_stream = open_stream
+        self._count_tokens = count_tokens
+        self._on_result = on_result
+        self._should_probe = should_probe
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.summaries: Dict[Tuple[str, str], Dict[str, object]] = {}
+        self.rounds = 0
+        self.last_round: Optional[Dict[str, object]] = None
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self._manual: Optional[asyncio.Task] = None
+
+    def summary(self, provider_name: str, model: str = ANY_MODEL) -> Optional[Dict[str, object]]:
+        return self.summaries.get((provider_name, model))
+
+    async def probe(self, provider, model: str) -> ProbeResult:
+        """Uma sonda: canário em streaming, com TTFT, tokens/s e timeout total"""
+        name = getattr(provider, "__name__", str(provider))
+        started = time.perf_counter()
+        ttft = None
+        pieces: List[str] = []
+
+        async def consume():
+            nonlocal ttft
+            async for text in self._open_stream(provider, model):
+                if text and ttft is None:
+                    ttft = time.perf_counter() - started
+                pieces.append(text)
+
+        error = None
+        try:
+            await asyncio.wait_for(consume(), timeout=self.timeout)
+            if ttft is None:
+                error = "empty_response"
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except Exception as e:
+            error = type(e).__name__
+        total = time.perf_counter() - started
+        tokens = self._count_tokens("".join(pieces), model) if pieces else 0
+        generation = total - (ttft or total)
+        return {
+            "ts": time.time(),
+            "provider": name,
+            "model": model,
+            "ok": error is None,
+            "ttft": ttft,
+            "total": total,
+            "tokens": tokens,
+            "tps": round(tokens / generation, 2) if error is None and tokens and generation > 0 else None,
+            "error": error,
+        }
+
+    async def run_round(self) -> List[ProbeResult]:
+        """Sonda todos os pares com no máximo `concurrency` sondas simultâneas"""
+        self.running = True
+        started = time.time()
+        queue: asyncio.Queue = asyncio.Queue()
+        for target in self._targets():
+            queue.put_nowait(target)
+        total = queue.qsize()
+        results: List[ProbeResult] = []
+
+        async def worker():
+            while True:
+                try:
+                    provider, model = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await self.probe(provider, model)
+                results.append(result)
+                if self._on_result is not None:
+                    self._on_result(result)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, total) or 1)))
+            await asyncio.to_thread(self.store.add, results)
+        finally:
+            self.running = False
+        self.rounds += 1
+        self.last_round = {
+            "started": started,
+            "duration": round(time.time() - started, 3),
+            "probes": len(results),
+            "ok": sum(1 for r in results if r["ok"]),
+        }
+        logger.info("[G4F] Sondagem: %s/%s pares responderam em %.1fs",
+                    self.last_round["ok"], len(results), self.last_round["duration"])
+        self.summaries = await asyncio.to_thread(self.store.summaries)
+        return results
+
+    def trigger(self) -> bool:
+        """Dispara uma rodada fora do agendamento; False se já há uma em andamento"""
+        if self.running:
+            return False
+        self.running = True
+        self._manual = asyncio.create_task(self.run_round())
+        return True
+
+    def _due(self) -> bool:
+        last = self.store.last_round()
+        return last is None or time.time() - last >= self.interval
+
+    async def _loop(self):
+        while True:
+            try:
+                # Uma rodada disparada manualmente em andamento conta como a rodada da vez
+                if not self.running and self._should_probe() and await asyncio.to_thread(self._due):
+                    await self.run_round()
+                else:
+                    self.summaries = await asyncio.to_thread(self.store.summaries)
+            except Exception:
+                logger.exception("Falha na sondagem dos providers")
+            # Quem não sonda relê o histórico com mais frequência (outro worker pode ter gravado)
+            await asyncio.sleep(min(self.interval, 60.0))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, object]:
+        rows = [{"provider": provider, "model": model, **summary}
+                for (provider, model), summary in sorted(self.summaries.items())]
+        return {
+            "data": rows,
+            "object": "list",
+            "interval": self.interval,
+            "concurrency": self.concurrency,
+            "timeout": self.timeout,
+            "rounds": self.rounds,
+            "running": self.running,
+            "last_round": self.last_round,
+        }
+
+
+# ============ ORDENAÇÃO E FILTROS DAS LISTAGENS ============
+
+SORT_KEYS = ("ttft", "throughput", "success")
+
+
+def _sort_value(summary: Optional[Dict[str, object]], sort: str) -> float:
+    """Menor é melhor; sem medição vai para o fim"""
+    if not summary or not summary["samples"]:
+        return float("inf")
+    if sort == "ttft":
+        value = summary["ttft_p50"]
+        return value if value is not None else float("inf")
+    if sort == "throughput":
+        return -(summary["tps_p50"] or 0.0)
+    return -(summary["success_rate"] or 0.0)
+
+
+def passes(summary: Optional[Dict[str, object]], min_success: Optional[float], max_ttft: Optional[float],
+           probed: bool) -> bool:
+    """O provider (ou par provider/modelo) atende aos filtros de desempenho medido?"""
+    measured = bool(summary and summary["samples"])
+    if not measured:
+        return not (probed or min_success is not None or max_ttft is not None)
+    if min_success is not None and (summary["success_rate"] or 0.0) < min_success:
+        return False
+    if max_ttft is not None and (summary["ttft_p50"] is None or summary["ttft_p50"] > max_ttft):
+        return False
+    return True
+
+
+def rank_providers(payload: Dict[str, object], prober: Prober, sort: Optional[str],
+                   min_success: Optional[float], max_ttft: Optional[float], probed: bool) -> Dict[str, object]:
+    """Cópia do payload de `/v1/providers` com `performance` por item, filtrada e ordenada"""
+    items = []
+    for item in payload["data"]:
+        summary = prober.summary(item["id"])
+        if passes(summary, min_success, max_ttft, probed):
+            items.append(dict(item, performance=summary))
+    if sort:
+        items.sort(key=lambda item: _sort_value(item["performance"], sort))
+    return {"data": items, "object": "list"}
+
+
+def rank_models(payload: Dict[str, object], prober: Prober, sort: Optional[str],
+                min_success: Optional[float], max_ttft: Optional[float], probed: bool) -> Dict[str, object]:
+    """
+    Cópia do payload de `/v1/models`: em cada modelo só ficam os providers que
+    passam nos filtros (ordenados pelo critério), e o modelo herda o
+    desempenho do seu melhor provider. Modelos sem provider restante saem.
+    """
+    models = []
+    for entry in payload["data"]:
+        ranked = []
+        for name in entry["providers"]:
+            summary = prober.summary(name, entry["id"]) or prober.summary(name)
+            if passes(summary, min_success, max_ttft, probed):
+                ranked.append((name, summary))
+        if not ranked:
+            continue
+        ranked.sort(key=lambda item: _sort_value(item[1], sort or "ttft"))
+        models.append(dict(entry, providers=[name for name, _ in ranked], performance=ranked[0][1]))
+    if sort:
+        models.sort(key=lambda entry: _sort_value(entry["performance"], sort))
+    return {"data": models, "object": "list", "total": len(models)}
@@ -0,0 +1,162 @@
+"""
+Perfil sob demanda do servidor em execução.
+
+- `sample_cpu`: perfil por amostragem, sem dependências. Uma thread lê
+  `sys._current_frames()` a cada PROFILE_INTERVAL segundos e conta as pilhas
+  de todas as threads (formato "collapsed", pronto para flamegraph.pl /
+  speedscope) e as funções mais frequentes no topo da pilha.
+- `task_dump`: pilhas de todas as tasks asyncio vivas, agrupadas pela
+  coroutine, para achar o que está preso esperando.
+
+Só um perfil por vez (`ProfileBusy`), com duração limitada a
+PROFILE_MAX_SECONDS.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.01"))
+# Profundidade máxima das pilhas amostradas
+PROFILE_MAX_DEPTH = int(os.environ.get("PROFILE_MAX_DEPTH", "64"))
+
+_busy = threading.Lock()
+
+
+class ProfileBusy(RuntimeError):
+    """Já existe um perfil em andamento"""
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> List[str]:
+    """Pilha da base para o topo"""
+    stack = []
+    while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+        stack.append(_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _thread_names() -> Dict[int, str]:
+    return {thread.ident: thread.name for thread in threading.enumerate() if thread.ident is not None}
+
+
+def sample_cpu(seconds: float, interval: float = PROFILE_INTERVAL, top: int = 30) -> Dict[str, object]:
+    """Amostra as pilhas de todas as threads por `seconds` (bloqueia: rodar fora do event loop)"""
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("Já existe um perfil em andamento")
+    try:
+        seconds = max(0.0, min(seconds, PROFILE_MAX_SECONDS))
+        own = threading.get_ident()
+        names = _thread_names()
+        stacks: Counter = Counter()
+        leaves: Counter = Counter()
+        inclusive: Counter = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = _stack(frame)
+                if not stack:
+                    continue
+                thread = names.get(ident)
+                if thread is None:
+                    names = _thread_names()
+                    thread = names.get(ident, str(ident))
+                stacks[";".join([thread, *stack])] += 1
+                leaves[stack[-1]] += 1
+                for label in set(stack):
+                    inclusive[label] += 1
+            samples += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+        elapsed = time.perf_counter() - started
+    finally:
+        _busy.release()
+
+    return {
+        "mode": "cpu",
+        "seconds": round(elapsed, 3),
+        "interval": interval,
+        "samples": samples,
+        "top_self": [{"function": label, "samples": count} for label, count in leaves.most_common(top)],
+        "top_total": [{"function": label, "samples": count} for label, count in inclusive.most_common(top)],
+        "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+    }
+
+
+def _task_stack(task: asyncio.Task) -> List[str]:
+    stack = [_label(frame) for frame in task.get_stack(limit=PROFILE_MAX_DEPTH)]
+    if not stack:
+        # Task ainda não iniciada (ou já terminando): só a coroutine
+        coro = task.get_coro()
+        code = getattr(coro, "cr_code", None) or getattr(coro, "ag_code", None)
+        if code is not None:
+            stack = [f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"]
+    return stack
+
+
+def task_dump(loop: Optional[asyncio.AbstractEventLoop] = None) -> Dict[str, object]:
+    """Pilhas das tasks asyncio vivas, agrupadas (pilhas iguais contam juntas)"""
+    tasks = asyncio.all_tasks(loop)
+    current = asyncio.current_task(loop)
+    groups: Dict[str, Dict[str, object]] = {}
+    for task in tasks:
+        if task is current:
+            continue
+        stack = _task_stack(task)
+        key = ";".join(stack)
+        group = groups.setdefault(key, {"count": 0, "names": [], "stack": stack})
+        group["count"] += 1
+        if len(group["names"]) < 5:
+            group["names"].append(task.get_name())
+    return {
+        "mode": "tasks",
+        "tasks": len(tasks) - (1 if current in tasks else 0),
+        "groups": sorted(groups.values(), key=lambda g: g["count"], reverse=True),
+        "collapsed": "\n".join(f"{key} {group['count']}" for key, group in groups.items() if key),
+    }
+
+
+async def sample_tasks(seconds: float, interval: float = 0.1) -> Dict[str, object]:
+    """Sem duração: dump imediato. Com duração: soma as pilhas das tasks a cada `interval`"""
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("Já existe um perfil em andamento")
+    try:
+        duration = max(0.0, min(seconds, PROFILE_MAX_SECONDS))
+        if duration <= 0:
+            return task_dump()
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.perf_counter() + duration
+        while True:
+            for group in task_dump()["groups"]:
+                stacks[";".join(group["stack"])] += group["count"]
+            samples += 1
+            if time.perf_counter() >= deadline:
+                break
+            await asyncio.sleep(interval)
+        dump = task_dump()
+        dump.update(
+            seconds=duration,
+            samples=samples,
+            collapsed="\n".join(f"{stack} {count}" for stack, count in stacks.most_common() if stack),
+        )
+        return dump
+    finally:
+        _busy.release()
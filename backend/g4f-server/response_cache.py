@@ -0,0 +1,210 @@
+"""
+Cache de respostas de chat completions.
+
+Chave = hash canônico de (model, provider, messages, temperature, max_tokens,
+web_search). Camada em memória com LRU + TTL e limite de bytes, e uma camada
+opcional em disco (RESPONSE_CACHE_DIR) que sobrevive a reinícios.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("g4f-server")
+
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "")
+# Tamanho aproximado (em caracteres) de cada chunk ao reproduzir um hit em streaming
+REPLAY_CHUNK_CHARS = int(os.environ.get("REPLAY_CHUNK_CHARS", "64"))
+
+_WORD = re.compile(r"\s*\S+\s*|\s+")
+
+
+def cache_key(
+    model: Optional[str],
+    provider: Optional[str],
+    messages: List[Dict[str, str]],
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    web_search: bool,
+) -> str:
+    """Hash SHA-256 de uma serialização canônica (chaves ordenadas, sem espaços)"""
+    payload = {
+        "model": model or "auto",
+        "provider": (provider or "").lower(),
+        "messages": [[m["role"], m["content"]] for m in messages],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "web_search": bool(web_search),
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def replay_pieces(content: str, size: int = REPLAY_CHUNK_CHARS) -> List[str]:
+    """Quebra o texto salvo em pedaços de ~`size` caracteres, sem cortar palavras"""
+    pieces, current = [], ""
+    for word in _WORD.findall(content):
+        if current and len(current) + len(word) > size:
+            pieces.append(current)
+            current = ""
+        current += word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class CachedResponse:
+    __slots__ = ("content", "provider", "created", "size")
+
+    def __init__(self, content: str, provider: Optional[str], created: float):
+        self.content = content
+        self.provider = provider
+        self.created = created
+        self.size = len(content.encode("utf-8")) + 64
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created
+
+
+class ResponseCache:
+    """LRU + TTL em memória com limite de entradas/bytes e camada opcional em disco"""
+
+    def __init__(
+        self,
+        ttl: int = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        disk_dir: str = RESPONSE_CACHE_DIR,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: str, count: bool = True) -> Optional[CachedResponse]:
+        """Resposta válida para a chave; `count=False` não mexe nos contadores de hit/miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.age <= self.ttl:
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry
+            self._remove(key)
+
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._store(key, entry)
+            if count:
+                self.hits += 1
+                self.disk_hits += 1
+            return entry
+
+        if count:
+            self.misses += 1
+        return None
+
+    def similar_hit(self):
+        """A consulta exata já contou um miss, mas a requisição foi atendida por uma quase-duplicata"""
+        self.misses = max(0, self.misses - 1)
+        self.hits += 1
+
+    def contains(self, key: str) -> bool:
+        """Há resposta válida para a chave? (sem mexer nos contadores de hit/miss)"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.age <= self.ttl:
+            return True
+        return self.disk_dir is not None and self._disk_get(key) is not None
+
+    def set(self, key: str, content: str, provider: Optional[str] = None):
+        if not self.enabled or not content:
+            return
+        entry = CachedResponse(content, provider, time.time())
+        if entry.size > self.max_bytes:
+            return
+        self._store(key, entry)
+        self._disk_set(key, entry)
+
+    def _store(self, key: str, entry: CachedResponse):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    # ---- camada em disco ----
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str) -> Optional[CachedResponse]:
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        entry = CachedResponse(data.get("content", ""), data.get("provider"), float(data.get("created", 0)))
+        if not entry.content or entry.age > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _disk_set(self, key: str, entry: CachedResponse):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"content": entry.content, "provider": entry.provider, "created": entry.created}, fh)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Falha ao gravar cache em disco: %s", e)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "disk_dir": self.disk_dir,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
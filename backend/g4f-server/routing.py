@@ -0,0 +1,201 @@
+"""
+Roteamento de providers baseado em latência medida no tráfego real.
+
+Mantém, por provider (e por provider+modelo), uma janela deslizante com
+time-to-first-token, latência total e taxa de sucesso, e ordena os
+candidatos de uma requisição do mais rápido/saudável para o pior.
+"""
+
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+ROUTING_WINDOW = int(os.environ.get("ROUTING_WINDOW", "50"))
+ROUTING_MIN_SAMPLES = int(os.environ.get("ROUTING_MIN_SAMPLES", "3"))
+ROUTING_MIN_SUCCESS = float(os.environ.get("ROUTING_MIN_SUCCESS", "0.5"))
+ROUTING_MAX_AGE = int(os.environ.get("ROUTING_MAX_AGE", "1800"))
+ROUTING_EXPLORE = float(os.environ.get("ROUTING_EXPLORE", "0.1"))
+
+# Chave usada para agregar amostras de todos os modelos de um provider
+ANY_MODEL = "*"
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _provider_name(provider) -> str:
+    return getattr(provider, "__name__", None) or str(provider)
+
+
+class ProviderStats:
+    """Janela deslizante de amostras (timestamp, ok, ttft, total) de um provider"""
+
+    __slots__ = ("samples", "last_error")
+
+    def __init__(self, window: int):
+        self.samples: Deque[Tuple[float, bool, Optional[float], Optional[float]]] = deque(maxlen=window)
+        self.last_error: Optional[str] = None
+
+    def add(self, ok: bool, ttft: Optional[float], total: Optional[float], error: Optional[str] = None):
+        self.samples.append((time.time(), ok, ttft, total))
+        if error:
+            self.last_error = error
+
+    def _recent(self, max_age: int):
+        cutoff = time.time() - max_age
+        return [s for s in self.samples if s[0] >= cutoff]
+
+    def summary(self, max_age: int = ROUTING_MAX_AGE) -> Dict[str, object]:
+        recent = self._recent(max_age)
+        ok = [s for s in recent if s[1]]
+        ttfts = [s[2] for s in ok if s[2] is not None]
+        totals = [s[3] for s in ok if s[3] is not None]
+        return {
+            "samples": len(recent),
+            "success_rate": round(len(ok) / len(recent), 4) if recent else None,
+            "ttft_p50": _percentile(ttfts, 50),
+            "ttft_p99": _percentile(ttfts, 99),
+            "latency_p50": _percentile(totals, 50),
+            "latency_p99": _percentile(totals, 99),
+            "last_sample": recent[-1][0] if recent else None,
+            "last_error": self.last_error,
+        }
+
+
+def _score(summary: Dict[str, object]) -> float:
+    """Menor é melhor: latência típica (TTFT quando houver) penalizada pela taxa de falha"""
+    p50 = summary["ttft_p50"] if summary["ttft_p50"] is not None else summary["latency_p50"]
+    p99 = summary["ttft_p99"] if summary["ttft_p99"] is not None else summary["latency_p99"]
+    if p50 is None:
+        return float("inf")
+    latency = 0.7 * p50 + 0.3 * (p99 if p99 is not None else p50)
+    return latency / max(summary["success_rate"] or 0.0, 0.05)
+
+
+class LatencyRouter:
+    """Escolhe o melhor provider para cada modelo a partir das amostras registradas"""
+
+    def __init__(
+        self,
+        window: int = ROUTING_WINDOW,
+        min_samples: int = ROUTING_MIN_SAMPLES,
+        min_success: float = ROUTING_MIN_SUCCESS,
+        max_age: int = ROUTING_MAX_AGE,
+        explore: float = ROUTING_EXPLORE,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.min_success = min_success
+        self.max_age = max_age
+        self.explore = explore
+        self._stats: Dict[Tuple[str, str], ProviderStats] = {}
+
+    def _get(self, provider_name: str, model: str) -> ProviderStats:
+        key = (provider_name, model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ProviderStats(self.window)
+        return stats
+
+    def record(
+        self,
+        provider,
+        model: Optional[str],
+        ok: bool,
+        ttft: Optional[float] = None,
+        total: Optional[float] = None,
+        error: Optional[str] = None,
+    ):
+        """Registra o resultado de uma chamada (sucesso/falha, TTFT e latência em segundos)"""
+        if not provider:
+            return
+        name = provider if isinstance(provider, str) else _provider_name(provider)
+        self._get(name, model or "auto").add(ok, ttft, total, error)
+        if model:
+            self._get(name, ANY_MODEL).add(ok, ttft, total, error)
+
+    def _summary_for(self, name: str, model: Optional[str]) -> Dict[str, object]:
+        specific = self._stats.get((name, model or "auto"))
+        if specific is not None:
+            summary = specific.summary(self.max_age)
+            if summary["samples"] >= self.min_samples:
+                return summary
+        aggregate = self._stats.get((name, ANY_MODEL))
+        if aggregate is not None:
+            return aggregate.summary(self.max_age)
+        if specific is not None:
+            return specific.summary(self.max_age)
+        return {"samples": 0, "success_rate": None, "ttft_p50": None, "ttft_p99": None,
+                "latency_p50": None, "latency_p99": None}
+
+    def rank(self, candidates: Iterable, model: Optional[str] = None) -> List:
+        """
+        Ordena os candidatos: saudáveis medidos (por score), depois não medidos
+        (na ordem original) e por fim os não saudáveis. Com probabilidade
+        `explore`, um não medido vai para a frente para ganhar amostras.
+        """
+        healthy, unmeasured, unhealthy = [], [], []
+        for provider in candidates:
+            summary = self._summary_for(_provider_name(provider), model)
+            if summary["samples"] < self.min_samples:
+                unmeasured.append(provider)
+            elif (summary["success_rate"] or 0.0) < self.min_success:
+                unhealthy.append((_score(summary), provider))
+            else:
+                healthy.append((_score(summary), provider))
+
+        healthy.sort(key=lambda item: item[0])
+        unhealthy.sort(key=lambda item: item[0])
+        ordered = [p for _, p in healthy] + unmeasured + [p for _, p in unhealthy]
+
+        if unmeasured and healthy and random.random() < self.explore:
+            pick = random.choice(unmeasured)
+            ordered.remove(pick)
+            ordered.insert(0, pick)
+        return ordered
+
+    def best(self, candidates: Iterable, model: Optional[str] = None, measured_only: bool = False):
+        """Retorna o melhor candidato (ou None). Com `measured_only`, só aceita um provider saudável já medido"""
+        ordered = self.rank(candidates, model)
+        if not ordered:
+            return None
+        if measured_only and not self.is_healthy(ordered[0], model):
+            return None
+        return ordered[0]
+
+    def is_healthy(self, provider, model: Optional[str] = None) -> bool:
+        summary = self._summary_for(_provider_name(provider), model)
+        return summary["samples"] >= self.min_samples and (summary["success_rate"] or 0.0) >= self.min_success
+
+    def snapshot(self) -> Dict[str, object]:
+        """Placar atual por provider e modelo, ordenado pelo score"""
+        rows = []
+        for (name, model), stats in self._stats.items():
+            summary = stats.summary(self.max_age)
+            if not summary["samples"]:
+                continue
+            score = _score(summary)
+            rows.append({
+                "provider": name,
+                "model": model,
+                "score": None if score == float("inf") else round(score, 4),
+                "healthy": summary["samples"] >= self.min_samples
+                and (summary["success_rate"] or 0.0) >= self.min_success,
+                **summary,
+            })
+        rows.sort(key=lambda r: (r["model"], r["score"] if r["score"] is not None else float("inf")))
+        return {
+            "data": rows,
+            "object": "list",
+            "window": self.window,
+            "min_samples": self.min_samples,
+            "min_success": self.min_success,
+            "max_age": self.max_age,
+        }
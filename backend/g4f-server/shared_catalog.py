@@ -0,0 +1,162 @@
+"""
+Snapshot do catálogo compartilhado entre workers via arquivo mapeado em memória.
+
+Um único worker (o que segura o lock) varre os providers e publica o índice
+serializado; os demais mapeiam o arquivo (em /dev/shm quando disponível, ou
+seja, em RAM) e só releem o índice quando a geração no cabeçalho muda. A
+publicação grava num arquivo temporário e troca com `os.replace`, então quem
+lê nunca vê um snapshot pela metade.
+
+O arquivo tem o índice de roteamento em JSON (pequeno, decodificado por cada
+worker) seguido das listagens já codificadas (JSON, gzip, brotli). Essas não
+são decodificadas: viram fatias (`memoryview`) do mapeamento, servidas direto
+nas respostas, então as páginas ficam uma vez só na memória para todos os
+workers. Cada worker ainda importa o g4f: é ele quem chama os providers.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, Optional
+
+from encoded import EncodedBody
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: cada worker constrói o seu
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+logger = logging.getLogger("g4f-server")
+
+_SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SHARED_CATALOG_PATH = os.environ.get("SHARED_CATALOG_PATH", os.path.join(_SHM_DIR, "g4f-catalog.snapshot"))
+
+# Cabeçalho: magic, geração, tamanho do índice (JSON); depois os corpos codificados
+_MAGIC = b"G4F2"
+_HEADER = struct.Struct("<4sQQ")
+
+
+def _encode(snapshot: Dict[str, object]) -> bytes:
+    # `raw_models` pode trazer valores não-JSON vindos dos providers: viram string
+    if orjson is not None:
+        return orjson.dumps(snapshot, default=str)
+    return json.dumps(snapshot, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(body: bytes) -> Dict[str, object]:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class SnapshotStore:
+    """Arquivo de snapshot + lock de liderança (quem reconstrói o catálogo)"""
+
+    def __init__(self, path: str = SHARED_CATALOG_PATH):
+        self.path = path
+        self._lock_file = None
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_file is not None
+
+    def try_lead(self) -> bool:
+        """Tenta assumir a reconstrução do catálogo; o lock dura até `release` ou o fim do processo"""
+        if self._lock_file is not None:
+            return True
+        if fcntl is None:
+            return True
+        lock_file = open(self.path + ".lock", "a+b")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def generation(self) -> int:
+        """Geração publicada (0 se não há snapshot); lê só o cabeçalho"""
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(_HEADER.size)
+        except OSError:
+            return 0
+        if len(header) < _HEADER.size:
+            return 0
+        magic, generation, _ = _HEADER.unpack(header)
+        return generation if magic == _MAGIC else 0
+
+    def publish(self, snapshot: Dict[str, object], generation: int, bodies: Dict[str, EncodedBody]):
+        # Corpos codificados vão crus depois do índice; o índice guarda ETag e (offset, tamanho)
+        parts, layout, offset = [], {}, 0
+        for name, body in bodies.items():
+            variants = {}
+            for encoding, data in (("identity", body.identity), *body.variants.items()):
+                parts.append(data)
+                variants[encoding] = [offset, len(data)]
+                offset += len(data)
+            layout[name] = {"etag": body.etag, "variants": variants}
+        index = _encode(dict(snapshot, bodies=layout))
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".g4f-catalog-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, generation, len(index)))
+                f.write(index)
+                for data in parts:
+                    f.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def load(self, newer_than: int = 0) -> Optional[Dict[str, object]]:
+        """
+        Snapshot publicado, ou None se não existe / não é mais novo que `newer_than`.
+        Em `bodies` vêm os corpos codificados apontando para o mapeamento, que
+        fica aberto enquanto algum deles for referenciado.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapped) < _HEADER.size:
+            mapped.close()
+            return None
+        magic, generation, size = _HEADER.unpack_from(mapped, 0)
+        if magic != _MAGIC or generation <= newer_than:
+            mapped.close()
+            return None
+        try:
+            snapshot = _decode(mapped[_HEADER.size:_HEADER.size + size])
+            view = memoryview(mapped)[_HEADER.size + size:]
+            snapshot["bodies"] = {
+                name: EncodedBody.shared(entry["etag"], {
+                    encoding: view[start:start + length]
+                    for encoding, (start, length) in entry["variants"].items()
+                })
+                for name, entry in snapshot["bodies"].items()
+            }
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Snapshot do catálogo corrompido em %s", self.path)
+            return None
+        snapshot["version"] = generation
+        return snapshot
@@ -0,0 +1,224 @@
+"""
+Cache de quase-duplicatas (opt-in, SIMILAR_CACHE_ENABLED=1).
+
+Complementa o cache exato: prompts que diferem só em espaços, caixa ou
+pontuação reaproveitam a resposta já guardada. Funciona offline, sem
+embeddings:
+
+- o texto é normalizado (minúsculas, sem pontuação, espaços colapsados);
+- a última mensagem do usuário vira uma assinatura MinHash de uma permutação
+  (um hash por shingle de caracteres, mínimo por bin);
+- um índice LSH por bandas encontra candidatas, e a similaridade estimada
+  pela assinatura precisa passar de SIMILAR_CACHE_THRESHOLD.
+
+O escopo de comparação (modelo, provider, parâmetros, o histórico anterior
+normalizado e os números citados na pergunta) precisa ser idêntico: só a
+pergunta final é comparada por similaridade. A resposta em si fica no cache
+exato; aqui só se guarda a assinatura e a chave exata (memória limitada,
+LRU).
+"""
+
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+SIMILAR_CACHE_ENABLED = os.environ.get("SIMILAR_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+SIMILAR_CACHE_THRESHOLD = float(os.environ.get("SIMILAR_CACHE_THRESHOLD", "0.85"))
+SIMILAR_CACHE_MAX_ENTRIES = int(os.environ.get("SIMILAR_CACHE_MAX_ENTRIES", "5000"))
+# Assinatura com SIMILAR_CACHE_BINS bins, dividida em SIMILAR_CACHE_BANDS bandas para o LSH
+SIMILAR_CACHE_BINS = int(os.environ.get("SIMILAR_CACHE_BINS", "64"))
+SIMILAR_CACHE_BANDS = int(os.environ.get("SIMILAR_CACHE_BANDS", "16"))
+SIMILAR_CACHE_SHINGLE = int(os.environ.get("SIMILAR_CACHE_SHINGLE", "4"))
+# Perguntas maiores que isso ficam só com o cache exato
+SIMILAR_CACHE_MAX_CHARS = int(os.environ.get("SIMILAR_CACHE_MAX_CHARS", "4000"))
+
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+_NUMBER = re.compile(r"\d+")
+_MASK = (1 << 64) - 1
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sem acentos combinantes nem pontuação, espaços colapsados"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def signature(text: str, bins: int = SIMILAR_CACHE_BINS, k: int = SIMILAR_CACHE_SHINGLE) -> Tuple[int, ...]:
+    """MinHash de uma permutação sobre shingles de `k` caracteres, com densificação dos bins vazios"""
+    shingles: Set[str] = {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+    mins: List[Optional[int]] = [None] * bins
+    for shingle in shingles:
+        h = _hash64(shingle)
+        slot, value = h % bins, h // bins
+        if mins[slot] is None or value < mins[slot]:
+            mins[slot] = value
+    # Bin vazio herda o próximo não vazio (deslocado pela distância, para não colidir por acaso)
+    filled = [i for i, value in enumerate(mins) if value is not None]
+    if not filled:
+        return tuple([0] * bins)
+    out = []
+    for i, value in enumerate(mins):
+        if value is None:
+            distance = next(((j - i) % bins for j in filled if j > i), filled[0] + bins - i)
+            value = (mins[(i + distance) % bins] + distance * 0x9E3779B97F4A7C15) & _MASK
+        out.append(value)
+    return tuple(out)
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Jaccard estimado: fração de bins iguais"""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a) if a else 0.0
+
+
+class Fingerprint:
+    """Escopo exato + assinatura da pergunta final de uma requisição"""
+
+    __slots__ = ("scope", "signature", "bands")
+
+    def __init__(self, scope: str, sig: Tuple[int, ...], bands: int):
+        self.scope = scope
+        self.signature = sig
+        rows = max(1, len(sig) // bands)
+        self.bands = [hash((scope, band, sig[band * rows:(band + 1) * rows])) for band in range(bands)]
+
+
+class _Entry:
+    __slots__ = ("key", "fingerprint")
+
+    def __init__(self, key: str, fingerprint: Fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+
+
+class SimilarCache:
+    """Índice LSH de assinaturas → chave do cache exato, com LRU"""
+
+    # Limites dos baldes do histograma de melhores scores (para calibrar o threshold)
+    SCORE_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0)
+
+    def __init__(self, enabled: bool = SIMILAR_CACHE_ENABLED, threshold: float = SIMILAR_CACHE_THRESHOLD,
+                 max_entries: int = SIMILAR_CACHE_MAX_ENTRIES, bins: int = SIMILAR_CACHE_BINS,
+                 bands: int = SIMILAR_CACHE_BANDS):
+        self.enabled = enabled and max_entries > 0
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bins = bins
+        self.bands = max(1, min(bands, bins))
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[int, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.stale = 0
+        self.evicted = 0
+        self.candidates = 0
+        self._scores = [0] * len(self.SCORE_BUCKETS)
+
+    def fingerprint(self, messages: List[Dict[str, str]], **params) -> Optional[Fingerprint]:
+        """Fingerprint da requisição, ou None se ela não é elegível (última mensagem não é do usuário, longa demais...)"""
+        if not self.enabled or not messages or messages[-1].get("role") != "user":
+            return None
+        question = messages[-1].get("content") or ""
+        if len(question) > SIMILAR_CACHE_MAX_CHARS:
+            self.skipped += 1
+            return None
+        text = normalize(question)
+        if not text:
+            return None
+        scope = json.dumps({
+            "params": params,
+            "history": [[m.get("role"), normalize(m.get("content") or "")] for m in messages[:-1]],
+            # Perguntas iguais com números diferentes não são a mesma pergunta
+            "numbers": _NUMBER.findall(text),
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        scope = hashlib.sha256(scope.encode("utf-8")).hexdigest()
+        return Fingerprint(scope, signature(text, self.bins), self.bands)
+
+    def _observe(self, score: float):
+        for index, bound in enumerate(self.SCORE_BUCKETS):
+            if score <= bound:
+                self._scores[index] += 1
+                return
+
+    def lookup(self, fingerprint: Fingerprint, exists) -> Tuple[Optional[str], float]:
+        """
+        Melhor chave exata parecida (acima do threshold) e o score. `exists(key)`
+        confirma que a resposta ainda está no cache exato; entradas órfãs saem.
+        """
+        seen: Set[str] = set()
+        best_key, best_score = None, 0.0
+        for band in fingerprint.bands:
+            for key in self._buckets.get(band, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                entry = self._entries.get(key)
+                if entry is None or entry.fingerprint.scope != fingerprint.scope:
+                    continue
+                score = similarity(entry.fingerprint.signature, fingerprint.signature)
+                if score > best_score:
+                    best_key, best_score = key, score
+        self.candidates += len(seen)
+        if seen:
+            self._observe(best_score)
+        if best_key is not None and best_score >= self.threshold:
+            if exists(best_key):
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return best_key, best_score
+            self.stale += 1
+            self._remove(best_key)
+        self.misses += 1
+        return None, best_score
+
+    def add(self, key: str, fingerprint: Fingerprint):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = _Entry(key, fingerprint)
+        for band in fingerprint.bands:
+            self._buckets.setdefault(band, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in entry.fingerprint.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def snapshot(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        labels = [f"<={bound}" for bound in self.SCORE_BUCKETS]
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bins": self.bins,
+            "bands": self.bands,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "skipped": self.skipped,
+            "stale": self.stale,
+            "evicted": self.evicted,
+            "candidates_checked": self.candidates,
+            # Distribuição do melhor score por consulta com candidatas
+            "best_scores": {label: count for label, count in zip(labels, self._scores) if count},
+        }
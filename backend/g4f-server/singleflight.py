@@ -0,0 +1,152 @@
+"""
+Coalescência "single-flight" de completions idênticas em andamento.
+
+A primeira requisição (líder) dispara o upstream numa task própria; as que
+chegam enquanto ela está em voo se anexam ao mesmo buffer de chunks e recebem
+a mesma sequência (fan-out). Se todos os assinantes desistirem, o upstream é
+cancelado.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "1").lower() not in ("0", "false", "no")
+
+
+class Flight:
+    """Uma chamada upstream compartilhada: buffer de chunks + sinal de novidade"""
+
+    def __init__(self, key: str, group: "SingleFlight"):
+        self.key = key
+        self.parts: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Informações preenchidas pelo produtor (ex.: provider usado)
+        self.meta: Dict[str, object] = {}
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._group = group
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _run(self, source: AsyncIterator[str]):
+        try:
+            async for piece in source:
+                self.parts.append(piece)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("Requisição upstream cancelada")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._group._finish(self)
+            self._notify()
+
+    def subscribe(self) -> "Subscription":
+        """Itera a sequência completa de chunks, desde o primeiro, até o fim do upstream"""
+        return Subscription(self)
+
+
+class Subscription:
+    """
+    Um ouvinte de um `Flight`. Conta como assinante desde a criação (não só
+    quando começa a iterar), e `aclose()` desiste mesmo que nunca tenha
+    iterado: se era o último, o upstream é cancelado na hora.
+    """
+
+    def __init__(self, flight: Flight):
+        self._flight = flight
+        self._index = 0
+        self._closed = False
+        flight.subscribers += 1
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> str:
+        flight = self._flight
+        try:
+            while self._index >= len(flight.parts):
+                if self._closed:
+                    raise StopAsyncIteration
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    raise StopAsyncIteration
+                await flight._changed.wait()
+        except BaseException:
+            self.close()
+            raise
+        piece = flight.parts[self._index]
+        self._index += 1
+        return piece
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        flight = self._flight
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            flight._group._abandon(flight)
+
+    async def aclose(self):
+        self.close()
+
+
+class SingleFlight:
+    """Registro das chamadas em voo, indexadas pela chave canônica da requisição"""
+
+    def __init__(self, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def active(self, key: str) -> Optional[Flight]:
+        """Chamada em voo para a chave, se houver"""
+        flight = self._flights.get(key)
+        return flight if flight is not None and not flight.done else None
+
+    def join(self, key: str, factory: Callable[[Dict[str, object]], AsyncIterator[str]]) -> Tuple[Flight, bool]:
+        """
+        Retorna (flight, líder?). Só o líder chama `factory(meta)` para criar o
+        iterador de conteúdo do upstream, que passa a rodar numa task própria.
+        """
+        flight = self.active(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight, False
+
+        flight = Flight(key, self)
+        self._flights[key] = flight
+        self.started += 1
+        flight.task = asyncio.ensure_future(flight._run(factory(flight.meta)))
+        return flight, True
+
+    def _finish(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def _abandon(self, flight: Flight):
+        # Ninguém mais ouvindo: tira do registro já (novas chegadas começam outro voo)
+        self.abandoned += 1
+        self._finish(flight)
+        if flight.task is not None and not flight.task.done():
+            flight.task.cancel()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
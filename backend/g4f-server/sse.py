@@ -0,0 +1,114 @@
+"""
+Encoder SSE de baixo custo para `chat.completion.chunk`.
+
+O prefixo/sufixo fixo de cada frame é renderizado uma vez por stream; por
+chunk só o texto do delta é escapado (com orjson quando disponível). Deltas
+pequenos podem ser agrupados num único frame por bytes ou por janela de tempo.
+"""
+
+import json
+import os
+import time
+import uuid
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+# Agrupamento de deltas: envia quando acumular N bytes ou após N ms (0 = desligado)
+SSE_FLUSH_BYTES = int(os.environ.get("SSE_FLUSH_BYTES", "0"))
+SSE_FLUSH_MS = float(os.environ.get("SSE_FLUSH_MS", "0"))
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def dumps(value) -> bytes:
+    """Serializa para JSON compacto em bytes usando o backend mais rápido disponível"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def new_completion_id() -> str:
+    """Id no formato da OpenAI (`chatcmpl-` + sufixo aleatório), estável por resposta"""
+    return f"chatcmpl-{uuid.uuid4().hex}"
+
+
+class ChunkEncoder:
+    """Gera frames SSE de um stream; o id/created/model são fixos por stream"""
+
+    def __init__(
+        self,
+        model: Optional[str],
+        completion_id: Optional[str] = None,
+        created: Optional[int] = None,
+        flush_bytes: int = SSE_FLUSH_BYTES,
+        flush_ms: float = SSE_FLUSH_MS,
+    ):
+        self.completion_id = completion_id or new_completion_id()
+        self.created = created or int(time.time())
+        self.model = model or "auto"
+        self.flush_bytes = max(0, flush_bytes)
+        self.flush_window = max(0.0, flush_ms) / 1000.0
+
+        head = (
+            b'data: {"id":' + dumps(self.completion_id)
+            + b',"object":"chat.completion.chunk","created":' + str(self.created).encode()
+            + b',"model":' + dumps(self.model)
+        )
+        self._prefix = head + b',"choices":[{"index":0,"delta":{"content":'
+        self._suffix = b'},"finish_reason":null}]}\n\n'
+        self._final = head + b',"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}\n\n'
+        self._usage = head + b',"choices":[],"usage":'
+
+        self._buffer = []
+        self._buffered = 0
+        self._buffer_started = 0.0
+
+    @property
+    def coalescing(self) -> bool:
+        return self.flush_bytes > 0 or self.flush_window > 0
+
+    def frame(self, content: str) -> bytes:
+        return self._prefix + dumps(content) + self._suffix
+
+    def feed(self, content: str) -> Optional[bytes]:
+        """Recebe um delta; retorna um frame pronto ou None se ficou no buffer"""
+        if not self.coalescing:
+            return self.frame(content)
+        if not self._buffer:
+            self._buffer_started = time.perf_counter()
+        self._buffer.append(content)
+        self._buffered += len(content.encode("utf-8"))
+        if self.flush_bytes and self._buffered >= self.flush_bytes:
+            return self.flush()
+        if self.flush_window and time.perf_counter() - self._buffer_started >= self.flush_window:
+            return self.flush()
+        return None
+
+    def time_to_flush(self) -> Optional[float]:
+        """Segundos até a janela de tempo do buffer vencer (None se não há prazo pendente)"""
+        if not self._buffer or not self.flush_window:
+            return None
+        return max(0.0, self.flush_window - (time.perf_counter() - self._buffer_started))
+
+    def flush(self) -> Optional[bytes]:
+        if not self._buffer:
+            return None
+        content = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        return self.frame(content)
+
+    def final(self) -> bytes:
+        return self._final
+
+    def usage(self, usage: dict) -> bytes:
+        """Chunk final de uso (formato `stream_options.include_usage` da OpenAI)"""
+        return self._usage + dumps(usage) + b"}\n\n"
+
+    @staticmethod
+    def error(message: str, error_type: str = "server_error") -> bytes:
+        return b"data: " + dumps({"error": {"message": message, "type": error_type}}) + b"\n\n"
@@ -0,0 +1,140 @@
+"""
+Inicialização rápida: o g4f (e todos os seus providers) é importado sob
+demanda e aquecido em segundo plano, com o tempo de cada fase registrado.
+
+O servidor abre a porta sem esperar o import; `/ready` só passa quando o
+cliente e o catálogo estão prontos.
+
+Com FAKE_PROVIDER=1 os providers falsos de `fake_provider` são somados aos do
+g4f; com FAKE_PROVIDER=only substituem o g4f (servidor totalmente offline).
+"""
+
+import asyncio
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from fake_provider import FAKE_PROVIDER, FakeClient, FakeModelUtils, parse_profiles
+
+logger = logging.getLogger("g4f-server")
+
+# Início do processo (aproximado pelo primeiro import deste módulo)
+PROCESS_STARTED = time.perf_counter()
+
+_g4f = None
+_client = None
+
+
+class _G4F:
+    """Referências do g4f resolvidas uma única vez"""
+
+    def __init__(self):
+        import g4f
+        from g4f.client import AsyncClient
+        from g4f.models import ModelUtils
+        from g4f.Provider import __providers__
+        self.module = g4f
+        self.AsyncClient = AsyncClient
+        self.ModelUtils = ModelUtils
+        self.providers = __providers__
+
+
+class _FakeG4F:
+    """Substituto do g4f quando FAKE_PROVIDER=only"""
+
+    module = None
+    ModelUtils = FakeModelUtils
+
+    def __init__(self):
+        self.providers = parse_profiles()
+
+    def AsyncClient(self):
+        return FakeClient(self.providers)
+
+
+_fakes = parse_profiles() if FAKE_PROVIDER in ("1", "true", "yes") else []
+
+
+def g4f_modules() -> _G4F:
+    """Importa o g4f na primeira chamada (pesado: carrega todos os providers)"""
+    global _g4f
+    if _g4f is None:
+        _g4f = _FakeG4F() if FAKE_PROVIDER == "only" else _G4F()
+    return _g4f
+
+
+def g4f_version() -> Optional[str]:
+    """Versão do g4f se já importado (não dispara o import)"""
+    if FAKE_PROVIDER == "only":
+        return "fake"
+    module = sys.modules.get("g4f")
+    return getattr(module, "__version__", "unknown") if module is not None else None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        client = g4f_modules().AsyncClient()
+        # Chamadas aos providers falsos não passam pelo cliente do g4f
+        _client = FakeClient(_fakes, inner=client) if _fakes else client
+    return _client
+
+
+def get_providers():
+    providers = g4f_modules().providers
+    return list(providers) + _fakes if _fakes else providers
+
+
+def get_model(name: str):
+    return g4f_modules().ModelUtils.get_model(name) or FakeModelUtils.get_model(name)
+
+
+class StartupTracker:
+    """Fases da inicialização (duração de cada uma) e o sinal de prontidão"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None
+        # True enquanto o aquecimento em segundo plano está em andamento
+        self.warming = False
+        self._ready = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def mark_ready(self):
+        self.ready_after = time.perf_counter() - PROCESS_STARTED
+        self._ready.set()
+        logger.info("[G4F] Pronto em %.3fs (%s)", self.ready_after,
+                    ", ".join(f"{name}={seconds:.3f}s" for name, seconds in self.phases.items()))
+
+    async def wait(self, timeout: float) -> bool:
+        """Aguarda o aquecimento até `timeout` segundos; retorna se ficou pronto"""
+        if self.ready:
+            return True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "ready": self.ready,
+            "uptime": time.perf_counter() - PROCESS_STARTED,
+            "ready_after": self.ready_after,
+            "phases": dict(self.phases),
+            "error": self.error,
+        }
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Servidor sem g4f: só os providers falsos (FakeA rápido, FakeB lento)
+os.environ.setdefault("FAKE_PROVIDER", "only")
+os.environ.setdefault("FAKE_PROVIDERS", "FakeA=0.01/1000/0,FakeB=2/1000/0")
+os.environ.setdefault("FAKE_RESPONSE_TOKENS", "8")
+os.environ.setdefault("JOBS_ENABLED", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
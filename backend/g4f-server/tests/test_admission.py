@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+from admission import AdmissionController, release_after
+
+
+async def _pieces():
+    yield "a"
+    yield "b"
+
+
+def _in_use(controller: AdmissionController) -> int:
+    return controller.snapshot()["global"]["in_use"]
+
+
+def test_aclose_releases_slot_never_iterated():
+    async def run():
+        controller = AdmissionController()
+        guard = release_after(_pieces(), await controller.admit("FakeA"))
+        assert _in_use(controller) == 1
+        await guard.aclose()
+        return controller
+
+    assert _in_use(asyncio.run(run())) == 0
+
+
+def test_exhausted_guard_releases_slot():
+    async def run():
+        controller = AdmissionController()
+        guard = release_after(_pieces(), await controller.admit("FakeA"))
+        assert [piece async for piece in guard] == ["a", "b"]
+        return controller
+
+    assert _in_use(asyncio.run(run())) == 0
+
+
+def test_client_gone_before_body_releases_slot():
+    """Cliente sai antes de o corpo ser iterado: o `finally` do gerador nunca roda"""
+
+    async def run():
+        controller = AdmissionController()
+        contents = release_after(_pieces(), await controller.admit("FakeA"))
+        response = main.UpstreamStreamingResponse(
+            main.stream_chat_response(contents, None, None, None), upstream=contents,
+            media_type="text/event-stream"
+        )
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise OSError("cliente desconectado")
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.3"}}
+        with pytest.raises(OSError):
+            await response(scope, receive, send)
+        return controller
+
+    assert _in_use(asyncio.run(run())) == 0
+
+
+def test_client_gone_before_body_cancels_coalesced_upstream():
+    """Pelo endpoint, com coalescência: o upstream é cancelado e a vaga liberada na hora"""
+    assert main.coalescer.enabled
+    body = json.dumps({
+        "provider": "FakeB", "stream": True, "cache": False,
+        "messages": [{"role": "user", "content": "sai antes do corpo"}],
+    }).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/v1/chat/completions", "raw_path": b"/v1/chat/completions",
+        "query_string": b"", "root_path": "", "client": ("test", 1), "server": ("test", 80),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("cliente desconectado")
+
+    async def run():
+        with pytest.raises(OSError):
+            await main.app(scope, receive, send)
+        # O cancelamento do upstream (FakeB leva 2 s) só precisa de algumas voltas do loop
+        await asyncio.sleep(0.1)
+        return main.admission.snapshot()["global"]["in_use"], main.coalescer.snapshot()
+
+    in_use, flights = asyncio.run(run())
+    assert in_use == 0
+    assert flights["in_flight"] == 0 and flights["abandoned"] >= 1
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+import breaker
+import main
+from breaker import HALF_OPEN, CircuitBreaker
+
+
+def _provider(name):
+    return next(p for p in main.get_providers() if p.__name__ == name)
+
+
+def _half_open(provider) -> CircuitBreaker:
+    """Força o circuito do provider a meio-aberto (aberto com o tempo de abertura já vencido)"""
+    state = main.breakers.get(provider)
+    state._trip(time.monotonic() - state.open_for, backoff=False)
+    assert state.available() and state.state == HALF_OPEN
+    return state
+
+
+async def _drain(stream):
+    return [piece async for piece in stream]
+
+
+def test_release_returns_half_open_probe():
+    state = CircuitBreaker("x")
+    state._trip(time.monotonic() - state.open_for, backoff=False)
+    assert state.acquire()
+    assert not state.available()
+    state.release()
+    assert state.available() and state.state == HALF_OPEN
+
+
+def test_stale_half_open_probe_expires(monkeypatch):
+    state = CircuitBreaker("x")
+    state._trip(time.monotonic() - state.open_for, backoff=False)
+    assert state.acquire()
+    monkeypatch.setattr(breaker, "BREAKER_PROBE_TIMEOUT", 0.0)
+    assert state.available()
+
+
+def test_hedge_loser_releases_half_open_probe():
+    fast, slow = _provider("FakeA"), _provider("FakeB")
+    state = _half_open(slow)
+    pieces = asyncio.run(_drain(main.upstream_stream(
+        model=None,
+        messages=[{"role": "user", "content": "oi"}],
+        provider=fast,
+        hedge_providers=[fast, slow],
+        hedge_delay=0,
+    )))
+    assert pieces
+    # FakeB perdeu a corrida: foi cancelado sem resultado e continua podendo receber a chamada de teste
+    assert state.state == HALF_OPEN
+    assert state.probes == 0
+    assert state.available()
+
+
+def test_stream_closed_early_releases_half_open_probe():
+    slow = _provider("FakeB")
+    state = _half_open(slow)
+    slow_latency, slow.latency = slow.latency, 0.01
+
+    async def read_one_and_close():
+        stream = main.upstream_stream(model=None, messages=[{"role": "user", "content": "oi"}], provider=slow)
+        await stream.__anext__()
+        await stream.aclose()
+
+    try:
+        asyncio.run(read_one_and_close())
+    finally:
+        slow.latency = slow_latency
+    assert state.state == HALF_OPEN
+    assert state.probes == 0
+
+
+def _gate(name):
+    return main.admission.gate(name)
+
+
+def _count_calls(monkeypatch, provider):
+    calls = []
+    original = provider.create_async_generator
+
+    def counting(model, messages, **kwargs):
+        calls.append(model)
+        return original(model, messages, **kwargs)
+
+    monkeypatch.setattr(provider, "create_async_generator", staticmethod(counting))
+    return calls
+
+
+def test_hedge_extra_holds_its_own_provider_gate():
+    fast, slow = _provider("FakeA"), _provider("FakeB")
+    gate = _gate("FakeB")
+    admitted = gate.admitted
+
+    async def run():
+        stream = main.upstream_stream(model=None, messages=[{"role": "user", "content": "gate"}],
+                                      provider=fast, hedge_providers=[fast, slow], hedge_delay=0)
+        # FakeB entra na corrida com vaga própria e a devolve ao perder
+        return [piece async for piece in stream]
+
+    assert asyncio.run(run())
+    assert gate.admitted == admitted + 1
+    assert gate.in_use == 0
+
+
+def test_hedge_extra_skipped_when_its_provider_is_full(monkeypatch):
+    fast, slow = _provider("FakeA"), _provider("FakeB")
+    calls = _count_calls(monkeypatch, slow)
+    gate = _gate("FakeB")
+    in_use, gate.in_use = gate.in_use, gate.limit
+    admitted = gate.admitted
+    try:
+        assert asyncio.run(_drain(main.upstream_stream(
+            model=None, messages=[{"role": "user", "content": "cheio"}],
+            provider=fast, hedge_providers=[fast, slow], hedge_delay=0,
+        )))
+        assert gate.admitted == admitted and gate.in_use == gate.limit
+        assert calls == []
+    finally:
+        gate.in_use = in_use
+
+
+def test_fallback_skipped_when_its_provider_is_full(monkeypatch):
+    failing, fallback = _provider("FakeA"), _provider("FakeB")
+    monkeypatch.setattr(failing, "failure_rate", 1.0)
+    # As falhas forçadas não podem abrir o circuito de FakeA para os outros testes
+    monkeypatch.setattr(main.breakers, "_breakers", {})
+    calls = _count_calls(monkeypatch, fallback)
+    gate = _gate("FakeB")
+    in_use, gate.in_use = gate.in_use, gate.limit
+    admitted = gate.admitted
+    try:
+        for upstream in (main.upstream_complete, main.upstream_stream):
+            try:
+                asyncio.run(_drain(upstream(model=None, messages=[{"role": "user", "content": "fallback"}],
+                                            provider=failing, fallbacks=[fallback])))
+            except Exception:
+                pass
+            assert gate.admitted == admitted and gate.in_use == gate.limit
+        assert calls == []
+    finally:
+        gate.in_use = in_use
@@ -0,0 +1,45 @@
+import asyncio
+import gc
+
+import main
+from image_store import BlobStore
+
+
+def test_failed_image_flight_without_clients_is_retrieved(monkeypatch):
+    """Cliente cai, a geração protegida pelo shield falha depois: ninguém espera, mas a exceção é lida"""
+
+    async def failing_generation(request, model, dimensions, key):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("provider caiu")
+
+    monkeypatch.setattr(main, "_generate_images", failing_generation)
+    unretrieved = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        request = main.ImageGenerationRequest(prompt="flight", model="flux")
+        with_timeout = asyncio.wait_for(main.image_generations(request), 0.01)
+        try:
+            await with_timeout
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.1)
+        assert main._image_flights == {}
+        gc.collect()
+
+    asyncio.run(run())
+    gc.collect()
+    assert unretrieved == []
+
+
+def test_blob_write_leaves_the_index_to_the_event_loop(tmp_path):
+    """`write` roda numa thread: só grava o arquivo; índice e despejo ficam com `add`"""
+    store = BlobStore(str(tmp_path), max_bytes=10)
+    name, size = store.write(b"\x89PNG" + b"a" * 4)
+    assert store.snapshot()["blobs"] == 0 and store.path(name) is None
+    assert store.add(name, size) == name and store.path(name) is not None
+
+    other = store.put(b"\x89PNG" + b"b" * 4)
+    # Passou do limite: o mais antigo sai do índice e do disco
+    assert store.path(name) is None and store.path(other) is not None
+    assert store.snapshot()["evicted"] == 1
@@ -0,0 +1,30 @@
+import asyncio
+
+import main
+from multiplex import StreamMux, _Stream
+
+
+def test_cancel_while_start_is_queued_releases_slot(monkeypatch):
+    """Cliente lento (fila de saída cheia) cancela antes do "start" sair: o upstream nunca foi lido"""
+    monkeypatch.setattr(main.coalescer, "enabled", False)
+    payload = {"provider": "FakeB", "cache": False, "messages": [{"role": "user", "content": "ws lento"}]}
+
+    async def run():
+        mux = StreamMux(websocket=None, open_stream=main._ws_open_stream, queue_size=1)
+        mux.outbox.put_nowait(b"{}")
+        stream = _Stream("s1", mux.window)
+        mux.streams["s1"] = stream
+        stream.task = asyncio.ensure_future(mux._pump(stream, payload))
+        while main.admission.snapshot()["global"]["in_use"] == 0:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        stream.cancelled = True
+        stream.task.cancel()
+        # O escritor da conexão volta a esvaziar a fila (para o aviso de "cancelled" sair)
+        while not stream.task.done():
+            while not mux.outbox.empty():
+                mux.outbox.get_nowait()
+            await asyncio.sleep(0.01)
+        return main.admission.snapshot()["global"]["in_use"]
+
+    assert asyncio.run(run()) == 0
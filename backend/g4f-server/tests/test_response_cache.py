@@ -0,0 +1,28 @@
+import asyncio
+
+import httpx
+
+import main
+
+
+def test_similar_hit_counts_once(monkeypatch):
+    """Uma quase-duplicata servida do cache conta um hit, não um miss e um hit"""
+    monkeypatch.setattr(main.similar_cache, "enabled", True)
+
+    async def ask(client, question):
+        response = await client.post("/v1/chat/completions", json={
+            "provider": "FakeA", "messages": [{"role": "user", "content": question}],
+        })
+        return response.headers["x-cache"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert await ask(client, "Como inverter uma lista em Python?") == "MISS"
+            before = main.response_cache.snapshot()
+            assert await ask(client, "como inverter uma lista em python") == "SIMILAR"
+            return before, main.response_cache.snapshot()
+
+    before, after = asyncio.run(run())
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
@@ -0,0 +1,38 @@
+import gzip
+
+from starlette.requests import Request
+
+import encoded
+import main
+from catalog import Catalog
+from encoded import encoded_response
+from shared_catalog import SnapshotStore
+
+
+def _request(accept_encoding: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/v1/models",
+                    "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+def test_worker_serves_listings_from_the_mapped_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(encoded, "ENCODED_MIN_BYTES", 0)
+    path = str(tmp_path / "catalog.snapshot")
+    leader = Catalog(main.get_providers, main.get_model, 300, store=SnapshotStore(path))
+    built = leader.refresh()
+    worker = Catalog(main.get_providers, main.get_model, 300, store=SnapshotStore(path))
+    try:
+        adopted = worker.get()
+        assert not worker._store.leader and adopted.version == built.version
+        # Corpos são fatias do arquivo mapeado, não cópias decodificadas
+        body = adopted.encoded["providers"]
+        assert isinstance(body.identity, memoryview) and isinstance(body.variants["gzip"], memoryview)
+        assert body.etag == built.encoded["providers"].etag
+        assert adopted._payloads == {}
+
+        response = encoded_response(_request("gzip"), body)
+        assert response.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(bytes(response.body)) == bytes(built.encoded["providers"].identity)
+        assert adopted.providers_payload == built.providers_payload
+        assert adopted.find_provider("FakeA") is built.find_provider("FakeA")
+    finally:
+        leader._store.release()
@@ -0,0 +1,27 @@
+import asyncio
+
+import httpx
+
+import main
+
+
+def test_stream_and_complete_do_not_share_a_flight():
+    """Um stream não pode seguir uma chamada não-stream (nem o contrário): formatos diferentes"""
+    body = {"provider": "FakeB", "cache": False, "messages": [{"role": "user", "content": "singleflight"}]}
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json={**body, "stream": stream})
+                for stream in (False, True, False, True)
+            ])
+
+    complete, stream, complete_follower, stream_follower = asyncio.run(run())
+    assert [r.headers["x-coalesced"] for r in (complete, stream, complete_follower, stream_follower)] == [
+        "leader", "leader", "follower", "follower"
+    ]
+    assert complete.json()["object"] == "chat.completion"
+    assert complete_follower.json()["choices"] == complete.json()["choices"]
+    assert stream.headers["content-type"].startswith("text/event-stream")
+    assert stream_follower.text.rstrip().endswith("data: [DONE]")
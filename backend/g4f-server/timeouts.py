@@ -0,0 +1,98 @@
+"""
+Timeouts do upstream em streaming.
+
+Cada stream de provider é embrulhado com quatro limites: conexão (primeiro
+evento de qualquer tipo), primeiro token (primeiro chunk com texto), ociosidade
+entre chunks e tempo total. Estourar qualquer um deles gera um
+`UpstreamTimeout` que diz qual fase falhou, e o stream de origem é fechado na
+hora.
+
+Chamadas não-streaming só têm o limite total (UPSTREAM_TOTAL_TIMEOUT): o g4f
+devolve a resposta pronta, sem eventos de conexão ou de primeiro token.
+"""
+
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Callable
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "20"))
+UPSTREAM_FIRST_TOKEN_TIMEOUT = float(os.environ.get("UPSTREAM_FIRST_TOKEN_TIMEOUT", "60"))
+UPSTREAM_IDLE_TIMEOUT = float(os.environ.get("UPSTREAM_IDLE_TIMEOUT", "30"))
+UPSTREAM_TOTAL_TIMEOUT = float(os.environ.get("UPSTREAM_TOTAL_TIMEOUT", "300"))
+
+_PHASES = {
+    "connect": "conexão",
+    "first_token": "primeiro token",
+    "idle": "ociosidade entre chunks",
+    "total": "tempo total",
+}
+
+
+class UpstreamTimeout(TimeoutError):
+    """Timeout de uma fase do upstream (connect, first_token, idle ou total)"""
+
+    def __init__(self, phase: str, seconds: float):
+        super().__init__(f"Timeout de {_PHASES.get(phase, phase)} do provider ({seconds:g}s)")
+        self.phase = phase
+        self.seconds = seconds
+
+
+async def close_stream(stream) -> None:
+    """Fecha um iterador assíncrono (se suportar) ignorando erros do próprio fechamento"""
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception:
+            pass
+
+
+async def with_timeouts(
+    stream: AsyncIterator,
+    has_content: Callable[[object], bool],
+    connect: float = UPSTREAM_CONNECT_TIMEOUT,
+    first_token: float = UPSTREAM_FIRST_TOKEN_TIMEOUT,
+    idle: float = UPSTREAM_IDLE_TIMEOUT,
+    total: float = UPSTREAM_TOTAL_TIMEOUT,
+) -> AsyncIterator:
+    """Repassa os chunks de `stream` aplicando os limites (0 desliga um limite)"""
+    iterator = stream.__aiter__()
+    started = time.monotonic()
+    last = started
+    seen_any = seen_content = False
+    try:
+        while True:
+            now = time.monotonic()
+            if not seen_any:
+                phase, limit, since = "connect", connect, started
+            elif not seen_content:
+                phase, limit, since = "first_token", first_token, started
+            else:
+                phase, limit, since = "idle", idle, last
+            budget = limit - (now - since) if limit > 0 else None
+            if total > 0:
+                remaining = total - (now - started)
+                if budget is None or remaining < budget:
+                    phase, limit, budget = "total", total, remaining
+            if budget is not None and budget <= 0:
+                raise UpstreamTimeout(phase, limit)
+
+            waited_from = time.monotonic()
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=budget)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                # Distingue o nosso limite de um TimeoutError levantado pelo próprio provider
+                if budget is not None and time.monotonic() - waited_from >= budget * 0.99:
+                    raise UpstreamTimeout(phase, limit) from None
+                raise
+
+            last = time.monotonic()
+            seen_any = True
+            if not seen_content and has_content(chunk):
+                seen_content = True
+            yield chunk
+    finally:
+        await close_stream(iterator)
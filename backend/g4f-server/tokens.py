@@ -0,0 +1,206 @@
+"""
+Contagem de tokens local (sem rede) para o bloco `usage`.
+
+Tokenizers são plugáveis por família de modelo. Quando o `tiktoken` está
+instalado e as tabelas BPE já estão no disco (TIKTOKEN_CACHE_DIR, populado no
+build da imagem), a contagem é exata para as famílias OpenAI e uma boa
+aproximação para as demais; caso contrário usa-se um estimador baseado na
+mesma pré-tokenização. Contagens de textos repetidos (ex.: system prompts)
+são memoizadas e streams são contados incrementalmente.
+"""
+
+import logging
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("g4f-server")
+
+# auto | tiktoken | heuristic
+TOKENIZER = os.environ.get("TOKENIZER", "auto").lower()
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "8192"))
+# Só textos curtos (system prompts, mensagens repetidas) entram no cache; respostas longas quase
+# nunca se repetem e ficariam presas na memória
+TOKEN_CACHE_MAX_CHARS = int(os.environ.get("TOKEN_CACHE_MAX_CHARS", "2048"))
+
+# Overhead do formato de chat da OpenAI: por mensagem e para o início da resposta
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMING = 3
+
+# Pré-tokenização no estilo cl100k (letras, números de até 3 dígitos, pontuação, espaços)
+_PRETOKEN = re.compile(
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+
+class HeuristicTokenizer:
+    """Estimador: pré-tokeniza como o BPE e estima sub-palavras pelo tamanho de cada pedaço"""
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        total = 0
+        for piece in _PRETOKEN.findall(text):
+            word = piece.strip()
+            if not word:
+                total += 1
+            elif word.isascii():
+                # Palavras comuns curtas viram 1 token; longas quebram a cada ~4 caracteres
+                total += 1 + max(0, len(word) - 6) // 4
+            else:
+                # Acentos/CJK custam mais bytes por caractere no BPE
+                total += max(1, math.ceil(len(word.encode("utf-8")) / 3))
+        return total
+
+
+class TiktokenTokenizer:
+    """BPE exato via tiktoken (só usado com as tabelas já em cache local)"""
+
+    def __init__(self, encoding_name: str):
+        import tiktoken
+        self.name = encoding_name
+        self._encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode_ordinary(text))
+
+
+# Família do modelo → encoding BPE. Famílias não-OpenAI usam cl100k como aproximação.
+MODEL_FAMILIES: List[Tuple[str, str]] = [
+    ("gpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("gpt-5", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+]
+DEFAULT_ENCODING = "cl100k_base"
+
+_factories: Dict[str, Callable[[], object]] = {}
+_instances: Dict[str, object] = {}
+_heuristic = HeuristicTokenizer()
+
+
+def register_tokenizer(name: str, factory: Callable[[], object]):
+    """Registra um tokenizer (objeto com `name` e `count(text)`) sob um nome de encoding"""
+    _factories[name] = factory
+    _instances.pop(name, None)
+
+
+def _tiktoken_available() -> bool:
+    # Sem tabelas em cache o tiktoken baixaria da internet: nesse caso não usamos
+    if TOKENIZER == "heuristic":
+        return False
+    if TOKENIZER != "tiktoken" and not os.environ.get("TIKTOKEN_CACHE_DIR"):
+        return False
+    try:
+        import tiktoken  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _load(encoding_name: str):
+    tokenizer = _instances.get(encoding_name)
+    if tokenizer is not None:
+        return tokenizer
+    factory = _factories.get(encoding_name)
+    try:
+        if factory is not None:
+            tokenizer = factory()
+        elif _tiktoken_available():
+            tokenizer = TiktokenTokenizer(encoding_name)
+    except Exception as e:
+        logger.warning("Tokenizer '%s' indisponível (%s); usando estimativa", encoding_name, e)
+        tokenizer = None
+    tokenizer = tokenizer or _heuristic
+    _instances[encoding_name] = tokenizer
+    return tokenizer
+
+
+def encoding_for(model: Optional[str]) -> str:
+    name = (model or "").lower()
+    if "/" in name:
+        name = name.rsplit("/", 1)[1]
+    for prefix, encoding in MODEL_FAMILIES:
+        if name.startswith(prefix):
+            return encoding
+    return DEFAULT_ENCODING
+
+
+def tokenizer_for(model: Optional[str]):
+    return _load(encoding_for(model))
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _count_memo(encoding_name: str, text: str) -> int:
+    return _load(encoding_name).count(text)
+
+
+def _count_cached(encoding_name: str, text: str) -> int:
+    """Contagem com cache limitado a textos de até TOKEN_CACHE_MAX_CHARS (memória limitada por entrada)"""
+    if len(text) > TOKEN_CACHE_MAX_CHARS:
+        return _load(encoding_name).count(text)
+    return _count_memo(encoding_name, text)
+
+
+def count_text(text: Optional[str], model: Optional[str] = None) -> int:
+    """Tokens de um texto; textos curtos repetidos (system prompts, histórico) vêm da memória"""
+    if not text:
+        return 0
+    return _count_cached(encoding_for(model), text)
+
+
+def _message_tokens(encoding: str, message: Dict[str, str]) -> int:
+    content = message.get("content") or ""
+    return (TOKENS_PER_MESSAGE + _count_cached(encoding, message.get("role", ""))
+            + (_count_cached(encoding, content) if content else 0))
+
+
+def count_message(message: Dict[str, str], model: Optional[str] = None) -> int:
+    """Tokens de uma mensagem (conteúdo + papel + overhead), sem o priming da resposta"""
+    return _message_tokens(encoding_for(model), message)
+
+
+def count_messages(messages: Iterable[Dict[str, str]], model: Optional[str] = None) -> int:
+    """Tokens de prompt no formato de chat (conteúdo + papéis + overhead por mensagem)"""
+    encoding = encoding_for(model)
+    return TOKENS_REPLY_PRIMING + sum(_message_tokens(encoding, message) for message in messages)
+
+
+def usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class StreamCounter:
+    """
+    Conta tokens de um stream à medida que os deltas chegam. Só o trecho após o
+    último espaço fica pendente (uma palavra pode continuar no próximo delta);
+    o restante é contado e descartado, então o custo é linear no texto.
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self._tokenizer = tokenizer_for(model)
+        self._tail = ""
+        self.committed = 0
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        self._tail += text
+        cut = max(self._tail.rfind(" "), self._tail.rfind("\n"))
+        if cut > 0:
+            self.committed += self._tokenizer.count(self._tail[:cut])
+            self._tail = self._tail[cut:]
+
+    @property
+    def total(self) -> int:
+        return self.committed + (self._tokenizer.count(self._tail) if self._tail else 0)
@@ -0,0 +1,140 @@
+"""
+Spans de tempo por requisição.
+
+Uma fração das requisições da API (TRACE_SAMPLE_RATE, ou as que enviam o
+header `X-Trace: 1`) ganha um `Trace` num ContextVar. O código marca as
+fases com `span("nome")` (ou `record`/`add` para tempos já medidos); fora de
+uma requisição amostrada essas chamadas não fazem nada.
+
+O middleware devolve as fases concluídas até o início da resposta no header
+`Server-Timing` e, no fim do corpo, registra o trace completo numa linha de
+log JSON. Em streams o header só leva as fases anteriores ao primeiro byte
+(resolução, cache, fila...); TTFT e o tempo de stream aparecem no log.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger("g4f-server.trace")
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.05"))
+# Só rotas com estes prefixos são amostradas
+TRACE_PATHS = tuple(p.strip() for p in os.environ.get("TRACE_PATHS", "/v1/").split(",") if p.strip())
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("g4f_trace", default=None)
+
+
+class Trace:
+    """Fases (nome → segundos acumulados e nº de ocorrências) de uma requisição"""
+
+    __slots__ = ("trace_id", "started", "spans")
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans: Dict[str, Tuple[float, int]] = {}
+
+    def add(self, name: str, seconds: float):
+        total, count = self.spans.get(name, (0.0, 0))
+        self.spans[name] = (total + seconds, count + 1)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={total * 1000:.2f}" for name, (total, _) in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": round(self.elapsed() * 1000, 2),
+            "spans": {
+                name: {"ms": round(total * 1000, 2), "count": count} if count > 1 else round(total * 1000, 2)
+                for name, (total, count) in self.spans.items()
+            },
+        }
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def record(name: str, seconds: Optional[float]):
+    """Registra uma fase medida por fora (ex.: TTFT)"""
+    trace = _current.get()
+    if trace is not None and seconds is not None:
+        trace.add(name, seconds)
+
+
+class TracingMiddleware:
+    """Middleware ASGI: amostra, injeta `Server-Timing` e registra o trace ao fim do corpo"""
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE, paths: Tuple[str, ...] = TRACE_PATHS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.paths = paths
+
+    def _sampled(self, scope) -> bool:
+        if not scope["path"].startswith(self.paths):
+            return False
+        for name, value in scope.get("headers", ()):
+            if name == b"x-trace":
+                return value not in (b"0", b"false")
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._sampled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current.set(trace)
+        status = {"code": None, "logged": False}
+
+        def log():
+            if status["logged"]:
+                return
+            status["logged"] = True
+            entry = trace.to_dict()
+            entry.update(method=scope["method"], path=scope["path"], status=status["code"])
+            logger.info(json.dumps(entry, separators=(",", ":")))
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                headers.append((b"x-trace-id", trace.trace_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                log()
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            # Cliente desconectou no meio (ou erro): registra o que houve até ali
+            log()
+            _current.reset(token)